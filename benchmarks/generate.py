@@ -0,0 +1,133 @@
+# Synthetic transaction generator for benchmarks: writes a transactions CSV and an existing client accounts CSV
+# of any size, with a configurable mix of transaction types.
+# Run with: python -m benchmarks.generate --rows 1000000 --clients 10000 --output-dir data/
+import argparse
+import os
+import random
+
+# Disputes pick their deposit among this many most recent deposits, like real disputes arriving within a window
+# of the deposit. It also keeps the generator's memory flat however many rows are generated
+DISPUTE_WINDOW = 100000
+
+
+class TransactionMix:
+    """Shape of a generated transaction stream.
+    deposit_ratio: share of deposits among deposits and withdrawals.
+    dispute_rate: probability that a row disputes one of the recent deposits.
+    resolve_rate, chargeback_rate: probability that a row resolves, or charges back, an open dispute.
+    locked_ratio: share of existing client accounts that are locked.
+    edge_case_rate: probability that a row is a transaction the engine must ignore, a dispute of a recent
+    withdrawal or a dispute of a recent deposit naming another client."""
+
+    def __init__(self, deposit_ratio=0.6, dispute_rate=0.02, resolve_rate=0.01, chargeback_rate=0.005,
+                 locked_ratio=0.01, edge_case_rate=0.0):
+        if dispute_rate + resolve_rate + chargeback_rate + edge_case_rate >= 1:
+            raise ValueError("dispute, resolve, chargeback and edge case rates must leave room for deposits and "
+                             "withdrawals")
+        self.deposit_ratio = deposit_ratio
+        self.dispute_rate = dispute_rate
+        self.resolve_rate = resolve_rate
+        self.chargeback_rate = chargeback_rate
+        self.locked_ratio = locked_ratio
+        self.edge_case_rate = edge_case_rate
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def generate_transactions(rows, clients, mix=None, seed=0):
+    """Yield rows rows of transactions (type, client, txn, amount text) for client ids 1..clients"""
+    mix = mix or TransactionMix()
+    rng = random.Random(seed)
+    dispute_below = mix.dispute_rate
+    resolve_below = dispute_below + mix.resolve_rate
+    chargeback_below = resolve_below + mix.chargeback_rate
+    edge_case_below = chargeback_below + mix.edge_case_rate
+    recent_deposits = []
+    deposits = 0
+    recent_withdrawals = []
+    withdrawals = 0
+    open_disputes = []
+    for txn_id in range(1, rows + 1):
+        roll = rng.random()
+        if roll < dispute_below and recent_deposits:
+            client_id, deposit_txn = recent_deposits[rng.randrange(len(recent_deposits))]
+            open_disputes.append((client_id, deposit_txn))
+            yield "dispute", client_id, deposit_txn, ""
+        elif roll < chargeback_below and open_disputes:
+            client_id, deposit_txn = open_disputes.pop(rng.randrange(len(open_disputes)))
+            yield "resolve" if roll < resolve_below else "chargeback", client_id, deposit_txn, ""
+        elif chargeback_below <= roll < edge_case_below and recent_deposits:
+            if recent_withdrawals and rng.random() < 0.5:
+                client_id, withdrawal_txn = recent_withdrawals[rng.randrange(len(recent_withdrawals))]
+                yield "dispute", client_id, withdrawal_txn, ""
+            else:
+                client_id, deposit_txn = recent_deposits[rng.randrange(len(recent_deposits))]
+                yield "dispute", client_id % clients + 1, deposit_txn, ""
+        else:
+            client_id = rng.randint(1, clients)
+            amount = f"{rng.randint(1, 1000000) / 10000:.4f}"
+            if rng.random() < mix.deposit_ratio:
+                if deposits < DISPUTE_WINDOW:
+                    recent_deposits.append((client_id, txn_id))
+                else:
+                    recent_deposits[deposits % DISPUTE_WINDOW] = (client_id, txn_id)
+                deposits += 1
+                yield "deposit", client_id, txn_id, amount
+            else:
+                if withdrawals < DISPUTE_WINDOW:
+                    recent_withdrawals.append((client_id, txn_id))
+                else:
+                    recent_withdrawals[withdrawals % DISPUTE_WINDOW] = (client_id, txn_id)
+                withdrawals += 1
+                yield "withdraw", client_id, txn_id, amount
+
+
+def write_transactions(path, rows, clients, mix=None, seed=0):
+    """Write a generated transactions CSV to path"""
+    with open(path, "w") as output:
+        output.write("type,client,txn,amount\n")
+        output.writelines(f"{txn_type},{client_id},{txn_id},{amount}\n"
+                          for txn_type, client_id, txn_id, amount in generate_transactions(rows, clients, mix, seed))
+
+
+def write_client_accounts(path, clients, mix=None, seed=0):
+    """Write an existing client accounts CSV to path with an account for every other client id,
+    mix.locked_ratio of them locked"""
+    mix = mix or TransactionMix()
+    rng = random.Random(seed)
+    with open(path, "w") as output:
+        output.write("client,available,held,total,locked\n")
+        for client_id in range(1, clients + 1, 2):
+            available = rng.randint(0, 10000000) / 10000
+            locked = 1 if rng.random() < mix.locked_ratio else 0
+            output.write(f"{client_id},{available:.4f},0.0000,{available:.4f},{locked}\n")
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Generate a synthetic transactions CSV and client accounts CSV")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=".")
+    add_mix_arguments(parser)
+    args = parser.parse_args()
+    mix = mix_from_arguments(args)
+    write_transactions(os.path.join(args.output_dir, "transactions.csv"), args.rows, args.clients, mix, args.seed)
+    write_client_accounts(os.path.join(args.output_dir, "clients_existing_accounts_balances.csv"), args.clients,
+                          mix, args.seed)
+
+
+def add_mix_arguments(parser):
+    """Command line options for every TransactionMix setting"""
+    defaults = TransactionMix()
+    for name, value in defaults.as_dict().items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=value)
+
+
+def mix_from_arguments(args):
+    return TransactionMix(**{name: getattr(args, name) for name in TransactionMix().as_dict()})
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,258 @@
+# Differential replay of a transactions log through two engine configurations. Both run in a fresh process,
+# their final account states are compared and, when they differ, prefixes of the log are replayed to find the
+# first transaction after which they diverge. Throughput and peak memory of both are reported side by side.
+# Run with: python -m benchmarks.replay --rows 1000000 --clients 10000 --baseline streaming --candidate scan_kernel
+# or replay a recorded log: python -m benchmarks.replay --transactions log.csv --accounts accounts.csv ...
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import tempfile
+from itertools import islice
+from benchmarks.generate import add_mix_arguments, mix_from_arguments, write_client_accounts, write_transactions
+from benchmarks.run_benchmarks import MODES, git_commit, run_isolated, run_once
+from src.binary_format import (TRANSACTION_COLUMNS, TRANSACTIONS_MAGIC, map_columns, transaction_fields,
+                               write_transactions as write_binary_transactions)
+from src.decoding import RecordBatch
+from src.txn_index import RetentionPolicy
+
+# Differing clients listed in a report
+MAX_DIFFERENCES = 20
+
+
+def engine_options(configuration):
+    """PaymentEngine keyword arguments of a configuration: a MODES name or a JSON object of keyword arguments,
+    where retention may be given as a JSON object of RetentionPolicy fields"""
+    if configuration in MODES:
+        return dict(MODES[configuration])
+    options = json.loads(configuration)
+    if isinstance(options.get("retention"), dict):
+        options["retention"] = RetentionPolicy(**options["retention"])
+    return options
+
+
+def diff_states(baseline, candidate):
+    """Compare lists of (client id, state) pairs. Returns (ids of the clients whose state differs or that only
+    one side has, whether the clients are in a different order)"""
+    baseline_states, candidate_states = dict(baseline), dict(candidate)
+    differing = sorted(client_id for client_id in baseline_states.keys() | candidate_states.keys()
+                       if baseline_states.get(client_id) != candidate_states.get(client_id))
+    order_differs = [client_id for client_id, _ in baseline] != [client_id for client_id, _ in candidate]
+    return differing, order_differs
+
+
+def count_rows(transactions, input_format):
+    """Number of rows of a transactions file"""
+    if input_format == "binary":
+        return map_columns(transactions, TRANSACTIONS_MAGIC, TRANSACTION_COLUMNS)[0]
+    with open(transactions, "rb") as input_file:
+        return max(sum(1 for _ in input_file) - 1, 0)
+
+
+def binary_rows(transactions, start, stop):
+    """RecordBatch of rows start to stop of a binary transactions file"""
+    _, columns = map_columns(transactions, TRANSACTIONS_MAGIC, TRANSACTION_COLUMNS)
+    return RecordBatch(*(columns[name][start:stop] for name in ("type", "client", "txn", "amount", "with_amount")))
+
+
+def write_prefix(transactions, input_format, rows, path):
+    """Write the first rows rows of a transactions file to path, in the same format"""
+    if input_format == "binary":
+        write_binary_transactions(path, [binary_rows(transactions, 0, rows)])
+    else:
+        with open(transactions, "rb") as input_file, open(path, "wb") as output:
+            output.writelines(islice(input_file, rows + 1))
+
+
+def transaction_at(transactions, input_format, row):
+    """Fields of given row (counted from 1) of a transactions file"""
+    if input_format == "binary":
+        return transaction_fields(binary_rows(transactions, row - 1, row), 0)
+    with open(transactions, newline="") as input_file:
+        return next(islice(csv.reader(input_file), row, None))
+
+
+def error_summary(error):
+    """Text of an error a configuration failed with"""
+    return f"{type(error).__name__}: {error}"
+
+
+def diverged(baseline, candidate):
+    """Whether the outcomes of two runs, lists of (client id, state) pairs or the error text of a failed run,
+    differ. Runs failing with the same error don't"""
+    if isinstance(baseline, str) or isinstance(candidate, str):
+        return baseline != candidate
+    return bool(diff_states(baseline, candidate)[0])
+
+
+def first_divergence(transactions, accounts, input_format, baseline, candidate, rows, work_dir):
+    """Bisect prefixes of the log for the first row after which the two configurations' account states differ,
+    or only one of them fails. Assumes states that have diverged stay diverged, a later row that hides a
+    divergence may hide an earlier one. Returns a dict with the row, its transaction and the differing states
+    after it, or the error of the configuration failing after it"""
+    def outcome(path, options):
+        try:
+            return run_once(path, accounts, options, states=True)["states"]
+        except Exception as e:
+            return error_summary(e)
+
+    def outcomes_after(prefix_rows):
+        path = os.path.join(work_dir, f"prefix_{prefix_rows}")
+        write_prefix(transactions, input_format, prefix_rows, path)
+        try:
+            return [outcome(path, options) for options in (baseline, candidate)]
+        finally:
+            os.remove(path)
+
+    equal_rows, differing_rows = 0, rows
+    while differing_rows - equal_rows > 1:
+        middle = (equal_rows + differing_rows) // 2
+        if diverged(*outcomes_after(middle)):
+            differing_rows = middle
+        else:
+            equal_rows = middle
+    divergence = {"row": differing_rows, "transaction": transaction_at(transactions, input_format, differing_rows)}
+    baseline_outcome, candidate_outcome = outcomes_after(differing_rows)
+    for name, result in (("baseline", baseline_outcome), ("candidate", candidate_outcome)):
+        if isinstance(result, str):
+            divergence[f"{name}_error"] = result
+    if "baseline_error" in divergence or "candidate_error" in divergence:
+        divergence["clients"] = []
+        return divergence
+    baseline_states, candidate_states = dict(baseline_outcome), dict(candidate_outcome)
+    differing, _ = diff_states(baseline_states.items(), candidate_states.items())
+    divergence["clients"] = state_differences(differing, baseline_states, candidate_states)
+    return divergence
+
+
+def state_summary(state):
+    """JSON serializable account state: [available, held, total, locked, sorted open disputes] or None"""
+    if state is None:
+        return None
+    available, held, total, locked, disputed = state
+    return [int(available), int(held), int(total), bool(locked), sorted(int(txn_id) for txn_id in disputed)]
+
+
+def state_differences(client_ids, baseline_states, candidate_states):
+    """Both states of the first MAX_DIFFERENCES of given clients"""
+    return [{"client": int(client_id), "baseline": state_summary(baseline_states.get(client_id)),
+             "candidate": state_summary(candidate_states.get(client_id))}
+            for client_id in client_ids[:MAX_DIFFERENCES]]
+
+
+def replay(transactions, accounts, baseline, candidate, input_format="csv", bisect=True):
+    """Replay a transactions log through two configurations (PaymentEngine keyword arguments), each in a fresh
+    process. Returns a report dict with the throughput and memory of each, whether their final account states
+    are identical and, if not, the differing clients and the first diverging transaction. A configuration that
+    fails has its error in the report instead of its throughput, and diverges from one that doesn't"""
+    rows = count_rows(transactions, input_format)
+    baseline = dict(baseline, input_format=input_format)
+    candidate = dict(candidate, input_format=input_format)
+    runs, outcomes = {}, {}
+    for name, options in (("baseline", baseline), ("candidate", candidate)):
+        try:
+            runs[name] = run_isolated(transactions, accounts, options, states=True)
+            outcomes[name] = runs[name].pop("states")
+        except Exception as e:
+            outcomes[name] = error_summary(e)
+            runs[name] = {"error": outcomes[name]}
+    failed = any(isinstance(outcome, str) for outcome in outcomes.values())
+    baseline_states = {} if failed else dict(outcomes["baseline"])
+    candidate_states = {} if failed else dict(outcomes["candidate"])
+    differing, order_differs = ([], False) if failed else diff_states(outcomes["baseline"], outcomes["candidate"])
+    report = {
+        "rows": rows,
+        "identical": not failed and not differing and not order_differs,
+        "order_differs": order_differs,
+        "differing_clients": len(differing),
+        "differences": state_differences(differing, baseline_states, candidate_states),
+    }
+    for name, options in (("baseline", baseline), ("candidate", candidate)):
+        result = runs[name]
+        result["options"] = {key: value._asdict() if isinstance(value, RetentionPolicy) else value
+                             for key, value in options.items()}
+        if "error" not in result:
+            result.update(rows_per_second=rows / result["total_seconds"],
+                          process_rows_per_second=rows / result["process_seconds"])
+        report[name] = result
+    if bisect and rows and diverged(outcomes["baseline"], outcomes["candidate"]):
+        with tempfile.TemporaryDirectory() as work_dir:
+            report["first_divergence"] = first_divergence(transactions, accounts, input_format, baseline, candidate,
+                                                          rows, work_dir)
+    return report
+
+
+def print_summary(report, stream):
+    """Side by side summary of a replay report"""
+    baseline, candidate = report["baseline"], report["candidate"]
+    print(f"{'':>22} {'baseline':>14} {'candidate':>14}", file=stream)
+    for label, key, scale in (("rows/s", "rows_per_second", 1), ("process rows/s", "process_rows_per_second", 1),
+                              ("total seconds", "total_seconds", 1), ("peak RSS MiB", "peak_rss_bytes", 2 ** 20)):
+        values = (f"{result[key] / scale:>14,.2f}" if key in result else f"{'failed':>14}"
+                  for result in (baseline, candidate))
+        print(f"{label:>22} {' '.join(values)}", file=stream)
+    if report["identical"]:
+        print(f"identical final account states over {report['rows']} rows", file=stream)
+        return
+    for name, result in (("baseline", baseline), ("candidate", candidate)):
+        if "error" in result:
+            print(f"{name} failed: {result['error']}", file=stream)
+    if "error" not in baseline and "error" not in candidate:
+        print(f"{report['differing_clients']} client accounts differ"
+              + (", accounts are in a different order" if report["order_differs"] else ""), file=stream)
+    divergence = report.get("first_divergence")
+    if divergence is not None:
+        print(f"first diverging transaction: row {divergence['row']} {','.join(divergence['transaction'])}",
+              file=stream)
+        for name in ("baseline", "candidate"):
+            if f"{name}_error" in divergence:
+                print(f"  {name} fails after it: {divergence[f'{name}_error']}", file=stream)
+        for client in divergence["clients"]:
+            print(f"  client {client['client']}: baseline {client['baseline']} candidate {client['candidate']}",
+                  file=stream)
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Replay a transactions log through two engine configurations "
+                                                 "and compare their final account states and performance")
+    parser.add_argument("--baseline", default="streaming",
+                        help=f"one of {', '.join(MODES)} or a JSON object of PaymentEngine keyword arguments")
+    parser.add_argument("--candidate", default="scan_kernel", help="like --baseline")
+    parser.add_argument("--transactions", help="recorded transactions log to replay, generated when not given")
+    parser.add_argument("--accounts", help="existing client accounts, a CSV or an account snapshot")
+    parser.add_argument("--input-format", choices=("csv", "binary"), default="csv")
+    parser.add_argument("--rows", type=int, default=100000, help="rows of the generated log")
+    parser.add_argument("--clients", type=int, default=1000, help="clients of the generated log")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-bisect", action="store_true", help="don't look for the first diverging transaction")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    add_mix_arguments(parser)
+    parser.set_defaults(edge_case_rate=0.01)
+    args = parser.parse_args()
+    with contextlib.ExitStack() as stack:
+        transactions, accounts = args.transactions, args.accounts
+        mix = None
+        if transactions is None:
+            if args.input_format != "csv":
+                parser.error("generated logs are CSV, convert them with python -m src.binary_format")
+            data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            mix = mix_from_arguments(args)
+            transactions = os.path.join(data_dir, "transactions.csv")
+            write_transactions(transactions, args.rows, args.clients, mix, args.seed)
+            if accounts is None:
+                accounts = os.path.join(data_dir, "clients.csv")
+                write_client_accounts(accounts, args.clients, mix, args.seed)
+        report = replay(transactions, accounts, engine_options(args.baseline), engine_options(args.candidate),
+                        args.input_format, bisect=not args.no_bisect)
+    report.update(commit=git_commit(), mix=mix.as_dict() if mix is not None else None)
+    print_summary(report, sys.stderr)
+    with open(args.output, "w") if args.output else contextlib.nullcontext(sys.stdout) as output:
+        json.dump(report, output, indent=2)
+        output.write("\n")
+    sys.exit(0 if report["identical"] else 1)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,170 @@
+# Benchmarks of PaymentEngine on generated data at several scales and in several engine modes.
+# Reports rows/sec, peak RSS and load/process/write timings as JSON so runs can be compared across commits.
+# Run with: python -m benchmarks.run_benchmarks --rows 10000,100000 --output bench.json
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.generate import add_mix_arguments, mix_from_arguments, write_client_accounts, write_transactions
+from src.metrics import peak_rss_bytes as process_peak_rss_bytes
+
+# Engine modes benchmarked, as PaymentEngine keyword arguments
+MODES = {
+    "batch": {},
+    "streaming": {"streaming": True},
+    "columnar": {"streaming": True, "account_store": "columnar"},
+    "sharded": {"streaming": True, "workers": 4},
+    "scan_kernel": {"streaming": True, "scan_kernel": True},
+}
+# Seconds between checks that a benchmark process is still running while waiting on its result
+POLL_SECONDS = 0.1
+
+
+def peak_rss_bytes(workers_peak_rss_bytes=0):
+    """Peak resident set size of this process plus given summed peak RSS of the sharded workers it ran. Without
+    sharded workers, the largest of its finished child processes (parse workers) if it is larger"""
+    if workers_peak_rss_bytes:
+        return process_peak_rss_bytes() + workers_peak_rss_bytes
+    return max(process_peak_rss_bytes(), process_peak_rss_bytes(children=True))
+
+
+def run_once(transactions_csv, client_accounts_csv, engine_options, states=False):
+    """Time the load, process and write phases of one engine run, in the calling process. With states the
+    final account states are returned too, as (client id, state) pairs in account order"""
+    from src.payment_engine import PaymentEngine
+    started = time.perf_counter()
+    engine = PaymentEngine(transactions_csv, client_accounts_csv, **engine_options)
+    loaded = time.perf_counter()
+    engine.process_transactions()
+    processed = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        engine.write_results()
+    written = time.perf_counter()
+    result = {
+        "load_seconds": loaded - started,
+        "process_seconds": processed - loaded,
+        "write_seconds": written - processed,
+        "total_seconds": written - started,
+        "clients": len(engine.clients),
+        "peak_rss_bytes": peak_rss_bytes(engine.workers_peak_rss_bytes),
+        "workers_peak_rss_bytes": engine.workers_peak_rss_bytes,
+    }
+    if states:
+        result["states"] = list(engine.account_states().items())
+    return result
+
+
+def _run_in_child(results, *args):
+    try:
+        result = run_once(*args)
+    except Exception as e:
+        results.put(e)
+        return
+    results.put(result)
+
+
+def run_isolated(transactions_csv, client_accounts_csv, engine_options, states=False):
+    """run_once in a fresh interpreter so peak RSS belongs to this run only. An exception raised by run_once is
+    raised here, a RuntimeError if the interpreter died without a result"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_in_child, args=(results, transactions_csv, client_accounts_csv,
+                                                          engine_options, states))
+    process.start()
+    try:
+        result = _child_result(process, results)
+    finally:
+        process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _child_result(process, results):
+    """Wait for the result of a run_in_child process, checking every POLL_SECONDS that it is still running"""
+    while True:
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The result is in the queue before the process exits, look once more before giving up on it
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            return RuntimeError(f"benchmark process exited with code {process.exitcode} without a result")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def data_paths(data_dir, rows, clients, mix, seed):
+    """Paths of the generated transactions and client accounts in data_dir. They are named after every parameter
+    they are generated from, so data generated with other parameters is never reused"""
+    mix_values = "_".join(f"{value:g}" for value in mix.as_dict().values())
+    return (os.path.join(data_dir, f"transactions_{rows}_{clients}_{seed}_{mix_values}.csv"),
+            os.path.join(data_dir, f"clients_{clients}_{seed}_{mix_values}.csv"))
+
+
+def run_benchmarks(row_counts, clients, modes, mix, data_dir, seed=0):
+    """Generate data for every row count and benchmark every mode on it, returns a list of result dicts"""
+    results = []
+    for rows in row_counts:
+        transactions_csv, client_accounts_csv = data_paths(data_dir, rows, clients, mix, seed)
+        if not os.path.exists(transactions_csv):
+            write_transactions(transactions_csv, rows, clients, mix, seed)
+        if not os.path.exists(client_accounts_csv):
+            write_client_accounts(client_accounts_csv, clients, mix, seed)
+        for mode in modes:
+            result = run_isolated(transactions_csv, client_accounts_csv, MODES[mode])
+            result.update(mode=mode, rows=rows, rows_per_second=rows / result["total_seconds"],
+                          process_rows_per_second=rows / result["process_seconds"])
+            results.append(result)
+            print(f"{mode:>10} {rows:>10} rows: {result['rows_per_second']:>12,.0f} rows/s "
+                  f"{result['peak_rss_bytes'] / 2 ** 20:>8.1f} MiB", file=sys.stderr)
+    return results
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Benchmark PaymentEngine on generated transactions")
+    parser.add_argument("--rows", default="10000,100000", help="comma separated row counts")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma separated, any of {', '.join(MODES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="keep generated data in this directory and reuse it on later runs")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    add_mix_arguments(parser)
+    args = parser.parse_args()
+    mix = mix_from_arguments(args)
+    row_counts = [int(rows) for rows in args.rows.split(",")]
+    modes = args.modes.split(",")
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        results = run_benchmarks(row_counts, args.clients, modes, mix, data_dir, args.seed)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "clients": args.clients,
+        "seed": args.seed,
+        "mix": mix.as_dict(),
+        "results": results,
+    }
+    with open(args.output, "w") if args.output else contextlib.nullcontext(sys.stdout) as output:
+        json.dump(report, output, indent=2)
+        output.write("\n")
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,181 @@
+# ColumnarAccountStore keeps client accounts in contiguous array columns, one row per client, instead of one
+# Client object per client. It is a drop in replacement for the dict of Client objects in PaymentEngine.clients
+from array import array
+from src.money import MAX_UNITS, to_decimal
+from src.outcomes import APPLIED, BALANCE_OVERFLOW, INSUFFICIENT_FUNDS, LOCKED_ACCOUNT, NOT_DISPUTED
+
+INITIAL_CAPACITY = 1024
+
+
+class ColumnarAccountStore:
+    """Mapping of client id -> account with available, held and total balances in int64 columns and
+    locked flags in a byte column. Clients get consecutive rows in the order they are added, rows maps every
+    client id to its row so columns stay dense however large the ids are. Disputed transaction sets are only
+    allocated for rows that have an open dispute. Iterates clients in the order they were added, like a dict."""
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.available = array("q", bytes(8 * capacity))
+        self.held = array("q", bytes(8 * capacity))
+        self.total = array("q", bytes(8 * capacity))
+        self.locked = bytearray(capacity)
+        self.disputed = {}
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, client_id):
+        return client_id in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, client_id):
+        return AccountView(self, client_id, self.rows[client_id])
+
+    def __setitem__(self, client_id, client):
+        """Store the balances, locked flag and disputed transactions of given Client (or AccountView)"""
+        row = self.rows.get(client_id)
+        if row is None:
+            row = len(self.rows)
+            if row >= len(self.locked):
+                self._grow(row + 1)
+            self.rows[client_id] = row
+        self.available[row] = client.available
+        self.held[row] = client.held
+        self.total[row] = client.total
+        self.locked[row] = 1 if client.locked else 0
+        if client.disputed_transactions:
+            self.disputed[row] = set(client.disputed_transactions)
+        else:
+            self.disputed.pop(row, None)
+
+    def keys(self):
+        return iter(self.rows)
+
+    def items(self):
+        for client_id, row in self.rows.items():
+            yield client_id, AccountView(self, client_id, row)
+
+    def values(self):
+        for client_id, row in self.rows.items():
+            yield AccountView(self, client_id, row)
+
+    def _grow(self, min_capacity):
+        """Grow all columns to hold at least min_capacity rows"""
+        extra = max(min_capacity, 2 * len(self.locked)) - len(self.locked)
+        zeros = bytes(8 * extra)
+        self.available.frombytes(zeros)
+        self.held.frombytes(zeros)
+        self.total.frombytes(zeros)
+        self.locked.extend(bytes(extra))
+
+
+class AccountView:
+    """Client-like view of one account in a ColumnarAccountStore, same methods and semantics as Client"""
+
+    __slots__ = ("_store", "_row", "client_id")
+
+    def __init__(self, store, client_id, row):
+        self._store = store
+        self._row = row
+        self.client_id = client_id
+
+    @property
+    def available(self):
+        return self._store.available[self._row]
+
+    @property
+    def held(self):
+        return self._store.held[self._row]
+
+    @property
+    def total(self):
+        return self._store.total[self._row]
+
+    @property
+    def locked(self):
+        return self._store.locked[self._row] == 1
+
+    @property
+    def disputed_transactions(self):
+        """Open disputes of this client, an empty frozenset when there are none"""
+        return self._store.disputed.get(self._row, frozenset())
+
+    @property
+    def available_balance(self):
+        return to_decimal(self.available)
+
+    @property
+    def held_amount(self):
+        return to_decimal(self.held)
+
+    @property
+    def total_amount(self):
+        return to_decimal(self.total)
+
+    def deposit(self, amount):
+        """Deposit given amount in clients account, see Client.deposit"""
+        store, row = self._store, self._row
+        if store.locked[row]:
+            return LOCKED_ACCOUNT
+        if store.total[row] + amount > MAX_UNITS or store.available[row] + amount > MAX_UNITS:
+            return BALANCE_OVERFLOW
+        store.available[row] += amount
+        store.total[row] += amount
+        return APPLIED
+
+    def withdrawal(self, amount):
+        """Withdraw/Debit given amount from the clients account """
+        store, row = self._store, self._row
+        if store.locked[row]:
+            return LOCKED_ACCOUNT
+        if store.available[row] < amount:
+            return INSUFFICIENT_FUNDS
+        store.available[row] -= amount
+        store.total[row] -= amount
+        return APPLIED
+
+    def dispute(self, disputed_amount, txn_id):
+        """Hold disputed amount, see Client.dispute"""
+        store, row = self._store, self._row
+        if store.locked[row]:
+            return LOCKED_ACCOUNT
+        if store.available[row] < disputed_amount:
+            return INSUFFICIENT_FUNDS
+        store.available[row] -= disputed_amount
+        store.held[row] += disputed_amount
+        store.disputed.setdefault(row, set()).add(txn_id)
+        return APPLIED
+
+    def resolve(self, disputed_amount, txn_id):
+        """Release held amount back to available, see Client.resolve"""
+        store, row = self._store, self._row
+        if store.locked[row]:
+            return LOCKED_ACCOUNT
+        if txn_id not in store.disputed.get(row, ()):
+            return NOT_DISPUTED
+        store.held[row] -= disputed_amount
+        store.available[row] += disputed_amount
+        self._close_dispute(txn_id)
+        return APPLIED
+
+    def chargeback(self, disputed_amount, txn_id):
+        """Reverse disputed transaction and lock the account, see Client.chargeback"""
+        store, row = self._store, self._row
+        if store.locked[row]:
+            return LOCKED_ACCOUNT
+        if txn_id not in store.disputed.get(row, ()):
+            return NOT_DISPUTED
+        store.held[row] -= disputed_amount
+        store.total[row] -= disputed_amount
+        store.locked[row] = 1
+        self._close_dispute(txn_id)
+        return APPLIED
+
+    def _close_dispute(self, txn_id):
+        """Remove txn from open disputes, dropping the set once it is empty"""
+        disputed = self._store.disputed[self._row]
+        disputed.remove(txn_id)
+        if not disputed:
+            del self._store.disputed[self._row]
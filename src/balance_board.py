@@ -0,0 +1,63 @@
+# BalanceBoard lets other threads read client balances while transactions are being applied. The thread applying
+# transactions publishes immutable per account views in batches, readers look them up without taking any lock.
+import time
+from collections import namedtuple
+
+
+class BalanceView(namedtuple("BalanceView", ("available", "held", "total", "locked", "version"))):
+    """Published state of one account, balances in integer units (see money.py). version is the BalanceBoard
+    version the view was published in, 0 for accounts unchanged since they were loaded from a snapshot"""
+
+
+class BalanceBoard:
+    """Account balances published by the thread applying transactions, for any number of reader threads.
+    Every publish() makes a new version. Views are immutable tuples held in a dict that only publish() changes,
+    so get() of one account is a single dict lookup and always sees the whole of one version of the account.
+    They are plain tuples until read, so that publishing costs the thread applying transactions little.
+    read() of several accounts retries until no publish ran meanwhile, so all the views it returns are of the
+    same version. Relies on single dict operations and attribute assignments being atomic.
+    fallback(client_id) gives the view of an account that was never published or None, see publish()."""
+
+    def __init__(self):
+        # (views by client id, fallback), replaced as a whole
+        self._state = ({}, None)
+        # Odd while a publish is in progress
+        self._sequence = 0
+
+    @property
+    def version(self):
+        """Number of versions published"""
+        return self._sequence // 2
+
+    def get(self, client_id):
+        """Latest published BalanceView of given client, or None if it has no published account"""
+        views, fallback = self._state
+        view = views.get(client_id)
+        if view is None:
+            return None if fallback is None else fallback(client_id)
+        return BalanceView._make(view)
+
+    def read(self, client_ids):
+        """Dict of client id -> BalanceView (or None) of given clients, all as of the same version"""
+        while True:
+            sequence = self._sequence
+            if sequence % 2 == 0:
+                views = {client_id: self.get(client_id) for client_id in client_ids}
+                if self._sequence == sequence:
+                    return views
+            # Let the publishing thread finish
+            time.sleep(0)
+
+    def publish(self, accounts, replace=False, fallback=None):
+        """Publish the balances of (client id, account) pairs as a new version, accounts are Client-like objects.
+        Called by the thread applying transactions only. With replace they become all the published accounts,
+        accounts not among them are looked up with fallback"""
+        version = self.version + 1
+        published = {client_id: (account.available, account.held, account.total, account.locked, version)
+                     for client_id, account in accounts}
+        self._sequence += 1
+        if replace:
+            self._state = (published, fallback)
+        else:
+            self._state[0].update(published)
+        self._sequence += 1
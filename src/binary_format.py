@@ -0,0 +1,253 @@
+# Binary columnar formats for machine to machine pipelines: transactions as fixed width columns that are read
+# zero copy through a memory mapping, and account states written as columns instead of formatted text.
+# Convert to and from CSV with: python -m src.binary_format {transactions-to-binary,transactions-to-csv,
+# accounts-to-binary,accounts-to-csv} INPUT OUTPUT
+import argparse
+import csv
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+import numpy as np
+from src.decoding import (BAD_CLIENT, BAD_TXN, DEPOSIT, NEGATIVE_AMOUNT, TXN_TYPE_NAMES, WITHDRAW, RecordBatch,
+                          RejectWriter)
+from src.ingest import CHUNK_ROWS, TransactionReader
+from src.money import format_amount
+from src.outcomes import MISSING_AMOUNT, UNKNOWN_TYPE
+from src.snapshot import OUTPUT_HEADER, read_account_rows
+
+TRANSACTIONS_MAGIC = b"PAYTXNS\x01"
+ACCOUNTS_MAGIC = b"PAYACCT\x01"
+# Magic and number of rows
+HEADER = struct.Struct("<8sQ")
+# Column layouts after the header, int64 columns come first so every column stays aligned
+TRANSACTION_COLUMNS = (("client", "<i8"), ("txn", "<i8"), ("amount", "<i8"), ("type", "i1"), ("with_amount", "u1"))
+ACCOUNT_COLUMNS = (("client", "<i8"), ("available", "<i8"), ("held", "<i8"), ("total", "<i8"), ("locked", "u1"))
+
+
+def map_columns(path, magic, layout):
+    """Memory map a columnar file, returns (number of rows, dict of column name -> NumPy view). The views keep
+    the mapping open for as long as they are referenced"""
+    with open(path, "rb") as input_file:
+        mapping = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    file_magic, count = HEADER.unpack_from(mapping)
+    if file_magic != magic:
+        raise ValueError(f"{path} is not a {magic[:-1].decode().lower()} file")
+    columns = {}
+    offset = HEADER.size
+    for name, dtype in layout:
+        dtype = np.dtype(dtype)
+        if offset + dtype.itemsize * count > len(mapping):
+            raise ValueError(f"{path} is truncated")
+        columns[name] = np.frombuffer(mapping, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+    return count, columns
+
+
+def write_columns(output, magic, layout, chunks):
+    """Write chunks of columns (tuples of arrays in layout order) to a binary output stream as one columnar file.
+    Columns are staged in temporary files so chunks are streamed, not held in memory"""
+    staged = [tempfile.TemporaryFile() for _ in layout]
+    try:
+        count = 0
+        for chunk in chunks:
+            for stage, (_, dtype), column in zip(staged, layout, chunk):
+                stage.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+            count += len(chunk[0])
+        output.write(HEADER.pack(magic, count))
+        for stage in staged:
+            stage.seek(0)
+            shutil.copyfileobj(stage, output)
+    finally:
+        for stage in staged:
+            stage.close()
+
+
+def write_transactions(path, batches):
+    """Write RecordBatches as a binary transactions file"""
+    with open(path, "wb") as output:
+        write_columns(output, TRANSACTIONS_MAGIC, TRANSACTION_COLUMNS,
+                      ((batch.clients, batch.txns, batch.amounts, batch.types, batch.with_amount)
+                       for batch in batches))
+
+
+class BinaryTransactionReader:
+    """Reads a binary transactions file, the counterpart of TransactionReader for the CSV format.
+    Iterating yields (type code, client, txn, amount) tuples built from zero copy slices of the mapped
+    columns. Rows that aren't valid transactions (unknown type code, negative ids or amount, no amount on a
+    deposit or withdraw) go to rejects like undecodable CSV rows.
+    offset is the number of rows read so far, a reader created with that start_offset continues with the next."""
+
+    def __init__(self, path, start_offset=0, rejects=None, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.offset = start_offset
+        self.rejects = rejects if rejects is not None else RejectWriter()
+        self.chunk_rows = chunk_rows
+
+    def __iter__(self):
+        for start, stop, batch, record_rows in self._chunks():
+            for row, record in zip(record_rows.tolist(), batch.records()):
+                self.offset = start + row + 1
+                yield record
+            self.offset = stop
+
+    def batches(self):
+        """Iterate over the valid transactions as RecordBatches of up to chunk_rows rows, offset is just past the
+        last row of the batch yielded"""
+        for _, stop, batch, _ in self._chunks():
+            self.offset = stop
+            yield batch
+
+    def _chunks(self):
+        """(start, stop, RecordBatch of the valid rows, their indexes) of every chunk of rows"""
+        count, columns = map_columns(self.path, TRANSACTIONS_MAGIC, TRANSACTION_COLUMNS)
+        for start in range(self.offset, count, self.chunk_rows):
+            stop = min(start + self.chunk_rows, count)
+            batch = RecordBatch(columns["type"][start:stop], columns["client"][start:stop],
+                                columns["txn"][start:stop], columns["amount"][start:stop],
+                                columns["with_amount"][start:stop])
+            yield (start, stop, *self._validate(batch, start))
+
+    def _validate(self, batch, start):
+        """Valid rows of a batch and their indexes, the others go to rejects"""
+        types = batch.types
+        known_type = (types >= 0) & (types < len(TXN_TYPE_NAMES))
+        needs_amount = (types == DEPOSIT) | (types == WITHDRAW)
+        has_amount = batch.with_amount.astype(bool)
+        reasons = np.select(
+            [~known_type, batch.clients < 0, batch.txns < 0, needs_amount & ~has_amount,
+             needs_amount & (batch.amounts < 0)],
+            [UNKNOWN_TYPE, BAD_CLIENT, BAD_TXN, MISSING_AMOUNT, NEGATIVE_AMOUNT],
+            default="",
+        )
+        valid = reasons == ""
+        if valid.all():
+            return RecordBatch(types, batch.clients, batch.txns, batch.amounts, needs_amount), np.arange(len(types))
+        for row in np.flatnonzero(~valid).tolist():
+            self.rejects.reject(start + row + 1, transaction_fields(batch, row), reasons[row])
+        rows = np.flatnonzero(valid)
+        return RecordBatch(types[rows], batch.clients[rows], batch.txns[rows], batch.amounts[rows],
+                           needs_amount[rows]), rows
+
+
+def transaction_fields(batch, row):
+    """type, client, txn and amount text of one row of a RecordBatch, as in the CSV format"""
+    txn_type = int(batch.types[row])
+    return [TXN_TYPE_NAMES[txn_type] if 0 <= txn_type < len(TXN_TYPE_NAMES) else str(txn_type),
+            str(batch.clients[row]), str(batch.txns[row]),
+            format_amount(int(batch.amounts[row])) if batch.with_amount[row] else ""]
+
+
+def write_account_states(output, accounts):
+    """Write (client id, account) pairs to a binary output stream as an account states file"""
+    def chunks():
+        chunk = []
+        for client_id, account in accounts:
+            chunk.append((client_id, account.available, account.held, account.total, account.locked))
+            if len(chunk) == CHUNK_ROWS:
+                yield account_columns(chunk)
+                chunk = []
+        if chunk:
+            yield account_columns(chunk)
+
+    write_columns(output, ACCOUNTS_MAGIC, ACCOUNT_COLUMNS, chunks())
+
+
+def account_columns(rows):
+    """ACCOUNT_COLUMNS arrays of (client, available, held, total, locked) rows"""
+    try:
+        return tuple(np.array([row[column] for row in rows], dtype=dtype)
+                     for column, (_, dtype) in enumerate(ACCOUNT_COLUMNS))
+    except OverflowError:
+        raise ValueError("account balances must fit in 64 bit integer units for the binary format") from None
+
+
+def read_account_states(path):
+    """(client, available, held, total, locked) rows of an account states file, balances in integer units"""
+    count, columns = map_columns(path, ACCOUNTS_MAGIC, ACCOUNT_COLUMNS)
+    for start in range(0, count, CHUNK_ROWS):
+        yield from zip(*(columns[name][start:start + CHUNK_ROWS].tolist() for name, _ in ACCOUNT_COLUMNS[:4]),
+                       columns["locked"][start:start + CHUNK_ROWS].astype(bool).tolist())
+
+
+def transactions_to_binary(csv_path, binary_path):
+    """Convert a transactions CSV to a binary transactions file, returns the RejectWriter of rows left out"""
+    rejects = RejectWriter()
+    reader = TransactionReader(csv_path, rejects=rejects)
+
+    def batches():
+        chunk = []
+        for record in reader:
+            chunk.append(record)
+            if len(chunk) == CHUNK_ROWS:
+                yield record_batch(chunk)
+                chunk = []
+        if chunk:
+            yield record_batch(chunk)
+
+    write_transactions(binary_path, batches())
+    return rejects
+
+
+def record_batch(records):
+    """RecordBatch of (type code, client, txn, amount) tuples"""
+    types, clients, txns, amounts = zip(*records)
+    return RecordBatch(np.array(types, dtype=np.int8), np.array(clients, dtype=np.int64),
+                       np.array(txns, dtype=np.int64),
+                       np.array([0 if amount is None else amount for amount in amounts], dtype=np.int64),
+                       np.array([amount is not None for amount in amounts], dtype=np.uint8))
+
+
+def transactions_to_csv(binary_path, csv_path):
+    """Convert a binary transactions file to a transactions CSV"""
+    count, columns = map_columns(binary_path, TRANSACTIONS_MAGIC, TRANSACTION_COLUMNS)
+    with open(csv_path, "w", newline="") as output:
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(("type", "client", "txn", "amount"))
+        for start in range(0, count, CHUNK_ROWS):
+            batch = RecordBatch(*(columns[name][start:start + CHUNK_ROWS]
+                                  for name in ("type", "client", "txn", "amount", "with_amount")))
+            writer.writerows(transaction_fields(batch, row) for row in range(len(batch)))
+
+
+def accounts_to_binary(csv_path, binary_path):
+    """Convert a client accounts CSV (the engine's CSV output or an existing accounts file) to an account
+    states file"""
+    rows = read_account_rows(csv_path)
+    with open(binary_path, "wb") as output:
+        write_columns(output, ACCOUNTS_MAGIC, ACCOUNT_COLUMNS,
+                      [account_columns(rows[start:start + CHUNK_ROWS]) for start in range(0, len(rows), CHUNK_ROWS)])
+
+
+def accounts_to_csv(binary_path, csv_path):
+    """Convert an account states file to the CSV the engine writes"""
+    with open(csv_path, "w", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(OUTPUT_HEADER)
+        writer.writerows((client_id, format_amount(available), format_amount(held), format_amount(total), locked)
+                         for client_id, available, held, total, locked in read_account_states(binary_path))
+
+
+CONVERSIONS = {
+    "transactions-to-binary": transactions_to_binary,
+    "transactions-to-csv": transactions_to_csv,
+    "accounts-to-binary": accounts_to_binary,
+    "accounts-to-csv": accounts_to_csv,
+}
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Convert transactions and account states between CSV and the "
+                                                 "binary columnar formats")
+    parser.add_argument("conversion", choices=sorted(CONVERSIONS))
+    parser.add_argument("input")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    rejects = CONVERSIONS[args.conversion](args.input, args.output)
+    if rejects is not None and rejects.counts:
+        print(f"rows left out: {rejects.counts}", file=sys.stderr)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
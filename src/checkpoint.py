@@ -0,0 +1,36 @@
+# Checkpoints save the engine state (client accounts, open disputes, the transaction index and how far the
+# transactions file has been read) to a binary file so that a later run can resume with only the transactions
+# appended since
+import os
+import pickle
+
+CHECKPOINT_FORMAT = "paymentengine-checkpoint"
+CHECKPOINT_VERSION = 2
+
+
+def write_checkpoint(path, account_states, index_entries, transactions_offset):
+    """Write engine state to given path. The file is replaced atomically so an interrupted save never leaves
+    a truncated checkpoint behind"""
+    state = {
+        "format": CHECKPOINT_FORMAT,
+        "version": CHECKPOINT_VERSION,
+        "transactions_offset": transactions_offset,
+        "accounts": account_states,
+        "txn_index": index_entries,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as checkpoint_file:
+        pickle.dump(state, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    """Read a checkpoint written by write_checkpoint.
+    Returns a dict with accounts, txn_index and transactions_offset. Checkpoints are trusted local files."""
+    with open(path, "rb") as checkpoint_file:
+        state = pickle.load(checkpoint_file)
+    if not isinstance(state, dict) or state.get("format") != CHECKPOINT_FORMAT:
+        raise ValueError(f"{path} is not a payment engine checkpoint")
+    if state["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"unsupported checkpoint version {state['version']} in {path}")
+    return state
@@ -0,0 +1,176 @@
+# Decoding stage between reading transactions and applying them. Raw text rows are validated and converted in bulk
+# with pandas/NumPy into typed (type, client, txn, amount) tuples: the type as a small integer code, client and
+# txn as ints and the amount as integer units (see money.py). Rows that can't be decoded are rejected with
+# a reason instead of reaching the engine.
+import csv
+from collections import namedtuple
+import numpy as np
+from src.money import SCALE, parse_amount
+from src.outcomes import MISSING_AMOUNT, UNKNOWN_TYPE
+
+# Transaction type codes
+DEPOSIT, WITHDRAW, DISPUTE, RESOLVE, CHARGEBACK = range(5)
+TXN_TYPE_NAMES = ("deposit", "withdraw", "dispute", "resolve", "chargeback")
+TXN_TYPE_CODES = {name: code for code, name in enumerate(TXN_TYPE_NAMES)}
+
+# Reasons a row is rejected, besides unknown_type and missing_amount
+BAD_CLIENT = "bad_client"
+BAD_TXN = "bad_txn"
+BAD_AMOUNT = "bad_amount"
+NEGATIVE_AMOUNT = "negative_amount"
+
+# Client and txn ids are non negative integers that fit in int64
+ID_PATTERN = r"[0-9]{1,18}"
+MAX_AMOUNT_UNITS = 2 ** 63 - 1
+# Amounts whose units can be taken from their float value without loss, larger ones are parsed exactly
+FLOAT_EXACT_UNITS = 2 ** 50
+
+
+class RecordBatch(namedtuple("RecordBatch", ("types", "clients", "txns", "amounts", "with_amount"))):
+    """Decoded transactions as NumPy columns: int8 type codes, int64 client and txn ids, int64 amount units and
+    a mask of the rows that carry an amount (deposit and withdraw). Compact to hold and to send between
+    processes."""
+
+    def __len__(self):
+        return len(self.types)
+
+    def records(self):
+        """(type code, client, txn, amount) tuples of the batch, amount None where the row carries none"""
+        return list(zip(self.types.tolist(), self.clients.tolist(), self.txns.tolist(),
+                        [amount if with_amount else None
+                         for amount, with_amount in zip(self.amounts.tolist(), self.with_amount.tolist())]))
+
+
+def decode_columns(types, clients, txns, amounts):
+    """Validate and convert raw text columns of transactions.
+    Returns (records, record_rows, rejects): records are (type code, client, txn, amount) tuples of the valid rows
+    in input order, with amount None for dispute, resolve and chargeback, record_rows are the indexes of those
+    rows and rejects are (row index, reason) tuples of the others."""
+    batch, record_rows, rejects = decode_batch(types, clients, txns, amounts)
+    return batch.records(), record_rows.tolist(), rejects
+
+
+def decode_batch(types, clients, txns, amounts):
+    """Like decode_columns, but the valid rows are returned as a RecordBatch and their indexes as an array"""
+    # Imported here so that applying typed records (see ledger.py) doesn't need pandas
+    import pandas as pd
+    types = pd.Series(types, dtype=object).str.strip()
+    clients = pd.Series(clients, dtype=object).str.strip()
+    txns = pd.Series(txns, dtype=object).str.strip()
+    amounts = pd.Series(amounts, dtype=object).fillna("").str.strip()
+
+    type_codes = types.map(TXN_TYPE_CODES)
+    type_ok = type_codes.notna().to_numpy()
+    codes = type_codes.fillna(-1).to_numpy(dtype=np.int8)
+    client_ok, client_ids = decode_ids(clients)
+    txn_ok, txn_ids = decode_ids(txns)
+
+    needs_amount = (codes == DEPOSIT) | (codes == WITHDRAW)
+    has_amount = (amounts != "").to_numpy()
+    units, amount_ok = decode_amounts(amounts, needs_amount & has_amount)
+    negative = amount_ok & (units < 0)
+
+    reasons = np.select(
+        [~type_ok, ~client_ok, ~txn_ok,
+         needs_amount & ~has_amount, needs_amount & ~amount_ok, needs_amount & negative],
+        [UNKNOWN_TYPE, BAD_CLIENT, BAD_TXN, MISSING_AMOUNT, BAD_AMOUNT, NEGATIVE_AMOUNT],
+        default="",
+    )
+    valid = reasons == ""
+    rows = np.flatnonzero(valid)
+    batch = RecordBatch(codes[rows], client_ids[rows], txn_ids[rows], units[rows], needs_amount[rows])
+    invalid = np.flatnonzero(~valid)
+    rejects = list(zip(invalid.tolist(), reasons[invalid].tolist()))
+    return batch, rows, rejects
+
+
+def decode_ids(values):
+    """(valid mask, int64 ids) of a Series of id strings"""
+    valid = values.str.fullmatch(ID_PATTERN).fillna(False).to_numpy(dtype=bool)
+    ids = np.zeros(len(values), dtype=np.int64)
+    if valid.any():
+        ids[valid] = values[valid].astype(np.int64).to_numpy()
+    return valid, ids
+
+
+def decode_amounts(amounts, wanted):
+    """(int64 units, valid mask) of the amount strings selected by wanted mask.
+    Amounts with up to four decimal places are converted through float64 when that is exact, the remaining
+    ones are parsed exactly with parse_amount"""
+    units = np.zeros(len(amounts), dtype=np.int64)
+    valid = np.zeros(len(amounts), dtype=bool)
+    if not wanted.any():
+        return units, valid
+    import pandas as pd
+    as_float = pd.to_numeric(amounts[wanted], errors="coerce").to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore", over="ignore"):
+        scaled = as_float * SCALE
+        rounded = np.rint(scaled)
+        exact = np.isfinite(scaled) & (np.abs(rounded) < FLOAT_EXACT_UNITS) & (np.abs(scaled - rounded) < 1e-6)
+    wanted_rows = np.flatnonzero(wanted)
+    units[wanted_rows[exact]] = rounded[exact].astype(np.int64)
+    valid[wanted_rows[exact]] = True
+    for row in wanted_rows[~exact].tolist():
+        try:
+            amount = parse_amount(amounts.iat[row])
+        except ValueError:
+            continue
+        if abs(amount) <= MAX_AMOUNT_UNITS:
+            units[row] = amount
+            valid[row] = True
+    return units, valid
+
+
+def decode_row(fields):
+    """Decode one row of type, client, txn and optional amount fields, the same way decode_columns does.
+    Returns (record, None) for a valid row or (None, reason)"""
+    txn_type = TXN_TYPE_CODES.get(fields[0].strip()) if fields else None
+    if txn_type is None:
+        return None, UNKNOWN_TYPE
+    client_id = decode_id(fields[1] if len(fields) > 1 else "")
+    if client_id is None:
+        return None, BAD_CLIENT
+    txn_id = decode_id(fields[2] if len(fields) > 2 else "")
+    if txn_id is None:
+        return None, BAD_TXN
+    if txn_type != DEPOSIT and txn_type != WITHDRAW:
+        return (txn_type, client_id, txn_id, None), None
+    amount = fields[3].strip() if len(fields) > 3 else ""
+    if not amount:
+        return None, MISSING_AMOUNT
+    try:
+        units = parse_amount(amount)
+    except ValueError:
+        return None, BAD_AMOUNT
+    if abs(units) > MAX_AMOUNT_UNITS:
+        return None, BAD_AMOUNT
+    if units < 0:
+        return None, NEGATIVE_AMOUNT
+    return (txn_type, client_id, txn_id, units), None
+
+
+def decode_id(text):
+    text = text.strip()
+    if text.isascii() and text.isdigit() and len(text) <= 18:
+        return int(text)
+    return None
+
+
+class RejectWriter:
+    """Writes rejected rows as CSV (row, type, client, txn, amount, reason) and counts them by reason.
+    row is the 1 based number of the row among the data rows of the transactions file."""
+
+    HEADER = ("row", "type", "client", "txn", "amount", "reason")
+
+    def __init__(self, output=None):
+        self.output = output
+        self.counts = {}
+        self._writer = None
+        if output is not None:
+            self._writer = csv.writer(output)
+            self._writer.writerow(self.HEADER)
+
+    def reject(self, row_number, fields, reason):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if self._writer is not None:
+            self._writer.writerow((row_number, *fields, reason))
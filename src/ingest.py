@@ -0,0 +1,247 @@
+# Streaming readers for the transactions file. Rows are read in chunks, decoded in bulk (see decoding.py) and
+# yielded one typed transaction at a time, so the whole input never has to be held in memory.
+# ParallelTransactionReader parses byte ranges of the file in worker processes.
+import csv
+import io
+import multiprocessing
+import os
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from src.decoding import RecordBatch, RejectWriter, decode_batch, decode_columns
+
+TRANSACTION_COLUMNS = ("type", "client", "txn", "amount")
+CHUNK_ROWS = 65536
+# Size of the byte ranges parsed by one ParallelTransactionReader worker task
+BLOCK_BYTES = 8 * 2 ** 20
+
+
+@contextmanager
+def open_input(source, mode="r"):
+    """Open given file path for reading, file-like objects are used as they are and left open for the caller"""
+    if hasattr(source, "read"):
+        yield source
+    else:
+        with open(source, mode, **({} if "b" in mode else {"newline": ""})) as input_file:
+            yield input_file
+
+
+def raw_columns(rows, positions):
+    """Type, client, txn and amount text columns of parsed CSV rows, "" where a row has no such field"""
+    return [[row[position] if position is not None and len(row) > position else "" for row in rows]
+            for position in positions]
+
+
+def column_positions(header):
+    """Positions of the type, client, txn and amount columns in a header row, amount is None when missing"""
+    header = [column.strip() for column in header]
+    for column in TRANSACTION_COLUMNS[:3]:
+        if column not in header:
+            raise ValueError(f"transactions file has no {column} column")
+    return [header.index(column) if column in header else None for column in TRANSACTION_COLUMNS]
+
+
+class TransactionReader:
+    """Reads transactions from a CSV with type,client,txn,amount columns.
+    Iterating yields decoded (type code, client, txn, amount) tuples, amount is in integer units and None for
+    rows that don't carry one (dispute, resolve and chargeback). Rows that fail decoding are passed to rejects,
+    a RejectWriter, with their row number counted from start_offset.
+    offset is the position just past the last row yielded so far, a reader created with that start_offset
+    continues with the next row. Offsets count bytes for file paths and characters for text streams."""
+
+    def __init__(self, source, start_offset=0, rejects=None, chunk_rows=CHUNK_ROWS):
+        self.source = source
+        self.offset = start_offset
+        self.rejects = rejects if rejects is not None else RejectWriter()
+        self.chunk_rows = chunk_rows
+        self.rows_read = 0
+
+    def __iter__(self):
+        for batch, record_rows, line_ends in self._chunks():
+            for row, record in zip(record_rows.tolist(), batch.records()):
+                self.offset = line_ends[row]
+                yield record
+
+    def batches(self):
+        """Iterate over the decoded transactions as RecordBatches of up to chunk_rows rows, offset is just past
+        the last row of the batch yielded"""
+        for batch, _, line_ends in self._chunks():
+            self.offset = line_ends[-1]
+            yield batch
+
+    def _chunks(self):
+        """(RecordBatch, row indexes of its records, line end of every row) of every chunk of rows"""
+        with open_input(self.source, "rb") as input_file:
+            lines = self._lines(input_file)
+            header = next(csv.reader(lines), None)
+            if header is None:
+                return
+            positions = column_positions(header)
+            if self.offset > self._line_end:
+                input_file.seek(self.offset)
+                self._line_end = self.offset
+            reader = csv.reader(lines)
+            while True:
+                chunk, line_ends = [], []
+                for row in reader:
+                    if row:
+                        chunk.append(row)
+                        line_ends.append(self._line_end)
+                        if len(chunk) == self.chunk_rows:
+                            break
+                if not chunk:
+                    break
+                yield (*self._decode(chunk, positions), line_ends)
+            self.offset = max(self.offset, self._line_end)
+
+    def _decode(self, chunk, positions):
+        """Decode a chunk of raw rows into a RecordBatch and the indexes of its rows, rejected rows go to rejects"""
+        columns = raw_columns(chunk, positions)
+        batch, record_rows, rejects = decode_batch(*columns)
+        for row, reason in rejects:
+            self.rejects.reject(self.rows_read + row + 1, [column[row] for column in columns], reason)
+        self.rows_read += len(chunk)
+        return batch, record_rows
+
+    def _lines(self, input_file):
+        """Decoded lines of input file, keeping _line_end at the position just past the last line read"""
+        self._line_end = 0
+        for line in input_file:
+            self._line_end += len(line)
+            yield line.decode() if isinstance(line, bytes) else line
+
+
+class ParallelTransactionReader:
+    """Reads transactions from a CSV file like TransactionReader, with the parsing and decoding spread over
+    worker processes. The file is split into byte ranges of about block_bytes ending on a line end, each is
+    parsed by a worker into a RecordBatch, and batches are yielded from in file order, so iterating yields
+    exactly what TransactionReader would, with the same offset and rejects.
+    A quoted field must not span lines, as ranges are split on any line end."""
+
+    def __init__(self, path, start_offset=0, rejects=None, workers=2, block_bytes=BLOCK_BYTES):
+        self.path = path
+        self.offset = start_offset
+        self.rejects = rejects if rejects is not None else RejectWriter()
+        self.workers = workers
+        self.block_bytes = block_bytes
+        self.rows_read = 0
+
+    def __iter__(self):
+        for batch, line_ends, _ in self._blocks():
+            for record, line_end in zip(batch.records(), line_ends.tolist()):
+                self.offset = line_end
+                yield record
+
+    def batches(self):
+        """Iterate over the decoded transactions as one RecordBatch per block, offset is just past the last row
+        of the batch yielded"""
+        for batch, _, end in self._blocks():
+            self.offset = end
+            yield batch
+
+    def _blocks(self):
+        """(RecordBatch, line end of every record, end of the block) of every block in file order, rejected rows
+        go to rejects"""
+        with open(self.path, "rb") as input_file:
+            header_line = input_file.readline()
+        if not header_line:
+            return
+        positions = column_positions(next(csv.reader([header_line.decode()])))
+        start = max(self.offset, len(header_line))
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            # At most two blocks per worker are parsed ahead of the block being applied
+            pending = deque()
+            end = start
+            for begin, end in block_ranges(self.path, start, self.block_bytes):
+                pending.append((pool.apply_async(parse_block, (self.path, begin, end, positions)), end))
+                if len(pending) >= 2 * self.workers:
+                    yield self._block(*pending.popleft())
+            while pending:
+                yield self._block(*pending.popleft())
+            self.offset = max(self.offset, end)
+        finally:
+            pool.terminate()
+
+    def _block(self, result, end):
+        """(RecordBatch, line ends, end) of a parsed block, its rejected rows go to rejects"""
+        batch, line_ends, rows, rejects = result.get()
+        for row, fields, reason in rejects:
+            self.rejects.reject(self.rows_read + row + 1, fields, reason)
+        self.rows_read += rows
+        return batch, line_ends, end
+
+
+def block_ranges(path, start, block_bytes):
+    """(begin, end) byte ranges of about block_bytes covering path from start to its current size, each ending
+    just past a line end"""
+    with open(path, "rb") as input_file:
+        size = os.fstat(input_file.fileno()).st_size
+        begin = start
+        while begin < size:
+            input_file.seek(begin + block_bytes - 1)
+            input_file.readline()
+            end = min(input_file.tell(), size)
+            yield begin, end
+            begin = end
+
+
+def parse_block(path, begin, end, positions):
+    """Parse and decode the rows between byte offsets begin and end of path, run in a worker process.
+    Returns (RecordBatch of the valid rows, their line end offsets, number of rows, rejects as
+    (row, fields, reason) tuples)"""
+    with open(path, "rb") as input_file:
+        input_file.seek(begin)
+        data = input_file.read(end - begin)
+    line_end = begin
+
+    def lines():
+        nonlocal line_end
+        for line in io.BytesIO(data):
+            line_end += len(line)
+            yield line.decode()
+
+    rows, row_ends = [], []
+    for row in csv.reader(lines()):
+        if row:
+            rows.append(row)
+            row_ends.append(line_end)
+    columns = raw_columns(rows, positions)
+    batch, record_rows, rejected = decode_batch(*columns)
+    rejects = [(row, [column[row] for column in columns], reason) for row, reason in rejected]
+    return batch, np.array(row_ends, dtype=np.int64)[record_rows], len(rows), rejects
+
+
+def read_transactions_frame(source, rejects=None):
+    """Load and decode a whole transactions file into a DataFrame of type code, client, txn and amount columns,
+    rejected rows go to rejects"""
+    import pandas as pd
+    df = pd.read_csv(source, dtype=str, keep_default_na=False, skipinitialspace=True)
+    df.columns = [column.strip() for column in df.columns]
+    column_positions(df.columns)
+    columns = [df[column] if column in df.columns else [""] * len(df) for column in TRANSACTION_COLUMNS]
+    records, _, rejected = decode_columns(*columns)
+    rejects = rejects if rejects is not None else RejectWriter()
+    for row, reason in rejected:
+        rejects.reject(row + 1, [column[row] for column in columns], reason)
+    types, clients, txns, amounts = zip(*records) if records else ((), (), (), ())
+    return pd.DataFrame({
+        "type": np.array(types, dtype=np.int8),
+        "client": np.array(clients, dtype=np.int64),
+        "txn": np.array(txns, dtype=np.int64),
+        "amount": pd.Series(amounts, dtype=object),
+    })
+
+
+def frame_batches(df, chunk_rows=CHUNK_ROWS):
+    """RecordBatches of up to chunk_rows rows of a DataFrame returned by read_transactions_frame"""
+    with_amount = df["amount"].notna().to_numpy()
+    amounts = df["amount"].where(with_amount, 0).to_numpy(dtype=np.int64)
+    columns = (df["type"].to_numpy(), df["client"].to_numpy(), df["txn"].to_numpy(), amounts, with_amount)
+    for start in range(0, len(df), chunk_rows):
+        yield RecordBatch(*(column[start:start + chunk_rows] for column in columns))
+
+
+def iter_transactions(source):
+    """Iterate over decoded transactions of given CSV, see TransactionReader"""
+    return iter(TransactionReader(source))
@@ -0,0 +1,488 @@
+# Ledger is the embeddable core of the engine: client accounts, the transaction index of disputable deposits and
+# the rules applying typed transactions to them. In-process callers create one from existing account states and
+# submit typed records one at a time or in batches, PaymentEngine layers the file input and output on top of it.
+from itertools import repeat
+from operator import itemgetter
+import numpy as np
+from src.account_store import ColumnarAccountStore
+from src.balance_board import BalanceBoard, BalanceView
+from src.decoding import CHARGEBACK, DEPOSIT, DISPUTE, NEGATIVE_AMOUNT, RESOLVE, WITHDRAW, RecordBatch
+from src.money import MAX_UNITS, format_amount, to_decimal
+from src.outcomes import (APPLIED, BALANCE_OVERFLOW, CLIENT_MISMATCH, INSUFFICIENT_FUNDS, LOCKED_ACCOUNT,
+                          MISSING_AMOUNT, NOT_A_DEPOSIT, NOT_DISPUTED, UNKNOWN_CLIENT, UNKNOWN_TXN, UNKNOWN_TYPE)
+from src.scan_kernel import (APPLIED_CODE, SAFE_UNITS, SCAN_OUTCOMES, group_clients, scan_balances,
+                             scan_candidates)
+from src.snapshot import SnapshotAccounts
+from src.txn_index import TransactionIndex
+
+
+# Client class holds all the client related details. Balances are integer units of 1/10000 (see money.py)
+class Client:
+
+    def __init__(self, client_id, available, held, total, locked):
+        self.client_id = client_id
+        self.available = available
+        self.held = held
+        self.total = total
+        self.disputed_transactions = set()
+        self.locked = locked
+
+    @property
+    def available_balance(self):
+        return to_decimal(self.available)
+
+    @property
+    def held_amount(self):
+        return to_decimal(self.held)
+
+    @property
+    def total_amount(self):
+        return to_decimal(self.total)
+
+    def deposit(self, amount):
+        """Deposit given amount in clients account, refused when a balance would exceed MAX_UNITS"""
+        if self.locked:
+            return LOCKED_ACCOUNT
+        if self.total + amount > MAX_UNITS or self.available + amount > MAX_UNITS:
+            return BALANCE_OVERFLOW
+        self.available += amount
+        self.total += amount
+        return APPLIED
+
+    def withdrawal(self, amount):
+        """Withdraw/Debit given amount from the clients account """
+        if self.locked:
+            return LOCKED_ACCOUNT
+        if self.available < amount:
+            return INSUFFICIENT_FUNDS
+        self.available -= amount
+        self.total -= amount
+        return APPLIED
+
+    def dispute(self, disputed_amount, txn_id):
+        """When client raises a dispute for a specific transaction,the associated amount should be held.
+        Clients available balance should decrease by the amount disputed but the total fund should remain the same until
+        dispute resolved or charged back"""
+        if self.locked:
+            return LOCKED_ACCOUNT
+        if self.available < disputed_amount:
+            return INSUFFICIENT_FUNDS
+        self.available -= disputed_amount
+        self.held += disputed_amount
+        self.disputed_transactions.add(txn_id)
+        return APPLIED
+
+    def resolve(self, disputed_amount, txn_id):
+        """Resolve indicates resolution to a dispute and releases held amounts for the transaction.
+        Disputed/held amount should move from held balance to available balances."""
+        if self.locked:
+            return LOCKED_ACCOUNT
+        if txn_id not in self.disputed_transactions:
+            return NOT_DISPUTED
+        self.held -= disputed_amount
+        self.available += disputed_amount
+        self.disputed_transactions.remove(txn_id)
+        return APPLIED
+
+    def chargeback(self, disputed_amount, txn_id):
+        """Chargeback indicates another final state of a disputed transaction.
+        It represents the client reversing a transaction.Disputed amount should be removed from held amount
+        and total balances should be reduced by disputed amount."""
+        if self.locked:
+            return LOCKED_ACCOUNT
+        if txn_id not in self.disputed_transactions:
+            return NOT_DISPUTED
+        self.held -= disputed_amount
+        self.total -= disputed_amount
+        self.locked = True
+        self.disputed_transactions.remove(txn_id)
+        return APPLIED
+
+
+# Ways of holding client accounts: a dict of Client objects, or array columns indexed by client id which use
+# far less memory with many clients
+ACCOUNT_STORES = {
+    "objects": dict,
+    "columnar": ColumnarAccountStore,
+}
+
+
+class Ledger:
+    """Client accounts and the transactions applied to them.
+    accounts maps client id to a (available, held, total, locked) state, or the (available, held, total, locked,
+    disputed transactions) state returned by account_states(), balances in integer units (see money.py).
+    account_store selects how accounts are held, see ACCOUNT_STORES.
+    metrics is an optional EngineMetrics to record outcomes and latencies of applied transactions.
+    retention is an optional RetentionPolicy bounding how long deposits stay disputable in memory.
+    With track_changes the ids of clients whose account a transaction changed are kept in changed.
+    With scan_kernel batches are applied with the scan kernel for clients that only deposit and withdraw, see
+    apply_batch.
+    With share_balances, balances is a BalanceBoard other threads can read balances from while transactions are
+    applied. The accounts of the clients of a batch are published to it once the batch is applied, those of a
+    transaction submitted alone once it is applied. A PaymentEngine with workers publishes the accounts of a batch
+    once the worker of their shard applied it, so accounts read together may be of different input rows."""
+
+    def __init__(self, accounts=None, account_store="objects", metrics=None, retention=None, track_changes=False,
+                 scan_kernel=False, share_balances=False):
+        self.account_store = account_store
+        self.metrics = metrics
+        self.retention = retention
+        self.changed = set() if track_changes else None
+        self.scan_kernel = scan_kernel
+        self.balances = BalanceBoard() if share_balances else None
+        self.clients = self.new_account_store()
+        if accounts is not None:
+            self.load_account_states(accounts)
+        self.publish_balances()
+        # Deposits and withdrawals seen so far, disputes/resolves/chargebacks look their transaction up here
+        self.txn_index = self.new_txn_index()
+        # Transaction index entry of the withdrawals of every client, see withdrawal_entry
+        self._withdrawal_entries = {}
+        self._submit = None
+
+    def submit(self, txn_type, client_id, txn_id, amount=None):
+        """Apply one typed transaction: a type code (see decoding.py), client and txn ids and for deposits and
+        withdrawals an amount in integer units. Returns APPLIED or the reason the transaction was ignored"""
+        if (txn_type == DEPOSIT or txn_type == WITHDRAW) and (amount is None or amount < 0):
+            return MISSING_AMOUNT if amount is None else NEGATIVE_AMOUNT
+        outcome = self.handler()(txn_type, client_id, txn_id, amount)
+        self.publish_balances([client_id])
+        return outcome
+
+    def submit_batch(self, records):
+        """Apply typed transactions in order, records are (type, client, txn, amount) tuples as taken by submit,
+        in any iterable, or a RecordBatch. Returns the outcome of every record, in order"""
+        if isinstance(records, RecordBatch):
+            return self.apply_batch(records).tolist()
+        apply_transaction = self.handler()
+        outcomes = []
+        append = outcomes.append
+        # Clients to publish, records may be an iterator so they are noted while applying
+        client_ids = set() if self.balances is not None else None
+        for txn_type, client_id, txn_id, amount in records:
+            if client_ids is not None:
+                client_ids.add(client_id)
+            if (txn_type == DEPOSIT or txn_type == WITHDRAW) and (amount is None or amount < 0):
+                append(MISSING_AMOUNT if amount is None else NEGATIVE_AMOUNT)
+            else:
+                append(apply_transaction(txn_type, client_id, txn_id, amount))
+        if client_ids is not None:
+            self.publish_balances(client_ids)
+        return outcomes
+
+    def apply_batch(self, batch):
+        """Apply a RecordBatch in order, returns the outcome of every row as an object array.
+        With scan_kernel, the rows of clients that only deposit and withdraw in the batch and whose account isn't
+        locked are applied at once by the scan kernel (see scan_kernel.py), the other rows one by one. The result
+        is the same as applying every row one by one, except that metrics have no latency for scanned rows.
+        The scan kernel isn't used with a retention policy, as evictions depend on the order rows are applied."""
+        types = batch.types
+        outcomes = np.empty(len(batch), dtype=object)
+        needs_amount = (types == DEPOSIT) | (types == WITHDRAW)
+        missing = needs_amount & ~batch.with_amount.astype(bool)
+        negative = needs_amount & ~missing & (batch.amounts < 0)
+        outcomes[missing] = MISSING_AMOUNT
+        outcomes[negative] = NEGATIVE_AMOUNT
+        rows = np.flatnonzero(~(missing | negative))
+        new_clients = []
+        settle_scan = None
+        if self.scan_kernel and self.retention is None and len(rows):
+            scanned, scanned_outcomes, new_clients, settle_scan = self.scan_clients(
+                RecordBatch(*(column[rows] for column in batch)))
+            outcomes[rows[scanned]] = scanned_outcomes
+            new_clients = [(rows[row], client_id) for row, client_id in new_clients]
+            rows = np.delete(rows, scanned)
+        # Clients created by the scan are added before the row of their first deposit, as they are one by one, so
+        # accounts keep the same order
+        apply_transaction = self.handler()
+        records = RecordBatch(*(column[rows] for column in batch)).records()
+        results = []
+        start = 0
+        for row, client_id in new_clients:
+            stop = int(np.searchsorted(rows, row))
+            results.extend([apply_transaction(*record) for record in records[start:stop]])
+            self.create_client(client_id)
+            start = stop
+        results.extend([apply_transaction(*record) for record in records[start:]])
+        outcomes[rows] = results
+        if settle_scan is not None:
+            settle_scan()
+        if self.balances is not None:
+            self.publish_balances(np.unique(batch.clients).tolist())
+        return outcomes
+
+    def scan_clients(self, batch):
+        """Run the scan kernel over the clients of a batch of valid records that can be scanned. Accounts are only
+        read, returns (scanned rows, their outcomes, [(row of first deposit, client id)] of the clients it creates,
+        in row order, and settle). Once those clients are created, settle() applies the scanned rows"""
+        order, client_ids, starts = group_clients(batch.clients)
+        lengths = np.diff(np.append(starts, len(order)))
+        # Largest change of balance the rows of every client can make
+        reach = np.add.reduceat(batch.amounts[order].astype(np.float64), starts)
+        selected = scan_candidates(batch, order, starts)
+        balances, exists = [], []
+        for segment, client_id, client_reach in zip(np.flatnonzero(selected).tolist(),
+                                                    client_ids[selected].tolist(), reach[selected].tolist()):
+            if client_id in self.clients:
+                client = self.clients[client_id]
+                if client.locked or max(abs(client.available), abs(client.total)) + client_reach >= SAFE_UNITS:
+                    selected[segment] = False
+                    continue
+                balances.append(client.available)
+                exists.append(True)
+            elif client_reach >= SAFE_UNITS:
+                selected[segment] = False
+            else:
+                balances.append(0)
+                exists.append(False)
+        scanned = order[np.repeat(selected, lengths)]
+        if not len(scanned):
+            return scanned, [], [], lambda: None
+        client_ids = client_ids[selected]
+        scanned_starts = np.concatenate(([0], np.cumsum(lengths[selected])[:-1]))
+        types = batch.types[scanned]
+        exists = np.array(exists, dtype=bool)
+        codes, final = scan_balances(batch.amounts[scanned], types == WITHDRAW, scanned_starts, balances, exists)
+        # Clients without an account are created by their first deposit, if they have one
+        first_deposits = np.minimum.reduceat(np.where(types == DEPOSIT, np.arange(len(scanned)), len(scanned)),
+                                             scanned_starts)
+        created = ~exists & (first_deposits < np.append(scanned_starts[1:], len(scanned)))
+        new_clients = sorted(zip(scanned[first_deposits[created]].tolist(), client_ids[created].tolist()))
+        changes = list(zip(client_ids.tolist(), (final - np.array(balances, dtype=np.int64)).tolist(),
+                           np.logical_or.reduceat(codes == APPLIED_CODE, scanned_starts).tolist()))
+        deposit_rows = scanned[types == DEPOSIT]
+        withdrawal_rows = scanned[types == WITHDRAW]
+        withdrawal_clients, withdrawal_client_rows = np.unique(batch.clients[withdrawal_rows], return_inverse=True)
+
+        def settle():
+            for client_id, change, applied in changes:
+                # Deposits and withdrawals move available and total alike, deposit() moves them by the net change
+                if change:
+                    self.clients[client_id].deposit(change)
+                if applied and self.changed is not None:
+                    self.changed.add(client_id)
+            # No other row of the batch shares the id of a scanned row, so the order they are recorded in doesn't
+            # matter
+            self.txn_index.add_many(batch.txns[deposit_rows].tolist(), list(zip(
+                batch.clients[deposit_rows].tolist(), batch.amounts[deposit_rows].tolist(), repeat(DEPOSIT))))
+            entries = [self.withdrawal_entry(client_id) for client_id in withdrawal_clients.tolist()]
+            self.txn_index.add_many(batch.txns[withdrawal_rows].tolist(),
+                                    [entries[client] for client in withdrawal_client_rows.tolist()])
+            if self.metrics is not None:
+                keys, counts = np.unique(types.astype(np.int64) * len(SCAN_OUTCOMES) + codes, return_counts=True)
+                self.metrics.record_outcomes({(key // len(SCAN_OUTCOMES), SCAN_OUTCOMES[key % len(SCAN_OUTCOMES)]):
+                                              count for key, count in zip(keys.tolist(), counts.tolist())})
+
+        return scanned, SCAN_OUTCOMES[codes], new_clients, settle
+
+    def handler(self):
+        """The transaction_handler() records are applied with, created once"""
+        if self._submit is None:
+            self._submit = self.transaction_handler()
+        return self._submit
+
+    def transaction_handler(self):
+        """apply_transaction, wrapped to note changed accounts when tracked, to advance the transaction index
+        clock when deposits are evicted by age and to record into the engine metrics when they are enabled"""
+        apply_transaction = self.apply_transaction
+        if self.changed is not None:
+            apply_transaction = self.tracking(apply_transaction)
+        if self.txn_index.ages:
+            apply_transaction = self.txn_index.counting(apply_transaction)
+        if self.metrics is None:
+            return apply_transaction
+        return self.metrics.instrument(apply_transaction)
+
+    def tracking(self, apply_transaction):
+        """Wrap an apply_transaction(type, client, txn, amount) callable so clients of applied transactions are
+        added to changed"""
+        changed = self.changed
+
+        def apply_tracked(txn_type, client_id, txn_id, amount):
+            outcome = apply_transaction(txn_type, client_id, txn_id, amount)
+            if outcome == APPLIED:
+                changed.add(client_id)
+            return outcome
+
+        return apply_tracked
+
+    def publish_balances(self, client_ids=None):
+        """Publish the accounts of given clients to balances as a new version, or replace the published accounts
+        with every account. Untouched accounts of a snapshot aren't published, they are read from the snapshot
+        which never changes"""
+        if self.balances is None:
+            return
+        clients = self.clients
+        fallback = None
+        if isinstance(clients, SnapshotAccounts):
+            fallback = snapshot_view(clients.snapshot)
+            clients = clients.store
+        if client_ids is None:
+            self.balances.publish(clients.items(), replace=True, fallback=fallback)
+        else:
+            self.balances.publish((client_id, clients[client_id]) for client_id in client_ids
+                                  if client_id in clients)
+
+    def new_account_store(self):
+        """Empty store for client accounts of the configured kind"""
+        return ACCOUNT_STORES[self.account_store]()
+
+    def new_txn_index(self, resume=False):
+        """Empty transaction index with the configured retention, deposits under dispute are kept. With resume
+        the entries already in its spill file are kept (see TransactionIndex)"""
+        return TransactionIndex(self.retention, keep=self.is_disputed, resume=resume)
+
+    def is_disputed(self, txn_id, client_id):
+        """Whether given transaction of given client is under dispute"""
+        return client_id in self.clients and txn_id in self.clients[client_id].disputed_transactions
+
+    def account_states(self, touched=False):
+        """Plain (available, held, total, locked, disputed transactions) tuple of every client account, with
+        touched and an account snapshot only of the accounts read from it and of new clients"""
+        accounts = self.clients.touched_items() if touched and isinstance(self.clients, SnapshotAccounts) \
+            else self.clients.items()
+        return {client_id: (client.available, client.held, client.total, client.locked,
+                            client.disputed_transactions)
+                for client_id, client in accounts}
+
+    def load_account_states(self, states):
+        """Create client accounts from tuples returned by account_states(), or (available, held, total, locked)
+        tuples of accounts without open disputes"""
+        for client_id, (available, held, total, locked, *disputed_transactions) in states.items():
+            client = Client(client_id, available, held, total, locked)
+            if disputed_transactions:
+                client.disputed_transactions = set(disputed_transactions[0])
+            self.clients[client_id] = client
+
+    def apply_transaction(self, txn_type, client_id, txn_id, amount):
+        """Apply a single decoded transaction (see decoding.py) to the client accounts.
+        Returns APPLIED or the reason the transaction was ignored, see outcomes.py"""
+        if txn_type == DEPOSIT:
+            if not self.is_client_exists(client_id):
+                self.create_client(client_id)
+            self.index_transaction(txn_type, client_id, txn_id, amount)
+            return self.deposit(client_id, amount)
+        elif txn_type == WITHDRAW:
+            self.index_transaction(txn_type, client_id, txn_id, amount)
+            if not self.is_client_exists(client_id):
+                return UNKNOWN_CLIENT
+            return self.withdraw(client_id, amount)
+        elif txn_type == DISPUTE:
+            return self.dispute(client_id, txn_id)
+        elif txn_type == RESOLVE:
+            return self.resolve(client_id, txn_id)
+        elif txn_type == CHARGEBACK:
+            return self.chargeback(client_id, txn_id)
+        return UNKNOWN_TYPE
+
+    def create_client(self, client_id):
+        """Create new client with given client_id"""
+        self.clients[client_id] = Client(client_id, 0, 0, 0, False)
+
+    def is_client_exists(self, client_id):
+        """Check if a client exists"""
+        if client_id in self.clients:
+            return True
+        return False
+
+    def deposit(self, client_id, amount):
+        """Deposit to client account and update the available
+        and total balance of the client account."""
+        return self.clients[client_id].deposit(amount)
+
+    def withdraw(self, client_id, amount):
+        """Withdraw debit's from the client’s account and decrease the available and total balances."""
+        return self.clients[client_id].withdrawal(amount)
+
+    def index_transaction(self, txn_type, client_id, txn_id, amount):
+        """Record a deposit or withdrawal in the transaction index. Withdrawals can never be disputed, they are
+        kept so that a later transaction reusing their id can't be disputed either (see TransactionIndex.add)"""
+        if txn_type == WITHDRAW:
+            self.txn_index.add_entry(txn_id, self.withdrawal_entry(client_id))
+        else:
+            self.txn_index.add(txn_id, client_id, amount, txn_type)
+
+    def withdrawal_entry(self, client_id):
+        """(client, None, WITHDRAW) transaction index entry shared by all withdrawals of given client, their amount
+        is never needed"""
+        entry = self._withdrawal_entries.get(client_id)
+        if entry is None:
+            entry = self._withdrawal_entries[client_id] = (client_id, None, WITHDRAW)
+        return entry
+
+    def disputed_deposit(self, client_id, txn_id):
+        """Look up the deposit referred to by a dispute, resolve or chargeback.
+        Returns (amount, APPLIED) for a deposit of this client, otherwise (None, reason) when the transaction
+        doesn't exist, belongs to another client or isn't a deposit"""
+        entry = self.txn_index.get(txn_id)
+        if entry is None:
+            return None, UNKNOWN_TXN
+        deposit_client_id, amount, txn_type = entry
+        if client_id != deposit_client_id:
+            return None, CLIENT_MISMATCH
+        if not self.is_client_exists(client_id):
+            return None, UNKNOWN_CLIENT
+        if txn_type != DEPOSIT:
+            return None, NOT_A_DEPOSIT
+        return amount, APPLIED
+
+    def dispute(self, client_id, txn_id):
+        """When client raises a dispute for a specific transaction for error or issue.
+        Dispute has transaction id , amount picked from original transaction using transaction Id"""
+        amount, outcome = self.disputed_deposit(client_id, txn_id)
+        if amount is None:
+            return outcome
+        return self.clients[client_id].dispute(amount, txn_id)
+
+    def resolve(self, client_id, txn_id):
+        """Resolve represents a resolution to a dispute. Resolve does not specify an amount just like dispute,
+        it has transaction id which refers to transaction in dispute and now been resolved.
+        Only action if transaction id exist else do nothing"""
+        amount, outcome = self.disputed_deposit(client_id, txn_id)
+        if amount is None:
+            return outcome
+        return self.clients[client_id].resolve(amount, txn_id)
+
+    def chargeback(self, client_id, txn_id):
+        """Chargeback represents the client reversing a transaction. Chargeback does not specify an amount like dispute,
+        it has transaction id which refers to transaction in dispute and now been resolved.
+        Only action if transaction id exist else do nothing"""
+        amount, outcome = self.disputed_deposit(client_id, txn_id)
+        if amount is None:
+            return outcome
+        return self.clients[client_id].chargeback(amount, txn_id)
+
+    def account_row(self, client_id):
+        """Output columns (client, available, held, total, locked) of given client"""
+        client = self.clients[client_id]
+        return (client_id, format_amount(client.available), format_amount(client.held),
+                format_amount(client.total), client.locked)
+
+    def output_accounts(self, changed_only=False, sort=False):
+        """(client id, account) pairs to write: every account in the order they were added, or with changed_only
+        only the accounts changed by transactions applied since the engine was created (needs track_changes),
+        with sort ordered by client id"""
+        if changed_only:
+            if self.changed is None:
+                raise ValueError("writing only changed accounts needs an engine created with track_changes=True")
+            changed = self.changed
+            # Changed accounts have all been read into memory, untouched snapshot accounts needn't be looked at
+            accounts = self.clients.touched_items() if isinstance(self.clients, SnapshotAccounts) \
+                else self.clients.items()
+            accounts = ((client_id, client) for client_id, client in accounts if client_id in changed)
+        else:
+            accounts = self.clients.items()
+        if sort:
+            return sorted(accounts, key=itemgetter(0))
+        return accounts
+
+
+def snapshot_view(snapshot):
+    """BalanceBoard fallback reading the accounts of an AccountSnapshot"""
+    def view(client_id):
+        row = snapshot.row_of(client_id)
+        if row is None:
+            return None
+        return BalanceView(*snapshot.account(row)[1:], 0)
+
+    return view
@@ -0,0 +1,269 @@
+# Engine instrumentation: counts of processed transactions per type and outcome, latency histograms per
+# transaction type and an optional sampling profiler. Nothing here runs unless the engine is given an
+# EngineMetrics, the uninstrumented apply loop stays as it is.
+import json
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows
+    resource = None
+from src.decoding import TXN_TYPE_NAMES
+from src.outcomes import APPLIED
+
+# Latency histogram bucket n counts transactions that took less than 2**n nanoseconds
+HISTOGRAM_BUCKETS = 48
+
+
+class EngineMetrics:
+    """Collects per transaction type counts of processed, applied and ignored (by reason) transactions
+    and, with latency=True, a log2 histogram of the time spent applying each transaction.
+    With report_every set, a report is emitted every that many transactions during the run: applied one by one or
+    in batches, or routed to sharded workers whose counts are only merged when they finish (see route()).
+    reporter is called with the as_dict() of every report, by default it writes a JSON line to stderr.
+    A profiler sent to sharded workers samples each of them, their samples are merged into it."""
+
+    def __init__(self, latency=True, report_every=None, reporter=None, profiler=None):
+        self.latency = latency
+        self.report_every = report_every
+        self.reporter = reporter
+        self.profiler = profiler
+        self.counts = {}
+        self.histograms = {}
+        self.errors = []
+        self.rejected = {}
+        self.dispute_window = {}
+        # Transactions sent to sharded workers
+        self.routed = 0
+        # Transactions since the last periodic report
+        self._unreported = 0
+        self.started = None
+        self.elapsed = 0.0
+
+    def __getstate__(self):
+        # Sent to sharded workers without the reporter, which stays with the parent
+        state = dict(self.__dict__)
+        state.update(reporter=None)
+        return state
+
+    def instrument(self, apply_transaction):
+        """Wrap an apply_transaction(type, client, txn, amount) callable so it records into these metrics"""
+        counts = self.counts
+        histograms = self.histograms
+        latency = self.latency
+        report_every = self.report_every or 0
+        perf_counter_ns = time.perf_counter_ns
+
+        def apply_instrumented(txn_type, client_id, txn_id, amount):
+            if latency:
+                start = perf_counter_ns()
+                outcome = apply_transaction(txn_type, client_id, txn_id, amount)
+                elapsed = perf_counter_ns() - start
+                histogram = histograms.get(txn_type)
+                if histogram is None:
+                    histogram = histograms[txn_type] = [0] * HISTOGRAM_BUCKETS
+                histogram[min(elapsed.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+            else:
+                outcome = apply_transaction(txn_type, client_id, txn_id, amount)
+            key = (txn_type, outcome)
+            counts[key] = counts.get(key, 0) + 1
+            if report_every:
+                self._unreported += 1
+                if self._unreported >= report_every:
+                    self._unreported = 0
+                    self.report()
+            return outcome
+
+        return apply_instrumented
+
+    def record_outcomes(self, counts):
+        """Add counts by (type, outcome) of transactions applied without instrument(), whose latency isn't known"""
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.advance(sum(counts.values()))
+
+    def route(self, transactions=1):
+        """Count transactions sent to sharded workers, towards the next periodic report too"""
+        self.routed += transactions
+        self.advance(transactions)
+
+    def advance(self, transactions):
+        """Emit a periodic report if report_every transactions have passed since the last one"""
+        if self.report_every:
+            self._unreported += transactions
+            if self._unreported >= self.report_every:
+                self._unreported %= self.report_every
+                self.report()
+
+    def record_rejects(self, counts):
+        """Record counts by reason of rows rejected before reaching the engine, see decoding.py"""
+        self.rejected = dict(counts)
+
+    def record_dispute_window(self, counters):
+        """Record the eviction counters of the transaction index, see TransactionIndex"""
+        self.dispute_window = dict(counters)
+
+    def record_error(self, error):
+        """Record an error that stopped processing"""
+        self.errors.append(f"{type(error).__name__}: {error}")
+
+    def start(self):
+        """Called when processing starts"""
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def stop(self):
+        """Called when processing ends"""
+        if self.started is not None:
+            self.elapsed += time.perf_counter() - self.started
+            self.started = None
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def merge(self, other):
+        """Add counts and histograms collected by another EngineMetrics, e.g. of a sharded worker"""
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        for txn_type, other_histogram in other.histograms.items():
+            histogram = self.histograms.setdefault(txn_type, [0] * HISTOGRAM_BUCKETS)
+            for bucket, count in enumerate(other_histogram):
+                histogram[bucket] += count
+        for name, count in other.dispute_window.items():
+            self.dispute_window[name] = self.dispute_window.get(name, 0) + count
+        self.errors.extend(other.errors)
+        if self.profiler is not None and other.profiler is not None:
+            self.profiler.merge(other.profiler)
+
+    def as_dict(self):
+        """Metrics as a JSON serializable dict"""
+        by_type = {}
+        for (txn_type, outcome), count in sorted(self.counts.items()):
+            stats = by_type.setdefault(type_name(txn_type), {"processed": 0, "applied": 0, "ignored": {}})
+            stats["processed"] += count
+            if outcome == APPLIED:
+                stats["applied"] += count
+            else:
+                stats["ignored"][outcome] = count
+        processed = sum(self.counts.values())
+        elapsed = self.elapsed + (time.perf_counter() - self.started if self.started is not None else 0.0)
+        return {
+            "processed": processed,
+            "applied": sum(stats["applied"] for stats in by_type.values()),
+            "ignored": processed - sum(stats["applied"] for stats in by_type.values()),
+            "routed": self.routed,
+            "elapsed_seconds": elapsed,
+            "by_type": by_type,
+            "rejected": dict(self.rejected),
+            "dispute_window": dict(self.dispute_window),
+            "latency_ns": {type_name(txn_type): histogram_summary(histogram)
+                           for txn_type, histogram in sorted(self.histograms.items())},
+            "errors": list(self.errors),
+        }
+
+    def report(self):
+        """Emit the current metrics to the reporter"""
+        if self.reporter is not None:
+            self.reporter(self.as_dict())
+        else:
+            write_json_line(self.as_dict(), sys.stderr)
+
+    def write(self, path):
+        """Write the current metrics as JSON to given path"""
+        with open(path, "w") as output:
+            json.dump(self.as_dict(), output, indent=2)
+            output.write("\n")
+
+
+def type_name(txn_type):
+    """Name of a transaction type code"""
+    return TXN_TYPE_NAMES[txn_type] if 0 <= txn_type < len(TXN_TYPE_NAMES) else str(txn_type)
+
+
+def peak_rss_bytes(children=False):
+    """Peak resident set size of this process in bytes or, with children, that of the largest of its finished
+    child processes. 0 where it can't be measured (Windows)"""
+    if resource is None:  # pragma: no cover
+        return 0
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return unit * resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+
+
+def write_json_line(metrics, stream):
+    stream.write(json.dumps(metrics) + "\n")
+    stream.flush()
+
+
+def histogram_summary(histogram):
+    """Count, approximate percentiles (upper bucket bounds) and non empty buckets of a latency histogram"""
+    count = sum(histogram)
+    summary = {"count": count}
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)):
+        threshold = fraction * count
+        seen = 0
+        for bucket, bucket_count in enumerate(histogram):
+            seen += bucket_count
+            if bucket_count and seen >= threshold:
+                summary[name] = 2 ** bucket
+                break
+    summary["buckets"] = {f"<{2 ** bucket}": bucket_count for bucket, bucket_count in enumerate(histogram)
+                          if bucket_count}
+    return summary
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that starts it from a background thread every interval seconds.
+    Samples are counted per collapsed stack ("module:function;module:function" from outermost to innermost
+    frame), the format read by flame graph tools."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+        self._target = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def __getstate__(self):
+        # Sent to sharded workers with its samples only, a worker starts its own sampling thread
+        return {"interval": self.interval, "samples": self.samples}
+
+    def __setstate__(self, state):
+        self.__init__(state["interval"])
+        self.samples = state["samples"]
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def merge(self, other):
+        """Add the samples of another profiler, e.g. of a sharded worker"""
+        for stack, count in other.samples.items():
+            self.samples[stack] = self.samples.get(stack, 0) + count
+
+    def write_collapsed(self, path):
+        """Write samples as collapsed stacks, one "stack count" line each"""
+        with open(path, "w") as output:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                output.write(f"{stack} {count}\n")
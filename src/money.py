@@ -0,0 +1,45 @@
+# Money amounts are held as integers counting 1/10000 units (four decimal places). Amounts are parsed once when
+# they are read and only turned back into text when results are written.
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN, localcontext
+
+DECIMAL_PLACES = 4
+SCALE = 10 ** DECIMAL_PLACES
+# Largest balance in units: the columnar account store and the binary formats hold balances in int64
+MAX_UNITS = 2 ** 63 - 1
+
+
+def parse_amount(text):
+    """Parse a decimal amount such as "2.5" into integer units, extra decimal places are rounded half to even"""
+    text = text.strip()
+    whole, _, fraction = text.partition(".")
+    digits = whole.lstrip("+-")
+    if len(whole) - len(digits) <= 1 and (digits.isdigit() or (not digits and fraction)) \
+            and (fraction.isdigit() or not fraction) and len(fraction) <= DECIMAL_PLACES:
+        units = int(digits or "0") * SCALE + int(fraction.ljust(DECIMAL_PLACES, "0"))
+        return -units if whole.startswith("-") else units
+    return _parse_amount_exact(text)
+
+
+def _parse_amount_exact(text):
+    """Slow path of parse_amount for exponents and amounts with more than four decimal places"""
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"invalid amount: {text!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"invalid amount: {text!r}")
+    with localcontext() as ctx:
+        ctx.prec = max(amount.adjusted() + DECIMAL_PLACES + 2, 28)
+        return int(amount.scaleb(DECIMAL_PLACES).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def format_amount(units):
+    """Format integer units as a decimal string with four decimal places"""
+    sign = "-" if units < 0 else ""
+    whole, fraction = divmod(abs(units), SCALE)
+    return f"{sign}{whole}.{fraction:04d}"
+
+
+def to_decimal(units):
+    """Exact Decimal value of given integer units"""
+    return Decimal(format_amount(units))
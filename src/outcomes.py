@@ -0,0 +1,18 @@
+# Outcome of applying one transaction: either APPLIED or the reason the transaction was ignored.
+# Returned by the Client methods and PaymentEngine.apply_transaction
+APPLIED = "applied"
+
+# Reasons a transaction is ignored
+LOCKED_ACCOUNT = "locked_account"
+INSUFFICIENT_FUNDS = "insufficient_funds"
+UNKNOWN_CLIENT = "unknown_client"
+UNKNOWN_TXN = "unknown_txn"
+CLIENT_MISMATCH = "client_mismatch"
+NOT_A_DEPOSIT = "not_a_deposit"
+NOT_DISPUTED = "not_disputed"
+MISSING_AMOUNT = "missing_amount"
+UNKNOWN_TYPE = "unknown_type"
+BALANCE_OVERFLOW = "balance_overflow"
+
+IGNORED_REASONS = (LOCKED_ACCOUNT, INSUFFICIENT_FUNDS, UNKNOWN_CLIENT, UNKNOWN_TXN, CLIENT_MISMATCH, NOT_A_DEPOSIT,
+                   NOT_DISPUTED, MISSING_AMOUNT, UNKNOWN_TYPE, BALANCE_OVERFLOW)
@@ -1,184 +1,325 @@
+import os
+import io
 import sys
 import csv
-import numpy as np
-import pandas as pd
-from decimal import *
-
-# Setting decimal precision to 4
-getcontext().prec = 4
-
-# Client class holds all the client related details
-class Client:
-
-    def __init__(self, client_id, available, held, total, locked):
-        self.client_id = client_id
-        self.available_balance = available
-        self.held_amount = held
-        self.total_amount = total
-        self.disputed_transactions = set()
-        self.locked = locked
-
-    def deposit(self, amount):
-        """Deposit given amount in clients account """
-        if not self.locked:
-            self.available_balance += Decimal(str(amount))
-            self.total_amount += Decimal(str(amount))
-
-    def withdrawal(self, amount):
-        """Withdraw/Debit given amount from the clients account """
-        if not self.locked and self.available_balance >= Decimal(str(amount)):
-            self.available_balance -= Decimal(str(amount))
-            self.total_amount -= Decimal(str(amount))
-
-    def dispute(self, disputed_amount, txn_id):
-        """When client raises a dispute for a specific transaction,the associated amount should be held.
-        Clients available balance should decrease by the amount disputed but the total fund should remain the same until
-        dispute resolved or charged back"""
-        if not self.locked and self.available_balance >= Decimal(str(disputed_amount)):
-            self.available_balance -= Decimal(str(disputed_amount))
-            self.held_amount += Decimal(str(disputed_amount))
-            self.disputed_transactions.add(txn_id)
-
-    def resolve(self, disputed_amount, txn_id):
-        """Resolve indicates resolution to a dispute and releases held amounts for the transaction.
-        Disputed/held amount should move from held balance to available balances."""
-        if not self.locked and txn_id in self.disputed_transactions:
-            self.held_amount -= Decimal(disputed_amount)
-            self.available_balance += Decimal(disputed_amount)
-            self.disputed_transactions.remove(txn_id)
-
-    def chargeback(self, disputed_amount, txn_id):
-        """Chargeback indicates another final state of a disputed transaction.
-        It represents the client reversing a transaction.Disputed amount should be removed from held amount
-        and total balances should be reduced by disputed amount."""
-        if not self.locked and txn_id in self.disputed_transactions:
-            self.held_amount -= Decimal(disputed_amount)
-            self.total_amount -= Decimal(disputed_amount)
-            self.locked = True
-            self.disputed_transactions.remove(txn_id)
-
-
-# PaymentEngine class is the main class to process all transactions from transactions input file
-class PaymentEngine:
-
-    def __init__(self, transactions_file, client_details_file):
-        self.transactions_df = pd.read_csv(transactions_file)
+import argparse
+from itertools import islice
+
+if __package__ in (None, ""):  # pragma: no cover - executed as a script: python src/payment_engine.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.binary_format import BinaryTransactionReader, write_account_states
+from src.checkpoint import read_checkpoint, write_checkpoint
+from src.decoding import DEPOSIT, RejectWriter
+from src.ingest import ParallelTransactionReader, TransactionReader, frame_batches, read_transactions_frame
+from src.ledger import ACCOUNT_STORES, Client, Ledger
+from src.metrics import EngineMetrics, SamplingProfiler
+from src.money import format_amount
+from src.sharding import run_sharded
+from src.snapshot import OUTPUT_HEADER, AccountSnapshot, SnapshotAccounts, is_snapshot, read_account_rows
+from src.txn_index import RetentionPolicy
+
+
+# Output rows are formatted and written to stdout this many at a time
+OUTPUT_BATCH_ROWS = 10000
+
+
+# PaymentEngine class is the main class to process all transactions from transactions input file, a Ledger fed
+# from the transactions file with the client accounts written out at the end
+class PaymentEngine(Ledger):
+
+    def __init__(self, transactions_file, client_details_file, streaming=False, workers=1, account_store="objects",
+                 metrics=None, rejects=None, retention=None, parse_workers=1, input_format="csv",
+                 track_changes=False, scan_kernel=False, share_balances=False):
+        # In streaming mode transactions are read and applied one row at a time, only accounts and
+        # the transaction index (see txn_index.py) are kept in memory.
+        # With more than one worker transactions are applied in worker processes partitioned by client.
+        # Rows of the transactions file that can't be decoded go to rejects, a RejectWriter.
+        # With more than one parse worker a streamed transactions file is parsed in that many processes.
+        # input_format is "csv", or "binary" for a binary transactions file (see binary_format.py) which is
+        # always read through a memory mapping, in streaming mode or not.
+        # account_store, metrics, retention, track_changes, scan_kernel and share_balances are those of the Ledger,
+        # with scan_kernel or share_balances transactions are read and applied in batches (see Ledger.apply_batch)
+        super().__init__(account_store=account_store, metrics=metrics, retention=retention,
+                         track_changes=track_changes, scan_kernel=scan_kernel,
+                         share_balances=share_balances)
+        self.streaming = streaming
+        self.workers = workers
+        self.rejects = rejects if rejects is not None else RejectWriter()
+        self.parse_workers = parse_workers
+        self.input_format = input_format
+        self.transactions_file = transactions_file
+        # Position in the transactions file up to which transactions have been applied, see TransactionReader
+        self.transactions_offset = 0
+        self.transactions_reader = None
+        # Whether the spill files of sharded workers hold deposits of this engine, from a checkpoint or an earlier
+        # sharded run, rather than of an unrelated run
+        self.resume_spills = False
+        # Error that stopped the last processing of the transactions file, see report_error
+        self.error = None
+        # Largest sum of the peak RSS of the workers of a sharded run, in bytes. Pages a worker shares with this
+        # process count in both
+        self.workers_peak_rss_bytes = 0
+        self.transactions_df = None
+        if not streaming and input_format == "csv":
+            self.transactions_df = read_transactions_frame(transactions_file, self.rejects)
         self.output_file = None
-        self.clients = {}
-        df1 = pd.read_csv(client_details_file)
-        df1['locked'] = df1['locked'].astype('bool')
-        clients_dict = df1.set_index("client").to_dict("index")
-        for key, value in clients_dict.items():
-            self.clients[key] = Client(key, Decimal(value['available']), Decimal(value['held']),
-                                       Decimal(value['total']), (value['locked']))
+        # Existing accounts come from a CSV, or from an account snapshot (see snapshot.py) whose accounts are
+        # only read when a transaction touches them
+        if client_details_file is not None:
+            if is_snapshot(client_details_file):
+                self.clients = SnapshotAccounts(AccountSnapshot(client_details_file), self.clients, Client)
+            else:
+                for client_id, available, held, total, locked in read_account_rows(client_details_file):
+                    self.clients[client_id] = Client(client_id, available, held, total, locked)
+            self.publish_balances()
+
+    def transactions(self):
+        """Iterate over decoded (type code, client, txn, amount) tuples of the transactions to process"""
+        if self.transactions_df is not None:
+            return self.transactions_df.itertuples(index=False, name=None)
+        self.transactions_reader = self.new_transactions_reader()
+        return iter(self.transactions_reader)
+
+    def transaction_batches(self):
+        """Iterate over RecordBatches of the transactions to process"""
+        if self.transactions_df is not None:
+            return frame_batches(self.transactions_df)
+        self.transactions_reader = self.new_transactions_reader()
+        return self.transactions_reader.batches()
 
-        self.txn_array = self.transactions_df[["txn"]].to_numpy(dtype=np.uint32)
+    def new_transactions_reader(self):
+        """Reader of the transactions file from transactions_offset on"""
+        if self.input_format == "binary":
+            return BinaryTransactionReader(self.transactions_file, self.transactions_offset, self.rejects)
+        if self.parse_workers > 1 and isinstance(self.transactions_file, (str, os.PathLike)):
+            return ParallelTransactionReader(self.transactions_file, self.transactions_offset, self.rejects,
+                                             self.parse_workers)
+        return TransactionReader(self.transactions_file, self.transactions_offset, self.rejects)
 
     def process_transactions(self):
-        """Process all transactions from input transactions file."""
-        try:
-            for idx, txn_data in self.transactions_df.iterrows():
-                if txn_data["type"] == "deposit":
-                    if not self.is_client_exists(txn_data["client"]):
-                        self.create_client(txn_data["client"])
-                    self.deposit(txn_data)
-
-                if txn_data["type"] == "withdraw":
-                    self.withdraw(txn_data)
-
-                if txn_data["type"] == "dispute":
-                    self.dispute(txn_data)
-
-                if txn_data["type"] == "resolve":
-                    self.resolve(txn_data)
-
-                if txn_data["type"] == "chargeback":
-                    self.chargeback(txn_data)
-        except Exception as e:
-            print(f"Exception: {e}")
-
-    def create_client(self, client_id):
-        """Create new client with given client_id"""
-        self.clients[client_id] = Client(client_id, 0, 0, 0, False)
-
-    def is_client_exists(self, client_id):
-        """Check if a client exists"""
-        if client_id in self.clients:
-            return True
-        return False
-
-    def deposit(self, txn_data):
-        """Deposit to client account and update the available
-        and total balance of the client account."""
-        client, amount = txn_data["client"], txn_data["amount"]
-        client_data = self.clients[client]
-        client_data.deposit(amount)
-
-    def withdraw(self, txn_data):
-        """Withdraw debit's from the client’s account and decrease the available and total balances."""
-        client, amount = txn_data["client"], txn_data["amount"]
-        client_data = self.clients[client]
-        client_data.withdrawal(amount)
-
-    def dispute(self, txn_data):
-        """When client raises a dispute for a specific transaction for error or issue.
-        Dispute has transaction id , amount picked from original transaction using transaction Id"""
-        txn_id = txn_data["txn"]
-        if txn_id in self.txn_array:
-            client_txn_data = self.transactions_df.query('txn == @txn_id & type != "dispute"').iloc[0, :]
-            if txn_data["client"] == client_txn_data["client"] \
-                    and self.is_client_exists(txn_data["client"]) \
-                    and client_txn_data['type'] == "deposit":
-                client_data = self.clients[txn_data["client"]]
-                client_data.dispute(client_txn_data["amount"], client_txn_data["txn"])
-
-    def resolve(self, txn_data):
-        """Resolve represents a resolution to a dispute. Resolve does not specify an amount just like dispute,
-        it has transaction id which refers to transaction in dispute and now been resolved.
-        Only action if transaction id exist else do nothing"""
-        txn_id = txn_data["txn"]
-        if txn_id in self.txn_array:
-            client_txn_data = self.transactions_df.query('txn == @txn_id & type != "dispute"').iloc[0, :]
-            if txn_data["client"] == client_txn_data["client"] \
-                    and self.is_client_exists(txn_data["client"]) \
-                    and client_txn_data["type"] == "deposit":
-                client_data = self.clients[txn_data["client"]]
-                client_data.resolve(client_txn_data["amount"],
-                                    client_txn_data["txn"])
-
-    def chargeback(self, txn_data):
-        """Chargeback represents the client reversing a transaction. Chargeback does not specify an amount like dispute,
-        it has transaction id which refers to transaction in dispute and now been resolved.
-        Only action if transaction id exist else do nothing"""
-        txn_id = txn_data["txn"]
-        if txn_id in self.txn_array:
-            client_txn_data = self.transactions_df.query('txn == @txn_id & type != "dispute"').iloc[0, :]
-            if txn_data["client"] == client_txn_data["client"] \
-                    and self.is_client_exists(txn_data["client"]) \
-                    and client_txn_data["type"] == "deposit":
-                client_data = self.clients[txn_data["client"]]
-                client_data.chargeback(client_txn_data["amount"], client_txn_data["txn"])
-
-    def write_results(self):
-        header = ["client", "available", "held", "total", "locked"]
-        self.output_file = csv.DictWriter(sys.stdout, header)
-        self.output_file.writeheader()
-        for client_id, client in self.clients.items():
-            self.output_file.writerow({
-                "client": client_id,
-                "available": client.available_balance,
-                "held": client.held_amount,
-                "total": client.total_amount,
-                "locked": client.locked
-            })
+        """Process all transactions from input transactions file. If an error stops processing it is reported and
+        transactions_offset isn't advanced, so a checkpoint of this run can't skip rows that weren't applied."""
+        self.error = None
+        if self.metrics is not None:
+            self.metrics.start()
+        if self.workers > 1:
+            try:
+                self.process_transactions_sharded()
+            except Exception as e:
+                self.report_error(e)
+        elif self.scan_kernel or self.balances is not None:
+            try:
+                for batch in self.transaction_batches():
+                    self.apply_batch(batch)
+            except Exception as e:
+                self.report_error(e)
+        else:
+            apply_transaction = self.transaction_handler()
+            try:
+                for txn_type, client_id, txn_id, amount in self.transactions():
+                    apply_transaction(txn_type, client_id, txn_id, amount)
+            except Exception as e:
+                self.report_error(e)
+        if self.transactions_reader is not None and self.error is None:
+            self.transactions_offset = self.transactions_reader.offset
+        if self.metrics is not None:
+            self.metrics.record_rejects(self.rejects.counts)
+            if self.workers <= 1:
+                self.metrics.record_dispute_window(self.txn_index.counters)
+            self.metrics.stop()
+
+    def report_error(self, error):
+        """Report an error that stopped processing of the transactions file"""
+        print(f"Exception: {error}")
+        self.error = error
+        if self.metrics is not None:
+            self.metrics.record_error(error)
+
+    def process_transactions_sharded(self):
+        """Process all transactions across worker processes, each owning the clients of its shard.
+        Gives the same client accounts, in the same order, as processing them in this process.
+        If a worker fails its error is raised and the accounts are left as they were before."""
+        new_clients = []
+        # With an account snapshot workers read it themselves, only the accounts read from it are sent and merged
+        snapshot = self.clients.snapshot if isinstance(self.clients, SnapshotAccounts) else None
+
+        def records():
+            # Note new clients in order of their first deposit so output order matches a serial run. Untouched
+            # snapshot accounts are looked up in the snapshot when first deposited to, they aren't new
+            known_clients = set(self.clients.store if snapshot is not None else self.clients)
+            # Workers' counts are only merged when they finish, periodic reports follow the records sent to them
+            route = self.metrics.route if self.metrics is not None else None
+            try:
+                for record in self.transactions():
+                    if record[0] == DEPOSIT and record[1] not in known_clients:
+                        known_clients.add(record[1])
+                        if record[1] not in self.clients:
+                            new_clients.append(record[1])
+                    if route is not None:
+                        route()
+                    yield record
+            except Exception as e:
+                self.report_error(e)
+
+        engine_options = {"account_store": self.account_store, "retention": self.retention,
+                          "track_changes": self.changed is not None, "resume": self.resume_spills,
+                          "snapshot": None if snapshot is None else snapshot.path}
+        if self.metrics is not None:
+            # Every worker samples itself, the samples are merged with the metrics
+            profiler = self.metrics.profiler
+            profiler = None if profiler is None else SamplingProfiler(profiler.interval)
+            engine_options["metrics"] = EngineMetrics(latency=self.metrics.latency, profiler=profiler)
+        publish = None
+        if self.balances is not None:
+            # Accounts of the batches workers applied are published as they come, all of them once merged
+            def publish(states):
+                self.balances.publish((client_id, Client(client_id, *state)) for client_id, state in states)
+        states, index_entries, changed, worker_metrics, worker_peak_rss = run_sharded(
+            records(), self.account_states(touched=True), self.txn_index.entries(), self.workers,
+            engine_options=engine_options, publish=publish)
+        self.workers_peak_rss_bytes = max(self.workers_peak_rss_bytes, sum(worker_peak_rss))
+        self.resume_spills = True
+        for metrics in worker_metrics:
+            self.metrics.merge(metrics)
+        client_order = list(self.clients.store if snapshot is not None else self.clients) + new_clients
+        self.clients = self.new_account_store()
+        if snapshot is not None:
+            self.clients = SnapshotAccounts(snapshot, self.clients, Client)
+            # Snapshot accounts first read by the workers iterate in snapshot order wherever they are added
+            client_order = list(dict.fromkeys(client_order + list(states)))
+        self.load_account_states({client_id: states[client_id] for client_id in client_order})
+        self.txn_index.update(index_entries)
+        if changed is not None:
+            self.changed.update(changed)
+        self.publish_balances()
+
+    def save_checkpoint(self, path):
+        """Save client accounts, transaction index and transactions file offset so a later run can resume"""
+        if not self.streaming:
+            raise ValueError("checkpoints record how far the transactions file was read, which needs streaming mode")
+        if self.error is not None:
+            raise ValueError(f"processing stopped on an error, the accounts don't match a position in the "
+                             f"transactions file: {self.error}")
+        self.txn_index.flush()
+        write_checkpoint(path, self.account_states(), self.txn_index.entries(), self.transactions_offset)
+
+    def load_checkpoint(self, path):
+        """Replace engine state with a saved checkpoint, processing then continues with the transactions
+        appended to the transactions file after the checkpoint was saved"""
+        state = read_checkpoint(path)
+        offset = state["transactions_offset"]
+        if isinstance(self.transactions_file, (str, os.PathLike)) and os.path.getsize(self.transactions_file) < offset:
+            raise ValueError(f"{self.transactions_file} is shorter than when checkpoint {path} was saved")
+        self.clients = self.new_account_store()
+        self.load_account_states(state["accounts"])
+        self.txn_index = self.new_txn_index(resume=True)
+        self.txn_index.update(state["txn_index"])
+        self.resume_spills = True
+        self.transactions_offset = offset
+        self.publish_balances()
+
+    def write_results_binary(self, output=None, changed_only=False, sort=False):
+        """Write client accounts as a binary account states file (see binary_format.py) to output,
+        a binary stream, by default stdout. changed_only and sort select accounts like output_accounts"""
+        if output is None:
+            sys.stdout.flush()
+            output = sys.stdout.buffer
+        write_account_states(output, self.output_accounts(changed_only, sort))
+        output.flush()
+
+    def write_results(self, changed_only=False, sort=False):
+        """Write client accounts as CSV to stdout, changed_only and sort select accounts like output_accounts.
+        Rows are formatted and written in batches of OUTPUT_BATCH_ROWS"""
+        self.output_file = csv.writer(sys.stdout)
+        self.output_file.writerow(OUTPUT_HEADER)
+        if isinstance(self.clients, SnapshotAccounts) and not changed_only and not sort:
+            self.clients.write_rows(sys.stdout, self.write_account)
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        accounts = iter(self.output_accounts(changed_only, sort))
+        while True:
+            writer.writerows((client_id, format_amount(client.available), format_amount(client.held),
+                              format_amount(client.total), client.locked)
+                             for client_id, client in islice(accounts, OUTPUT_BATCH_ROWS))
+            if not buffer.tell():
+                break
+            sys.stdout.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+
+    def write_account(self, client_id, client):
+        self.output_file.writerow((client_id, format_amount(client.available), format_amount(client.held),
+                                   format_amount(client.total), client.locked))
 
 
 if __name__ == '__main__': # pragma: no cover
     client_account_csv = 'src/clients_existing_accounts_balances.csv'
-    try:
-        transactions_csv = sys.argv[1]
-    except IndexError:
-        transactions_csv = 'transactions.csv'
-    payment_engine = PaymentEngine(transactions_csv, client_account_csv)
+    parser = argparse.ArgumentParser(description="Process transactions and write client accounts to stdout")
+    parser.add_argument("transactions_csv", nargs="?", default="transactions.csv")
+    parser.add_argument("--accounts", default=client_account_csv, metavar="PATH",
+                        help="existing client accounts, a CSV or an account snapshot (see src/snapshot.py)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes, transactions are partitioned across them by client")
+    parser.add_argument("--input-format", choices=("csv", "binary"), default="csv",
+                        help="format of the transactions file, see src/binary_format.py for the binary format")
+    parser.add_argument("--output-format", choices=("csv", "binary"), default="csv",
+                        help="format of the client accounts written to stdout")
+    parser.add_argument("--output-mode", choices=("full", "changes"), default="full",
+                        help="write every client account, or only the accounts changed by this run's transactions")
+    parser.add_argument("--sort", action="store_true", help="write client accounts ordered by client id")
+    parser.add_argument("--parse-workers", type=int, default=1,
+                        help="number of processes parsing the transactions file, records are applied in file order")
+    parser.add_argument("--account-store", choices=sorted(ACCOUNT_STORES), default="objects",
+                        help="how client accounts are held in memory")
+    parser.add_argument("--scan-kernel", action="store_true",
+                        help="apply the transactions of clients that only deposit and withdraw in vectorized batches")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="resume from this checkpoint if it exists, and save the state to it after processing")
+    parser.add_argument("--metrics", metavar="PATH", help="write processing metrics as JSON to this file")
+    parser.add_argument("--metrics-every", type=int, metavar="N",
+                        help="also write metrics as a JSON line to stderr every N transactions")
+    parser.add_argument("--profile", metavar="PATH", help="sample the engine and write collapsed stacks to this file")
+    parser.add_argument("--rejects", metavar="PATH",
+                        help="write rows of the transactions file that can't be decoded, with the reason, to this CSV")
+    parser.add_argument("--dispute-window", type=int, metavar="N",
+                        help="keep deposits disputable in memory for N transactions after them")
+    parser.add_argument("--dispute-memory", type=int, metavar="MB",
+                        help="keep at most about MB megabytes of disputable deposits in memory, evicting the oldest")
+    parser.add_argument("--dispute-spill", metavar="PATH",
+                        help="write deposits evicted from memory to this file and look disputes up there")
+    args = parser.parse_args()
+    metrics = None
+    if args.metrics or args.metrics_every or args.profile:
+        metrics = EngineMetrics(report_every=args.metrics_every,
+                                profiler=SamplingProfiler() if args.profile else None)
+    rejects_file = open(args.rejects, "w", newline="") if args.rejects else None
+    retention = None
+    if args.dispute_window or args.dispute_memory or args.dispute_spill:
+        retention = RetentionPolicy(max_age=args.dispute_window,
+                                    max_bytes=args.dispute_memory * 2 ** 20 if args.dispute_memory else None,
+                                    spill_path=args.dispute_spill)
+    resume = args.checkpoint is not None and os.path.exists(args.checkpoint)
+    payment_engine = PaymentEngine(args.transactions_csv, None if resume else args.accounts, streaming=True,
+                                   workers=args.workers, account_store=args.account_store, metrics=metrics,
+                                   rejects=RejectWriter(rejects_file), retention=retention,
+                                   parse_workers=args.parse_workers, input_format=args.input_format,
+                                   track_changes=args.output_mode == "changes", scan_kernel=args.scan_kernel)
+    if resume:
+        payment_engine.load_checkpoint(args.checkpoint)
     payment_engine.process_transactions()
-    payment_engine.write_results()
+    # After an error the checkpoint saved by the last successful run is kept, resuming from it retries the rows
+    if args.checkpoint is not None and payment_engine.error is None:
+        payment_engine.save_checkpoint(args.checkpoint)
+    if args.metrics:
+        metrics.write(args.metrics)
+    if args.profile:
+        metrics.profiler.write_collapsed(args.profile)
+    if rejects_file is not None:
+        rejects_file.close()
+    changed_only = args.output_mode == "changes"
+    if args.output_format == "binary":
+        payment_engine.write_results_binary(changed_only=changed_only, sort=args.sort)
+    else:
+        payment_engine.write_results(changed_only=changed_only, sort=args.sort)
@@ -0,0 +1,98 @@
+# Vectorized scan of clients that only deposit and withdraw. For such a client the final available balance is an
+# ordered scan of its rows: deposits always apply, a withdrawal applies only when the running available balance
+# covers it, like Client.withdrawal. The scan runs over the rows of every such client of a batch at once with
+# NumPy, the engine applies the other rows one by one (see Ledger.apply_batch).
+import numpy as np
+from src.decoding import DEPOSIT, WITHDRAW
+from src.outcomes import APPLIED, INSUFFICIENT_FUNDS, UNKNOWN_CLIENT
+
+# Outcome codes of scanned rows, indexes into SCAN_OUTCOMES
+APPLIED_CODE, INSUFFICIENT_FUNDS_CODE, UNKNOWN_CLIENT_CODE = range(3)
+SCAN_OUTCOMES = np.array([APPLIED, INSUFFICIENT_FUNDS, UNKNOWN_CLIENT], dtype=object)
+# Clients whose balance plus the amounts of their rows may reach this many units are left to the row path,
+# so every running balance of the scan fits in int64
+SAFE_UNITS = 2 ** 62
+# Rounds of the vectorized scan, each settles the first refused withdrawal of every client. Withdrawals still
+# undecided after that are settled one by one
+MAX_ROUNDS = 32
+
+
+def group_clients(clients):
+    """Rows grouped by client: (order, client ids, starts). order lists the row indexes client by client keeping
+    the row order of every client, starts gives the position in order where the rows of each client begin"""
+    order = np.argsort(clients, kind="stable")
+    grouped = clients[order]
+    starts = np.flatnonzero(np.concatenate(([True], grouped[1:] != grouped[:-1])))
+    return order, grouped[starts], starts
+
+
+def scan_candidates(batch, order, starts):
+    """Mask of the grouped clients whose rows can be scanned: all deposits and withdrawals, none sharing its txn id
+    with another row of the batch, so that no row applied one by one looks up or records a transaction of a
+    scanned client"""
+    types = batch.types
+    txn_ids = np.sort(batch.txns)
+    repeated = txn_ids[1:][txn_ids[1:] == txn_ids[:-1]]
+    blocked = ((types != DEPOSIT) & (types != WITHDRAW)) | np.isin(batch.txns, repeated)
+    return ~np.logical_or.reduceat(blocked[order], starts)
+
+
+def scan_balances(amounts, withdrawals, starts, balances, exists):
+    """Scan the rows of clients that only deposit and withdraw, grouped by client: amounts in integer units,
+    withdrawals the mask of withdraw rows and starts where the rows of each client begin. balances are the
+    available balances of the clients before their rows and exists tells which of them have an account,
+    withdrawals before the first deposit of a client without one are refused as UNKNOWN_CLIENT.
+    Returns (outcome code of every row, available balance of every client after its rows)."""
+    count = len(amounts)
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, count)))
+    positions = np.arange(count)
+    codes = np.zeros(count, dtype=np.int8)
+    first_deposit = np.minimum.reduceat(np.where(withdrawals, count, positions), starts)
+    unknown = withdrawals & ~exists[segments] & (positions < first_deposit[segments])
+    codes[unknown] = UNKNOWN_CLIENT_CODE
+    deltas = np.where(withdrawals, -amounts, amounts)
+    deltas[unknown] = 0
+    scanned = withdrawals & ~unknown
+    # Every round scans the rows left assuming all their withdrawals apply. The first withdrawal of a client that
+    # takes its balance below zero is the first one refused, the rows of that client after it are scanned again
+    # from the balance before it, the other clients are settled
+    base = np.array(balances, dtype=np.int64)
+    final = base.copy()
+    rows = positions
+    for _ in range(MAX_ROUNDS):
+        if not len(rows):
+            return codes, final
+        row_segments = segments[rows]
+        row_deltas = deltas[rows]
+        firsts = np.flatnonzero(np.concatenate(([True], row_segments[1:] != row_segments[:-1])))
+        lengths = np.diff(np.append(firsts, len(rows)))
+        # One cumulative sum across clients, made relative to each client's first row. It may wrap around in
+        # int64 but the differences, bounded by SAFE_UNITS, are exact
+        running = np.cumsum(row_deltas)
+        after = base[row_segments] + running - np.repeat(running[firsts] - row_deltas[firsts], lengths)
+        failing = np.flatnonzero(scanned[rows] & (after < 0))
+        lasts = firsts + lengths - 1
+        final[row_segments[lasts]] = after[lasts]
+        if not len(failing):
+            return codes, final
+        failing_segments = row_segments[failing]
+        refused = failing[np.concatenate(([True], failing_segments[1:] != failing_segments[:-1]))]
+        refused_segments = row_segments[refused]
+        codes[rows[refused]] = INSUFFICIENT_FUNDS_CODE
+        base[refused_segments] = after[refused] - row_deltas[refused]
+        final[refused_segments] = base[refused_segments]
+        cutoff = np.full(len(starts), len(rows))
+        cutoff[refused_segments] = refused
+        rows = rows[np.arange(len(rows)) > cutoff[row_segments]]
+    available = base.tolist()
+    for row, segment, amount, withdrawal in zip(rows.tolist(), segments[rows].tolist(), amounts[rows].tolist(),
+                                                withdrawals[rows].tolist()):
+        if not withdrawal:
+            available[segment] += amount
+        elif available[segment] < amount:
+            codes[row] = INSUFFICIENT_FUNDS_CODE
+        else:
+            available[segment] -= amount
+    for segment in np.unique(segments[rows]).tolist():
+        final[segment] = available[segment]
+    return codes, final
@@ -0,0 +1,143 @@
+# Long running service mode: one resident PaymentEngine receives transactions continuously over a local socket
+# or stdin and applies them in arrival order, while balance queries are answered over the same socket.
+# Run with: python -m src.service [--port 8765] [--stdin]
+import argparse
+import asyncio
+import signal
+import sys
+from src.decoding import decode_row
+from src.payment_engine import PaymentEngine
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CLIENT_ACCOUNTS_CSV = "src/clients_existing_accounts_balances.csv"
+
+
+class PaymentService:
+    """Serves a PaymentEngine over a line based protocol.
+    A line is either a transaction in type,client,txn,amount form, which is applied and never answered, or
+    "balance,<client>" which is answered with the client,available,held,total,locked row of that client, or
+    "error,<reason>" for a malformed query or an unknown client. Only queries are answered so a client can read
+    the answer to each of its queries as the next line. Malformed transactions (see decoding.decode_row) go to
+    the rejects of the engine, numbered by the transaction lines received.
+    Lines are handled one at a time on the event loop, so a balance is always read between two whole
+    transactions and reflects every transaction received before it on the same connection."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.apply_transaction = engine.transaction_handler()
+        # Transaction lines received, rejected ones are numbered by it
+        self.transaction_lines = 0
+
+    def handle_line(self, line):
+        """Apply or answer one protocol line, returns the response line or None"""
+        fields = line.strip().split(",")
+        if fields[0] in ("", "type"):
+            return None
+        if fields[0] == "balance":
+            try:
+                client_id = int(fields[1])
+            except (ValueError, IndexError) as e:
+                return f"error,{str(e).replace(',', ';')}"
+            if not self.engine.is_client_exists(client_id):
+                return f"error,unknown client {client_id}"
+            return ",".join(str(column) for column in self.engine.account_row(client_id))
+        self.transaction_lines += 1
+        record, reason = decode_row(fields)
+        if record is None:
+            self.engine.rejects.reject(self.transaction_lines, fields, reason)
+        else:
+            self.apply_transaction(*record)
+        return None
+
+    async def handle_stream(self, reader, writer=None):
+        """Handle lines from reader until end of stream, responses are written to writer if given"""
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response = self.handle_line(line.decode())
+            if response is not None and writer is not None:
+                writer.write(response.encode() + b"\n")
+                await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            await self.handle_stream(reader, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start accepting connections, returns the asyncio server"""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def ingest_stdin(self):
+        """Apply transactions read from stdin until it is closed"""
+        reader = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        await self.handle_stream(reader)
+
+
+class ServiceClient:
+    """Local client for PaymentService, used to drive it from tests and scripts"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    def send_transaction(self, txn_type, client_id, txn_id, amount=""):
+        """Queue a transaction to be sent, amount as text as it would appear in the transactions CSV"""
+        self.writer.write(f"{txn_type},{client_id},{txn_id},{amount}\n".encode())
+
+    async def balance(self, client_id):
+        """(client, available, held, total, locked) columns of given client, raises LookupError if the
+        service answers with an error"""
+        self.writer.write(f"balance,{client_id}\n".encode())
+        await self.writer.drain()
+        response = (await self.reader.readline()).decode().rstrip("\n").split(",")
+        if response[0] == "error":
+            raise LookupError(response[1])
+        return tuple(response)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(engine, host, port, read_stdin):
+    """Run the service until SIGINT or SIGTERM"""
+    service = PaymentService(engine)
+    server = await service.start(host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    stdin_task = asyncio.create_task(service.ingest_stdin()) if read_stdin else None
+    async with server:
+        await stop.wait()
+    if stdin_task is not None:
+        stdin_task.cancel()
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Apply transactions received over a socket or stdin and answer "
+                                                 "balance queries, client accounts are written to stdout on exit")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--stdin", action="store_true", help="also apply transactions read from stdin")
+    parser.add_argument("--client-details", default=CLIENT_ACCOUNTS_CSV, help="existing client accounts CSV")
+    args = parser.parse_args()
+    engine = PaymentEngine(None, args.client_details, streaming=True)
+    asyncio.run(serve(engine, args.host, args.port, args.stdin))
+    engine.write_results()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,266 @@
+# Sharded execution: transactions of different clients never interact, so records are hash partitioned by client
+# id across worker processes. Each worker owns the accounts and transaction index of its clients and applies
+# their transactions in input order, the final account states are merged back by the caller.
+import multiprocessing
+import queue
+from collections import deque
+from src.decoding import DEPOSIT, WITHDRAW
+from src.ledger import Client, Ledger
+from src.metrics import peak_rss_bytes
+from src.snapshot import AccountSnapshot, SnapshotAccounts
+from src.txn_index import ENTRY_BYTES
+
+BATCH_SIZE = 10000
+QUEUE_DEPTH = 16
+# Seconds between checks that the workers are still running while waiting on them
+POLL_SECONDS = 0.1
+
+
+def shard_of(client_id, shards):
+    """Shard (worker number) responsible for given client"""
+    return hash(client_id) % shards
+
+
+def run_sharded(records, account_states, index_entries, workers, batch_size=BATCH_SIZE, engine_options=None,
+                publish=None):
+    """Apply (type, client, txn, amount) records across given number of worker processes.
+    account_states maps client id to the state tuple from PaymentEngine.account_states() and index_entries
+    are the transaction index entries already recorded, engine_options are passed to the Ledger of each worker.
+    Returns the merged account states and transaction index entries of all workers, the ids of the clients
+    whose accounts were changed if track_changes was passed in engine_options (None otherwise), the
+    EngineMetrics of every worker if metrics were passed in engine_options, and the peak RSS of every worker
+    in bytes (see metrics.peak_rss_bytes).
+    With the path of an account snapshot as snapshot in engine_options, workers read the accounts missing from
+    account_states from it, and only return the accounts they read from it or created.
+    As in a serial run, the first deposit or withdrawal recorded under a txn id is the one disputes refer to: the
+    worker of a later transaction of another shard reusing the id is told not to record it (see ShardLedger), and
+    the caller keeps the shard that recorded every id (see RecordedShards), as many ids as a serial run keeps.
+    As each worker only sees its own clients' txns, a dispute of another client's transaction is ignored as
+    unknown_txn, not client_mismatch.
+    With a retention policy in engine_options, a worker ages deposits by the transactions of its own shard only,
+    so they stay disputable for at least as long as in a serial run, and gets an equal part of its max_bytes and
+    its own spill file (see RetentionPolicy.for_shard), kept from an earlier run if resume is set.
+    publish, if given, is called in this process while records are fed and workers finish, with the list of
+    (client id, (available, held, total, locked)) of the accounts of every batch a worker applied, once it applied it.
+    If a worker fails, records stop being read once its queue is full, the other workers finish the batches they
+    were sent and the error of the worker is raised once they have stopped."""
+    batches = [multiprocessing.Queue(QUEUE_DEPTH) for _ in range(workers)]
+    results = multiprocessing.Queue()
+    updates = multiprocessing.Queue() if publish is not None else None
+    shard_accounts = [{} for _ in range(workers)]
+    for client_id, state in account_states.items():
+        shard_accounts[shard_of(client_id, workers)][client_id] = state
+    shard_index = [{} for _ in range(workers)]
+    # Shard that recorded every txn id
+    recorded_by = RecordedShards((engine_options or {}).get("retention"))
+    for txn_id, entry in index_entries.items():
+        shard = recorded_by.first_shard(txn_id, shard_of(entry[0], workers), 0)
+        shard_index[shard][txn_id] = entry
+    processes = [multiprocessing.Process(target=_run_shard, daemon=True,
+                                         args=(shard, workers, shard_accounts[shard], shard_index[shard],
+                                               batches[shard], results, updates, engine_options or {}))
+                 for shard in range(workers)]
+    for process in processes:
+        process.start()
+    del shard_accounts, shard_index
+
+    def drain():
+        # Publish the accounts of the batches workers applied so far
+        if updates is None:
+            return
+        while True:
+            try:
+                publish(updates.get_nowait())
+            except queue.Empty:
+                return
+
+    def send(shard, item):
+        # A worker that failed stops reading its queue, don't wait on it once the queue is full
+        while True:
+            drain()
+            try:
+                batches[shard].put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                if not processes[shard].is_alive():
+                    return False
+
+    try:
+        # Records of every shard and the ids they reuse that another shard recorded, sent together
+        pending = [[] for _ in range(workers)]
+        foreign = [[] for _ in range(workers)]
+        first_shard = recorded_by.first_shard
+        for row, record in enumerate(records, 1):
+            txn_type = record[0]
+            shard = shard_of(record[1], workers)
+            if (txn_type == DEPOSIT or txn_type == WITHDRAW) and first_shard(record[2], shard, row) != shard:
+                foreign[shard].append(record[2])
+            batch = pending[shard]
+            batch.append(record)
+            if len(batch) >= batch_size:
+                if not send(shard, (batch, foreign[shard])):
+                    break
+                pending[shard] = []
+                foreign[shard] = []
+        else:
+            for shard, batch in enumerate(pending):
+                if batch:
+                    send(shard, (batch, foreign[shard]))
+    finally:
+        for shard in range(workers):
+            send(shard, None)
+
+    merged_states, merged_index = {}, {}
+    changed = set() if (engine_options or {}).get("track_changes") else None
+    worker_metrics = []
+    worker_peak_rss = []
+    errors = []
+    for result in _shard_results(processes, results, drain):
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        states, index_entries, worker_changed, metrics, peak_rss = result
+        worker_peak_rss.append(peak_rss)
+        merged_states.update(states)
+        # Ids are only recorded by one worker, should one be in several results the first merged is kept
+        index_entries.update(merged_index)
+        merged_index = index_entries
+        if changed is not None:
+            changed.update(worker_changed)
+        if metrics is not None:
+            worker_metrics.append(metrics)
+    for process in processes:
+        # A worker only exits once the updates it sent are read
+        while process.is_alive():
+            drain()
+            process.join(POLL_SECONDS)
+    drain()
+    for batch_queue in batches:
+        # Batches left for a failed worker will never be read, don't wait to flush them at exit
+        batch_queue.cancel_join_thread()
+    if errors:
+        raise errors[0]
+    return merged_states, merged_index, changed, worker_metrics, worker_peak_rss
+
+
+def _shard_results(processes, results, wait):
+    """Result of every worker, in the order they arrive, calling wait while none arrives. A worker that exited
+    without sending one, killed by a signal for instance, gives a RuntimeError"""
+    received = set()
+    while len(received) < len(processes):
+        wait()
+        try:
+            shard, result = results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            # A worker's result is in the queue before it exits, look once more before giving up on it
+            exited = [shard for shard, process in enumerate(processes)
+                      if shard not in received and not process.is_alive()]
+            if not exited:
+                continue
+            try:
+                shard, result = results.get_nowait()
+            except queue.Empty:
+                shard = exited[0]
+                result = RuntimeError(f"worker of shard {shard} exited with code {processes[shard].exitcode}")
+        received.add(shard)
+        yield result
+
+
+class RecordedShards:
+    """Shard that recorded every txn id, for the ids a serial TransactionIndex with the same retention policy
+    would still hold: without one every id is kept, with one ids are forgotten once they are max_age rows old or
+    when more than max_bytes of index entries would be kept. Unlike the index, ids of deposits under an open
+    dispute aren't held longer, a later deposit of another shard reusing such an id is then recorded as well."""
+
+    def __init__(self, retention=None):
+        self._shards = {}
+        self._order = None
+        if retention is None or (retention.max_age is None and retention.max_bytes is None):
+            self.first_shard = self._first_shard
+            return
+        # (row, txn id) of the ids kept, oldest first
+        self._order = deque()
+        self._max_age = retention.max_age
+        self._max_ids = None if retention.max_bytes is None else max(retention.max_bytes // ENTRY_BYTES, 1)
+
+    def __len__(self):
+        return len(self._shards)
+
+    def _first_shard(self, txn_id, shard, row):
+        return self._shards.setdefault(txn_id, shard)
+
+    def first_shard(self, txn_id, shard, row):
+        """Shard that first recorded given id, given shard if it is recorded now at given row (counted from 1)"""
+        shards = self._shards
+        recorded = shards.get(txn_id)
+        if recorded is not None:
+            return recorded
+        shards[txn_id] = shard
+        order = self._order
+        order.append((row, txn_id))
+        oldest_row = None if self._max_age is None else row - self._max_age
+        while order and ((oldest_row is not None and order[0][0] <= oldest_row)
+                         or (self._max_ids is not None and len(order) > self._max_ids)):
+            del shards[order.popleft()[1]]
+        return shard
+
+
+class ShardBalances:
+    """Stands in for the BalanceBoard of a worker, the accounts it publishes are sent to the parent on updates"""
+
+    def __init__(self, updates):
+        self.updates = updates
+
+    def publish(self, accounts, replace=False, fallback=None):
+        self.updates.put([(client_id, (account.available, account.held, account.total, account.locked))
+                          for client_id, account in accounts])
+
+
+class ShardLedger(Ledger):
+    """Ledger of a worker. Transactions reusing a txn id first recorded by another shard aren't recorded, like
+    repeated ids in one ledger. With resume the entries in the spill file of its retention policy are kept.
+    snapshot is the path of the account snapshot of the engine, its accounts are read when first touched"""
+
+    def __init__(self, resume=False, snapshot=None, **engine_options):
+        super().__init__(**engine_options)
+        if resume:
+            self.txn_index = self.new_txn_index(resume=True)
+        if snapshot is not None:
+            self.clients = SnapshotAccounts(AccountSnapshot(snapshot), self.clients, Client)
+        # Ids recorded by another shard
+        self.foreign_txns = set()
+
+    def index_transaction(self, txn_type, client_id, txn_id, amount):
+        if txn_id not in self.foreign_txns:
+            super().index_transaction(txn_type, client_id, txn_id, amount)
+
+
+def _run_shard(shard, workers, account_states, index_entries, batches, results, updates, engine_options):
+    """Worker process: apply every batch sent to this shard and send back the final state. With updates the
+    accounts of every batch are sent on it once it is applied"""
+    try:
+        if engine_options.get("retention") is not None:
+            engine_options = dict(engine_options, retention=engine_options["retention"].for_shard(shard, workers))
+        engine = ShardLedger(**engine_options)
+        engine.load_account_states(account_states)
+        engine.txn_index.update(index_entries)
+        if updates is not None:
+            engine.balances = ShardBalances(updates)
+        apply_transaction = engine.transaction_handler()
+        if engine.metrics is not None:
+            engine.metrics.start()
+        for batch, foreign_txns in iter(batches.get, None):
+            engine.foreign_txns.update(foreign_txns)
+            for record in batch:
+                apply_transaction(*record)
+            if updates is not None:
+                engine.publish_balances({record[1] for record in batch})
+        engine.txn_index.flush()
+        if engine.metrics is not None:
+            engine.metrics.stop()
+            engine.metrics.record_dispute_window(engine.txn_index.counters)
+        states = engine.account_states(touched=True)
+        results.put((shard, (states, engine.txn_index.entries(), engine.changed, engine.metrics,
+                             peak_rss_bytes())))
+    except Exception as e:
+        results.put((shard, e))
@@ -0,0 +1,215 @@
+# Account snapshots: existing client accounts in a compact binary file that is memory mapped instead of parsed.
+# Accounts are materialized only when a transaction first touches them, and untouched accounts are written
+# to the output straight from their preformatted rows in the snapshot.
+# Convert an existing accounts CSV with: python -m src.snapshot accounts.csv accounts.snap
+import argparse
+import csv
+import io
+import mmap
+import struct
+import numpy as np
+from src.money import format_amount, parse_amount
+
+SNAPSHOT_MAGIC = b"PAYSNAP\x01"
+# Magic, number of accounts, size of the output rows text
+HEADER = struct.Struct("<8sQQ")
+OUTPUT_HEADER = ("client", "available", "held", "total", "locked")
+# Rows are written as by csv.writer with its default dialect, like PaymentEngine.write_results
+LINE_TERMINATOR = "\r\n"
+
+
+def read_account_rows(client_details_file):
+    """(client, available, held, total, locked) tuples of an existing client accounts CSV, in file order,
+    balances in integer units"""
+    import pandas as pd
+    df = pd.read_csv(client_details_file, dtype={"available": str, "held": str, "total": str})
+    df["locked"] = df["locked"].astype("bool")
+    if df["client"].duplicated().any():
+        raise ValueError("client ids of existing accounts must be unique")
+    return [(client_id, parse_amount(available), parse_amount(held), parse_amount(total), locked)
+            for client_id, available, held, total, locked
+            in df[list(OUTPUT_HEADER)].itertuples(index=False, name=None)]
+
+
+def format_account_rows(rows):
+    """Output CSV text of (client, available, held, total, locked) rows, as written by write_results"""
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator=LINE_TERMINATOR)
+    for client_id, available, held, total, locked in rows:
+        writer.writerow((client_id, format_amount(available), format_amount(held), format_amount(total),
+                         bool(locked)))
+    return text.getvalue()
+
+
+def write_snapshot(path, rows):
+    """Write (client, available, held, total, locked) rows, balances in integer units, as an account snapshot.
+    Layout after the header, little endian: client, available, held and total int64 columns in row order,
+    the client ids sorted and their row numbers (the index), the offsets of every row's output text,
+    the locked byte column and the output text itself."""
+    rows = list(rows)
+    try:
+        columns = [np.array([row[column] for row in rows], dtype="<i8") for column in range(4)]
+    except OverflowError:
+        raise ValueError("account balances of a snapshot must fit in 64 bit integer units") from None
+    locked = np.array([bool(row[4]) for row in rows], dtype=np.uint8)
+    if len(np.unique(columns[0])) != len(rows):
+        raise ValueError("client ids of a snapshot must be unique")
+    order = np.argsort(columns[0], kind="stable").astype("<i8")
+    lines = format_account_rows(rows).encode("ascii").splitlines(keepends=True)
+    offsets = np.zeros(len(rows) + 1, dtype="<i8")
+    np.cumsum([len(line) for line in lines], out=offsets[1:])
+    with open(path, "wb") as output:
+        output.write(HEADER.pack(SNAPSHOT_MAGIC, len(rows), int(offsets[-1])))
+        for array in (*columns, columns[0][order], order, offsets, locked):
+            output.write(array.tobytes())
+        output.writelines(lines)
+
+
+def is_snapshot(path):
+    """Whether given path is an account snapshot file"""
+    if not isinstance(path, str):
+        return False
+    with open(path, "rb") as snapshot_file:
+        return snapshot_file.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+class AccountSnapshot:
+    """Memory mapped account snapshot written by write_snapshot. Columns are NumPy views on the mapping,
+    nothing is decoded until asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, text_size = HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an account snapshot")
+        self.count = count
+        offset = HEADER.size
+        columns = []
+        for length in (count, count, count, count, count, count, count + 1):
+            columns.append(np.frombuffer(self._mmap, dtype="<i8", count=length, offset=offset))
+            offset += 8 * length
+        (self.client_ids, self.available, self.held, self.total,
+         self.sorted_ids, self.sorted_rows, self.line_offsets) = columns
+        self.locked = np.frombuffer(self._mmap, dtype=np.uint8, count=count, offset=offset)
+        self.text_offset = offset + count
+        if self.text_offset + text_size > len(self._mmap):
+            raise ValueError(f"{path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def row_of(self, client_id):
+        """Row number of given client or None if it has no account in the snapshot"""
+        position = int(np.searchsorted(self.sorted_ids, client_id))
+        if position < self.count and self.sorted_ids[position] == client_id:
+            return int(self.sorted_rows[position])
+        return None
+
+    def account(self, row):
+        """(client, available, held, total, locked) of given row, balances in integer units"""
+        return (int(self.client_ids[row]), int(self.available[row]), int(self.held[row]), int(self.total[row]),
+                bool(self.locked[row]))
+
+    def text(self, start, stop):
+        """Output CSV text of rows start to stop (excluded)"""
+        begin = self.text_offset + int(self.line_offsets[start])
+        end = self.text_offset + int(self.line_offsets[stop])
+        return self._mmap[begin:end].decode("ascii")
+
+
+class SnapshotAccounts:
+    """Account store backed by an AccountSnapshot, used as PaymentEngine.clients.
+    An account is read from the snapshot into store (an empty store of the configured kind) the first time it
+    is accessed, new_client(client, available, held, total, locked) builds the account to store.
+    Iterates snapshot accounts in snapshot order, then new clients in the order they were added."""
+
+    def __init__(self, snapshot, store, new_client):
+        self.snapshot = snapshot
+        self.store = store
+        self.new_client = new_client
+        # Snapshot rows that have been materialized into store, by client id
+        self.materialized = {}
+
+    def __len__(self):
+        return self.snapshot.count + len(self.store) - len(self.materialized)
+
+    def __contains__(self, client_id):
+        return client_id in self.store or self.snapshot.row_of(client_id) is not None
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, client_id):
+        if client_id not in self.store:
+            row = self.snapshot.row_of(client_id)
+            if row is None:
+                raise KeyError(client_id)
+            self.store[client_id] = self.new_client(*self.snapshot.account(row))
+            self.materialized[client_id] = row
+        return self.store[client_id]
+
+    def __setitem__(self, client_id, client):
+        if client_id not in self.store:
+            row = self.snapshot.row_of(client_id)
+            if row is not None:
+                self.materialized[client_id] = row
+        self.store[client_id] = client
+
+    def keys(self):
+        yield from self.snapshot.client_ids.tolist()
+        for client_id in self.store:
+            if client_id not in self.materialized:
+                yield client_id
+
+    def items(self):
+        """(client id, account) of every account, untouched snapshot accounts are built without being stored"""
+        for row, client_id in enumerate(self.snapshot.client_ids.tolist()):
+            if client_id in self.materialized:
+                yield client_id, self.store[client_id]
+            else:
+                yield client_id, self.new_client(*self.snapshot.account(row))
+        for client_id, client in self.store.items():
+            if client_id not in self.materialized:
+                yield client_id, client
+
+    def values(self):
+        for _, client in self.items():
+            yield client
+
+    def touched_items(self):
+        """(client id, account) of the accounts read from the snapshot, in snapshot order, then of new clients"""
+        for client_id, _ in sorted(self.materialized.items(), key=lambda item: item[1]):
+            yield client_id, self.store[client_id]
+        for client_id, client in self.store.items():
+            if client_id not in self.materialized:
+                yield client_id, client
+
+    def write_rows(self, output, write_row):
+        """Write the output rows of every account to output. Runs of untouched snapshot accounts are copied
+        from their preformatted text, write_row(client_id, account) writes the others."""
+        start = 0
+        for row in sorted(self.materialized.values()):
+            if start < row:
+                output.write(self.snapshot.text(start, row))
+            client_id = int(self.snapshot.client_ids[row])
+            write_row(client_id, self.store[client_id])
+            start = row + 1
+        if start < self.snapshot.count:
+            output.write(self.snapshot.text(start, self.snapshot.count))
+        for client_id, client in self.store.items():
+            if client_id not in self.materialized:
+                write_row(client_id, client)
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Convert an existing client accounts CSV to an account snapshot")
+    parser.add_argument("accounts_csv")
+    parser.add_argument("snapshot")
+    args = parser.parse_args()
+    write_snapshot(args.snapshot, read_account_rows(args.accounts_csv))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
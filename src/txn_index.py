@@ -0,0 +1,256 @@
+# TransactionIndex keeps the details of processed transactions so that disputes, resolves and chargebacks
+# can find the transaction they refer to without scanning the whole transactions file.
+# Withdrawals are recorded too (see Ledger.index_transaction) so that an id reused after one can't be disputed.
+# By default every entry is kept forever. With a RetentionPolicy only recent ones are kept in memory, older ones
+# are evicted, optionally to an on-disk SpillStore that is consulted when a lookup misses.
+import sqlite3
+from collections import deque, namedtuple
+
+# Approximate memory used by one in-memory entry of a TransactionIndex with a retention policy, in bytes
+ENTRY_BYTES = 320
+# Evicted entries are written to the spill store in batches of this many
+SPILL_BATCH = 4096
+# Without a spill store, this many of the most recently evicted ids are remembered to count lookups of them
+EVICTED_HISTORY = 65536
+
+
+class RetentionPolicy(namedtuple("RetentionPolicy", ("max_age", "max_bytes", "spill_path"),
+                                 defaults=(None, None, None))):
+    """How long deposits stay disputable in memory.
+    max_age: a deposit is evicted once that many transactions have been applied after it.
+    max_bytes: the oldest deposits are evicted while the index would use more than that many bytes.
+    spill_path: evicted deposits are written to an SQLite file at this path and looked up there on a miss,
+    otherwise they are dropped and disputes of them are ignored as unknown_txn. The spill file of an engine that
+    isn't resuming from a checkpoint is cleared when it is first used, deposits of earlier runs aren't disputable.
+    Deposits under dispute are never evicted while the dispute is open."""
+
+    def for_shard(self, shard, shards):
+        """Policy of one of shards sharded workers: it gets its own spill file and an equal part of max_bytes"""
+        policy = self
+        if self.max_bytes is not None:
+            policy = policy._replace(max_bytes=self.max_bytes // shards)
+        if self.spill_path is not None:
+            policy = policy._replace(spill_path=f"{self.spill_path}.{shard}")
+        return policy
+
+
+class TransactionIndex:
+    """Maps a transaction id to the (client, amount, type) of the transaction recorded under that id.
+    Entries are plain tuples so memory per transaction stays small and fixed, and lookups are O(1).
+    With a retention policy, keep(txn_id, client_id) tells whether an entry due for eviction is still
+    needed (an open dispute), such entries are held until it returns False. counters has the number of
+    entries evicted and spilled, and of lookups that found a spilled entry (spill_hits) or missed an entry
+    that had been evicted without a spill store (evicted_misses).
+    The spill store is only opened when an entry is first spilled or looked up there. With resume, the index
+    continues from a checkpoint and the entries already in the spill file are kept, otherwise they are cleared."""
+
+    __slots__ = ("_entries", "_order", "_held", "_held_limit", "_keep", "_max_age", "_max_entries", "_spill",
+                 "_spill_path", "_resume", "_evicted_ids", "rows", "counters")
+
+    def __init__(self, retention=None, keep=None, resume=False):
+        self._entries = {}
+        # Applied transactions, the clock entry ages are measured with, advanced by counting()
+        self.rows = 0
+        self.counters = {"evicted": 0, "spilled": 0, "spill_hits": 0, "evicted_misses": 0}
+        self._order = None
+        if retention is None:
+            return
+        # (row, txn id) of in-memory entries, oldest first
+        self._order = deque()
+        self._held = {}
+        self._held_limit = 1024
+        self._keep = keep
+        self._max_age = retention.max_age
+        self._max_entries = None if retention.max_bytes is None else max(retention.max_bytes // ENTRY_BYTES, 1)
+        self._spill = None
+        self._spill_path = retention.spill_path
+        self._resume = resume
+        self._evicted_ids = None if self._spill_path is not None else RecentIds(EVICTED_HISTORY)
+
+    def __len__(self):
+        if self._order is None:
+            return len(self._entries)
+        return len(self._entries) + len(self._held)
+
+    def __contains__(self, txn_id):
+        """Whether given id is recorded in memory"""
+        return txn_id in self._entries or (self._order is not None and txn_id in self._held)
+
+    @property
+    def ages(self):
+        """True when entries are evicted by age, the engine then has to advance rows, see counting()"""
+        return self._order is not None and self._max_age is not None
+
+    def counting(self, apply_transaction):
+        """Wrap an apply_transaction(type, client, txn, amount) callable so every call advances rows"""
+        def apply_counted(txn_type, client_id, txn_id, amount):
+            self.rows += 1
+            return apply_transaction(txn_type, client_id, txn_id, amount)
+
+        return apply_counted
+
+    def add(self, txn_id, client_id, amount, txn_type):
+        """Record a transaction. Transaction ids are expected to be unique, if an id is repeated the first
+        transaction recorded under it is kept as that is the one disputes have always referred to.
+        With a retention policy repeats are only detected while the first one is still in memory."""
+        if txn_id in self._entries:
+            return
+        if self._order is None:
+            self._entries[txn_id] = (client_id, amount, txn_type)
+            return
+        self.add_entry(txn_id, (client_id, amount, txn_type))
+
+    def add_entry(self, txn_id, entry):
+        """Record a (client, amount, type) entry like add(), entries may be shared by several ids"""
+        if txn_id in self._entries:
+            return
+        if self._order is None:
+            self._entries[txn_id] = entry
+            return
+        if txn_id in self._held:
+            return
+        self._entries[txn_id] = entry
+        self._order.append((self.rows, txn_id))
+        self._evict()
+
+    def add_many(self, txn_ids, entries):
+        """Record entries given as lists of ids and (client, amount, type) entries, like add_entry() of each in
+        order"""
+        added = dict(zip(txn_ids, entries))
+        if self._order is not None or len(added) != len(txn_ids):
+            for txn_id, entry in zip(txn_ids, entries):
+                self.add_entry(txn_id, entry)
+            return
+        for txn_id in added.keys() & self._entries.keys():
+            del added[txn_id]
+        self._entries.update(added)
+
+    def get(self, txn_id):
+        """Return (client, amount, type) for given transaction id or None if it was never recorded,
+        or was evicted and not spilled"""
+        entry = self._entries.get(txn_id)
+        if entry is not None or self._order is None:
+            return entry
+        entry = self._held.get(txn_id)
+        if entry is not None:
+            return entry
+        if self._spill_path is not None:
+            entry = self.spill_store().get(txn_id)
+            if entry is not None:
+                self.counters["spill_hits"] += 1
+            return entry
+        if txn_id in self._evicted_ids:
+            self.counters["evicted_misses"] += 1
+        return None
+
+    def entries(self):
+        """All in-memory entries as a dict of txn id -> (client, amount, type), spilled entries stay on disk"""
+        if self._order is None:
+            return dict(self._entries)
+        return {**self._entries, **self._held}
+
+    def update(self, entries):
+        """Add entries returned by entries(), ids already recorded keep their first transaction"""
+        for txn_id, entry in entries.items():
+            self.add_entry(txn_id, entry)
+
+    def spill_store(self):
+        """The SpillStore of a retention policy with a spill path, opened on first use"""
+        if self._spill is None:
+            self._spill = SpillStore(self._spill_path, self._resume)
+        return self._spill
+
+    def flush(self):
+        """Write pending evicted entries to the spill store"""
+        if self._order is not None and self._spill is not None:
+            self._spill.flush()
+
+    def _evict(self):
+        order = self._order
+        entries = self._entries
+        max_entries = self._max_entries
+        oldest_row = None if self._max_age is None else self.rows - self._max_age
+        while order and ((oldest_row is not None and order[0][0] <= oldest_row)
+                         or (max_entries is not None and len(entries) + len(self._held) > max_entries)):
+            _, txn_id = order.popleft()
+            entry = entries.pop(txn_id)
+            if self._keep is not None and self._keep(txn_id, entry[0]):
+                self._held[txn_id] = entry
+                if len(self._held) > self._held_limit:
+                    self._release_held()
+            else:
+                self._drop(txn_id, entry)
+
+    def _release_held(self):
+        """Evict held entries whose dispute has been closed since"""
+        for txn_id, entry in list(self._held.items()):
+            if not self._keep(txn_id, entry[0]):
+                del self._held[txn_id]
+                self._drop(txn_id, entry)
+        self._held_limit = max(2 * len(self._held), 1024)
+
+    def _drop(self, txn_id, entry):
+        self.counters["evicted"] += 1
+        if self._spill_path is not None:
+            self.spill_store().add(txn_id, entry)
+            self.counters["spilled"] += 1
+        else:
+            self._evicted_ids.add(txn_id)
+
+
+class RecentIds:
+    """Set of the last size ids added"""
+
+    __slots__ = ("_ids", "_order")
+
+    def __init__(self, size):
+        self._ids = set()
+        self._order = deque(maxlen=size)
+
+    def __contains__(self, txn_id):
+        return txn_id in self._ids
+
+    def add(self, txn_id):
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(txn_id)
+        self._ids.add(txn_id)
+
+
+class SpillStore:
+    """Evicted transaction index entries in an SQLite file, written in batches.
+    The first entry spilled under an id is kept, like TransactionIndex.add. Entries already in the file are
+    cleared unless resume is set"""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS spilled "
+                             "(txn INTEGER PRIMARY KEY, client INTEGER, amount INTEGER, type INTEGER)")
+            if not resume:
+                self._db.execute("DELETE FROM spilled")
+        self._pending = []
+
+    def __getstate__(self):
+        raise TypeError("a SpillStore can't be sent to another process, pass its RetentionPolicy instead")
+
+    def add(self, txn_id, entry):
+        self._pending.append((txn_id, *entry))
+        if len(self._pending) >= SPILL_BATCH:
+            self.flush()
+
+    def get(self, txn_id):
+        """(client, amount, type) spilled under given id or None"""
+        self.flush()
+        return self._db.execute("SELECT client, amount, type FROM spilled WHERE txn = ?", (txn_id,)).fetchone()
+
+    def flush(self):
+        if self._pending:
+            with self._db:
+                self._db.executemany("INSERT OR IGNORE INTO spilled VALUES (?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self._db.close()
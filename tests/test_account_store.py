@@ -0,0 +1,87 @@
+# account_store.py unit tests written using PyTest framework
+import pytest
+from decimal import Decimal
+from io import StringIO
+from src.account_store import ColumnarAccountStore
+from src.outcomes import BALANCE_OVERFLOW
+from src.payment_engine import Client, PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+# Test#1: accounts are stored in columns, iterate in insertion order and grow past initial capacity
+def test_store_and_read_accounts():
+    store = ColumnarAccountStore(capacity=4)
+    store[10] = Client(10, 5, 1, 6, False)
+    store[2] = Client(2, 0, 0, 0, True)
+    for client_id in range(100, 105):
+        store[client_id] = Client(client_id, client_id, 0, client_id, False)
+    assert list(store) == [10, 2, 100, 101, 102, 103, 104]
+    assert len(store) == 7
+    assert 10 in store and 3 not in store and 5000 not in store
+    assert store[104].available == 104
+    assert store[10].available == 5 and store[10].total == 6
+    assert store[2].locked is True
+    with pytest.raises(KeyError):
+        store[3]
+
+
+# Test#2: disputed transaction sets are only allocated while a dispute is open
+def test_disputed_transactions_allocated_lazily():
+    store = ColumnarAccountStore()
+    store[1] = Client(1, 30000, 0, 30000, False)
+    account = store[1]
+    assert store.disputed == {}
+    account.dispute(10000, 7)
+    assert account.disputed_transactions == {7}
+    assert account.available_balance == Decimal(2) and account.held_amount == Decimal(1)
+    account.resolve(10000, 7)
+    assert store.disputed == {}
+    assert account.available == 30000 and account.held == 0
+
+
+# Test#3: engine with columnar store writes exactly the same output as with Client objects
+def test_columnar_store_output_matches_objects(capsys):
+    transactions = random_transactions(3000, 40)
+    objects = engine_output(capsys, transactions)
+    columnar = engine_output(capsys, transactions, account_store="columnar")
+    assert columnar == objects
+
+
+# Test#4: chargeback locks the account in the columnar store
+def test_columnar_store_chargeback():
+    transactions = "type,client,txn,amount\ndeposit,1,1,3.0\ndispute,1,1\nchargeback,1,1\ndeposit,1,2,1.0\n"
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), account_store="columnar")
+    app.process_transactions()
+    client1 = app.clients[1]
+    assert client1.locked is True
+    assert client1.total_amount == Decimal(10.0)
+    assert client1.held_amount == Decimal(0.0)
+
+
+# Test#5: columns are as long as the number of clients, not the largest client id
+def test_large_client_ids(capsys):
+    transactions = "type,client,txn,amount\ndeposit,99999999999,2,1.0\ndeposit,3,3,2.0\n"
+    assert engine_output(capsys, transactions, account_store="columnar") == engine_output(capsys, transactions)
+    store = ColumnarAccountStore(capacity=4)
+    store[2 ** 62] = Client(2 ** 62, 1, 0, 1, False)
+    assert list(store) == [2 ** 62] and len(store.locked) == 4
+
+
+# Test#6: both stores refuse a deposit that would take a balance past MAX_UNITS and carry on with the next one
+@pytest.mark.parametrize("account_store", ["objects", "columnar"])
+def test_balance_overflow_is_refused(capsys, account_store):
+    transactions = ("type,client,txn,amount\ndeposit,1,1,900000000000000\ndeposit,1,2,900000000000000\n"
+                    "deposit,1,3,1.0\n")
+    output = engine_output(capsys, transactions, account_store=account_store)
+    assert output.splitlines()[1] == "1,900000000000011.0000,0.0000,900000000000011.0000,False"
+    assert store_client(account_store).deposit(1) == BALANCE_OVERFLOW
+
+
+def store_client(account_store):
+    """Client of given store with a total balance of MAX_UNITS"""
+    client = Client(1, 2 ** 63 - 2, 1, 2 ** 63 - 1, False)
+    if account_store == "objects":
+        return client
+    store = ColumnarAccountStore()
+    store[1] = client
+    return store[1]
@@ -0,0 +1,76 @@
+# balance_board.py unit tests written using PyTest framework
+import threading
+from io import StringIO
+import numpy as np
+from src.balance_board import BalanceBoard, BalanceView
+from src.decoding import DEPOSIT, RecordBatch
+from src.ledger import Client, Ledger
+from src.outcomes import APPLIED
+from src.payment_engine import PaymentEngine
+from src.snapshot import read_account_rows, write_snapshot
+from tests.txn_data import CLIENT_DETAILS, random_transactions
+
+
+# Test#1: every publish is a new version, replacing publishes drop the accounts not given and use the fallback
+def test_publish_versions():
+    board = BalanceBoard()
+    board.publish([(1, Client(1, 10, 0, 10, False))])
+    board.publish([(2, Client(2, 5, 1, 6, True))])
+    assert board.version == 2
+    assert board.read([1, 2, 3]) == {1: BalanceView(10, 0, 10, False, 1), 2: BalanceView(5, 1, 6, True, 2), 3: None}
+    board.publish([(2, Client(2, 0, 0, 0, False))], replace=True,
+                  fallback=lambda client_id: BalanceView(7, 0, 7, False, 0) if client_id == 1 else None)
+    assert board.get(1) == (7, 0, 7, False, 0) and board.get(2).version == 3 and board.get(3) is None
+
+
+# Test#2: a reader thread only ever sees the accounts as of whole batches while another thread applies them
+def test_reads_during_processing():
+    ledger = Ledger(share_balances=True)
+    clients = np.arange(1, 11)
+    batches = 300
+    seen = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            views = ledger.balances.read(clients.tolist())
+            seen.append({view.available for view in views.values() if view is not None})
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for batch in range(batches):
+            ledger.submit_batch(RecordBatch(np.full(10, DEPOSIT, dtype=np.int8), clients,
+                                            batch * 10 + clients, np.ones(10, dtype=np.int64),
+                                            np.ones(10, dtype=bool)))
+    finally:
+        done.set()
+        thread.join()
+    assert seen and all(len(values) <= 1 for values in seen)
+    assert ledger.balances.get(10) == (batches, 0, batches, False, batches + 1)
+
+
+# Test#3: balances of an engine are published after processing, untouched snapshot accounts are read from it
+def test_engine_balances(tmp_path):
+    transactions = random_transactions(2000, 8)
+    snapshot_path = str(tmp_path / "accounts.snap")
+    write_snapshot(snapshot_path, read_account_rows(StringIO(CLIENT_DETAILS)))
+    for client_details, options in ((StringIO(CLIENT_DETAILS), {"streaming": True}),
+                                    (StringIO(CLIENT_DETAILS), {"streaming": False, "scan_kernel": True}),
+                                    (snapshot_path, {"streaming": True, "workers": 2})):
+        app = PaymentEngine(StringIO(transactions), client_details, share_balances=True, **options)
+        app.process_transactions()
+        assert {client_id: tuple(app.balances.get(client_id)[:4]) for client_id in app.clients} == \
+            {client_id: state[:4] for client_id, state in app.account_states().items()}
+    app = PaymentEngine(StringIO("type,client,txn,amount\n"), snapshot_path, share_balances=True, streaming=True)
+    app.process_transactions()
+    assert app.balances.get(2) == (200000, 20000, 220000, True, 0) and not app.clients.materialized
+
+
+# Test#4: records given as an iterator are published too
+def test_submit_batch_iterator():
+    ledger = Ledger(share_balances=True)
+    records = [(DEPOSIT, 1, 1, 10000), (DEPOSIT, 2, 2, 20000), (DEPOSIT, 1, 3, 5000)]
+    assert ledger.submit_batch(iter(records)) == [APPLIED] * 3
+    assert ledger.balances.get(1) == (15000, 0, 15000, False, 2)
+    assert ledger.balances.get(2) == (20000, 0, 20000, False, 2)
@@ -0,0 +1,110 @@
+# benchmarks unit tests written using PyTest framework
+from collections import Counter
+from io import StringIO
+import pytest
+from benchmarks.generate import TransactionMix, generate_transactions, write_client_accounts, write_transactions
+from benchmarks.replay import print_summary, replay, write_prefix
+from benchmarks.run_benchmarks import data_paths, run_isolated, run_once
+from src.metrics import peak_rss_bytes as process_peak_rss_bytes
+from src.txn_index import RetentionPolicy
+
+
+# Test#1: generated transactions are reproducible and follow the requested mix
+def test_generate_transactions_mix():
+    mix = TransactionMix(deposit_ratio=0.5, dispute_rate=0.1, resolve_rate=0.05, chargeback_rate=0.05)
+    rows = list(generate_transactions(20000, 100, mix, seed=3))
+    assert rows == list(generate_transactions(20000, 100, mix, seed=3))
+    counts = Counter(row[0] for row in rows)
+    assert 1700 < counts["dispute"] < 2300
+    assert 700 < counts["resolve"] < 1300
+    assert 700 < counts["chargeback"] < 1300
+    assert abs(counts["deposit"] - counts["withdraw"]) < 1000
+    assert all(1 <= row[1] <= 100 for row in rows)
+
+
+# Test#2: a benchmark run reports the timings of every phase
+def test_run_once(tmp_path):
+    transactions_csv, client_accounts_csv = tmp_path / "transactions.csv", tmp_path / "clients.csv"
+    write_transactions(transactions_csv, 2000, 50)
+    write_client_accounts(client_accounts_csv, 50, TransactionMix(locked_ratio=0.5))
+    result = run_once(str(transactions_csv), str(client_accounts_csv), {"streaming": True})
+    assert result["clients"] == 50
+    assert result["total_seconds"] >= result["process_seconds"] > 0
+    assert result["peak_rss_bytes"] > 0
+
+
+# Test#3: configurations applying the same rules replay generated edge cases to identical account states
+def test_replay_identical(tmp_path):
+    transactions_csv, client_accounts_csv = str(tmp_path / "transactions.csv"), str(tmp_path / "clients.csv")
+    mix = TransactionMix(edge_case_rate=0.05, locked_ratio=0.2)
+    write_transactions(transactions_csv, 3000, 40, mix)
+    write_client_accounts(client_accounts_csv, 40, mix)
+    report = replay(transactions_csv, client_accounts_csv, {"streaming": True},
+                    {"streaming": True, "scan_kernel": True})
+    assert report["identical"] and report["rows"] == 3000 and "first_divergence" not in report
+    assert report["baseline"]["clients"] == report["candidate"]["clients"]
+    assert report["candidate"]["options"]["scan_kernel"] and report["candidate"]["rows_per_second"] > 0
+
+
+# Test#4: a retention window shorter than the disputes' reach diverges at the first dispute, resolve or chargeback
+# of a forgotten transaction, the states after the rows before it are the same
+def test_replay_first_divergence(tmp_path):
+    transactions_csv = str(tmp_path / "transactions.csv")
+    write_transactions(transactions_csv, 2000, 20, TransactionMix(edge_case_rate=0.05))
+    baseline, candidate = {"streaming": True}, {"streaming": True, "retention": RetentionPolicy(max_age=5)}
+    report = replay(transactions_csv, None, baseline, candidate)
+    assert not report["identical"] and report["differences"]
+    divergence = report["first_divergence"]
+    assert divergence["transaction"][0] in ("dispute", "resolve", "chargeback") and divergence["clients"]
+    prefix_csv = str(tmp_path / "prefix.csv")
+    write_prefix(transactions_csv, "csv", divergence["row"] - 1, prefix_csv)
+    assert run_once(prefix_csv, None, baseline, states=True)["states"] == \
+        run_once(prefix_csv, None, candidate, states=True)["states"]
+    assert report["candidate"]["options"]["retention"]["max_age"] == 5
+
+
+# Test#5: an error of the benchmarked run is raised by run_isolated instead of waiting for a result forever
+def test_run_isolated_error(tmp_path):
+    transactions_csv = str(tmp_path / "transactions.csv")
+    write_transactions(transactions_csv, 100, 5)
+    with pytest.raises(KeyError):
+        run_isolated(transactions_csv, None, {"account_store": "unknown"})
+    assert run_isolated(transactions_csv, None, {"streaming": True})["clients"] <= 5
+
+
+# Test#6: generated data is only reused for the same rows, clients, seed and mix
+def test_data_paths():
+    mix = TransactionMix()
+    paths = data_paths("data", 1000, 10, mix, 0)
+    assert paths == data_paths("data", 1000, 10, TransactionMix(), 0)
+    for other in (data_paths("data", 1000, 10, mix, 1), data_paths("data", 1000, 20, mix, 0),
+                  data_paths("data", 1000, 10, TransactionMix(edge_case_rate=0.01), 0),
+                  data_paths("data", 1000, 10, TransactionMix(locked_ratio=0.5), 0)):
+        assert other[0] != paths[0] and other[1] != paths[1]
+    assert data_paths("data", 2000, 10, mix, 0)[1] == paths[1]
+
+
+# Test#7: a configuration that fails is reported as diverging with its error, in the bisection too
+def test_replay_failing_candidate(tmp_path):
+    transactions_csv = str(tmp_path / "transactions.csv")
+    write_transactions(transactions_csv, 200, 5)
+    report = replay(transactions_csv, None, {"streaming": True}, {"streaming": True, "account_store": "unknown"})
+    assert not report["identical"] and report["candidate"]["error"] == "KeyError: 'unknown'"
+    assert report["baseline"]["rows_per_second"] > 0 and "rows_per_second" not in report["candidate"]
+    assert report["first_divergence"]["row"] == 1
+    assert report["first_divergence"]["candidate_error"] == "KeyError: 'unknown'"
+    assert "baseline_error" not in report["first_divergence"]
+    output = StringIO()
+    print_summary(report, output)
+    assert "candidate failed: KeyError: 'unknown'" in output.getvalue()
+
+
+# Test#8: the peak RSS of a sharded run adds the peaks of its workers to that of the engine process
+def test_run_once_sharded_peak_rss(tmp_path):
+    transactions_csv, client_accounts_csv = tmp_path / "transactions.csv", tmp_path / "clients.csv"
+    write_transactions(transactions_csv, 2000, 50)
+    write_client_accounts(client_accounts_csv, 50)
+    result = run_once(str(transactions_csv), str(client_accounts_csv), {"streaming": True, "workers": 2})
+    assert result["workers_peak_rss_bytes"] > 0
+    assert result["peak_rss_bytes"] == process_peak_rss_bytes() + result["workers_peak_rss_bytes"]
+    assert run_once(str(transactions_csv), str(client_accounts_csv), {"streaming": True})["workers_peak_rss_bytes"] == 0
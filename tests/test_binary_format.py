@@ -0,0 +1,69 @@
+# binary_format.py unit tests written using PyTest framework
+import io
+import numpy as np
+from io import StringIO
+from src.binary_format import (BinaryTransactionReader, accounts_to_binary, accounts_to_csv, read_account_states,
+                               transactions_to_binary, transactions_to_csv, write_transactions)
+from src.decoding import DEPOSIT, DISPUTE, RecordBatch, RejectWriter
+from src.ingest import TransactionReader
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+def write_csv(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+# Test#1: transactions converted to the binary format and back hold the same records, a reader can resume
+# from the offset of another
+def test_transactions_round_trip(tmp_path):
+    csv_path = write_csv(tmp_path, "transactions.csv", random_transactions(300, 5) + "withdrawal,1,999,1.0\n")
+    binary_path, back_path = str(tmp_path / "transactions.bin"), str(tmp_path / "back.csv")
+    rejects = transactions_to_binary(csv_path, binary_path)
+    assert rejects.counts == {"unknown_type": 1}
+    expected = list(TransactionReader(csv_path))
+    assert list(BinaryTransactionReader(binary_path, chunk_rows=64)) == expected
+    transactions_to_csv(binary_path, back_path)
+    assert list(TransactionReader(back_path)) == expected
+    reader = BinaryTransactionReader(binary_path)
+    records = iter(reader)
+    head = [next(records) for _ in range(100)]
+    assert head + list(BinaryTransactionReader(binary_path, reader.offset)) == expected
+
+
+# Test#2: binary input and output give exactly the results of the CSV path
+def test_engine_binary_matches_csv(tmp_path, capsys):
+    transactions = random_transactions(2000, 30)
+    binary_path = str(tmp_path / "transactions.bin")
+    transactions_to_binary(write_csv(tmp_path, "transactions.csv", transactions), binary_path)
+    expected = engine_output(capsys, transactions, streaming=True)
+    for options in ({}, {"streaming": True}, {"streaming": True, "workers": 2}):
+        app = PaymentEngine(binary_path, StringIO(CLIENT_DETAILS), input_format="binary", **options)
+        app.process_transactions()
+        app.write_results()
+        assert capsys.readouterr().out == expected
+    app = PaymentEngine(binary_path, StringIO(CLIENT_DETAILS), input_format="binary")
+    app.process_transactions()
+    output = io.BytesIO()
+    app.write_results_binary(output)
+    states_path, states_csv = tmp_path / "accounts.bin", str(tmp_path / "accounts.csv")
+    states_path.write_bytes(output.getvalue())
+    accounts_to_csv(str(states_path), states_csv)
+    assert open(states_csv, newline="").read() == expected
+    accounts_to_binary(states_csv, str(tmp_path / "again.bin"))
+    assert list(read_account_states(str(tmp_path / "again.bin"))) == list(read_account_states(str(states_path)))
+
+
+# Test#3: rows of a binary file that aren't valid transactions are rejected
+def test_invalid_binary_rows_are_rejected(tmp_path):
+    path = str(tmp_path / "transactions.bin")
+    write_transactions(path, [RecordBatch(np.array([DEPOSIT, 9, DEPOSIT, DISPUTE], dtype=np.int8),
+                                          np.array([1, 1, 1, 1]), np.array([1, 2, 3, 1]),
+                                          np.array([10000, 10000, -5, 7]), np.array([1, 1, 1, 1], dtype=np.uint8))])
+    rejects_csv = StringIO()
+    reader = BinaryTransactionReader(path, rejects=RejectWriter(rejects_csv))
+    assert list(reader) == [(DEPOSIT, 1, 1, 10000), (DISPUTE, 1, 1, None)]
+    assert rejects_csv.getvalue().splitlines()[1:] == ["2,9,1,2,1.0000,unknown_type",
+                                                       "3,deposit,1,3,-0.0005,negative_amount"]
@@ -0,0 +1,85 @@
+# checkpoint.py unit tests written using PyTest framework
+import pytest
+from io import StringIO
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, random_transactions
+
+
+def run_engine(transactions_file, client_details, checkpoint, capsys, **options):
+    """Run the engine, resuming from and saving to checkpoint, and return its output"""
+    app = PaymentEngine(transactions_file, client_details, streaming=True, **options)
+    if client_details is None:
+        app.load_checkpoint(checkpoint)
+    app.process_transactions()
+    app.save_checkpoint(checkpoint)
+    app.write_results()
+    return app, capsys.readouterr().out
+
+
+# Test#1: resuming from a checkpoint processes only appended transactions and gives the same output as a full run
+@pytest.mark.parametrize("options", [{}, {"account_store": "columnar"}, {"workers": 2}])
+def test_resume_matches_full_run(tmp_path, capsys, options):
+    lines = random_transactions(2000, 30).splitlines(keepends=True)
+    transactions_file = tmp_path / "transactions.csv"
+    checkpoint = tmp_path / "engine.ckpt"
+    transactions_file.write_text("".join(lines[:1200]))
+    run_engine(str(transactions_file), StringIO(CLIENT_DETAILS), checkpoint, capsys, **options)
+    with open(transactions_file, "a") as appended:
+        appended.write("".join(lines[1200:]))
+    app, resumed = run_engine(str(transactions_file), None, checkpoint, capsys, **options)
+    _, full = run_engine(str(transactions_file), StringIO(CLIENT_DETAILS), tmp_path / "full.ckpt", capsys, **options)
+    assert resumed == full
+    assert app.transactions_offset == transactions_file.stat().st_size
+
+
+# Test#2: a dispute can refer to a deposit processed in an earlier run
+def test_dispute_of_deposit_from_earlier_run(tmp_path, capsys):
+    transactions_file = tmp_path / "transactions.csv"
+    checkpoint = tmp_path / "engine.ckpt"
+    transactions_file.write_text("type,client,txn,amount\ndeposit,1,1,3.0\n")
+    run_engine(str(transactions_file), StringIO(CLIENT_DETAILS), checkpoint, capsys)
+    with open(transactions_file, "a") as appended:
+        appended.write("dispute,1,1,\n")
+    app, _ = run_engine(str(transactions_file), None, checkpoint, capsys)
+    assert app.clients[1].held == 30000
+    assert app.clients[1].disputed_transactions == {1}
+
+
+# Test#3: checkpoints need streaming mode, and refuse to resume a transactions file that got shorter
+def test_checkpoint_errors(tmp_path):
+    transactions_file = tmp_path / "transactions.csv"
+    transactions_file.write_text("type,client,txn,amount\ndeposit,1,1,3.0\n")
+    batch = PaymentEngine(str(transactions_file), StringIO(CLIENT_DETAILS))
+    with pytest.raises(ValueError):
+        batch.save_checkpoint(tmp_path / "engine.ckpt")
+    app = PaymentEngine(str(transactions_file), StringIO(CLIENT_DETAILS), streaming=True)
+    app.process_transactions()
+    app.save_checkpoint(tmp_path / "engine.ckpt")
+    transactions_file.write_text("type,client,txn,amount\n")
+    with pytest.raises(ValueError):
+        PaymentEngine(str(transactions_file), None, streaming=True).load_checkpoint(tmp_path / "engine.ckpt")
+
+
+# Test#4: a run stopped by a failing worker keeps the offset and can't be checkpointed, resuming from the last
+# checkpoint applies the rows it read
+def test_resume_after_worker_failure(tmp_path, capsys):
+    lines = random_transactions(600, 10).splitlines(keepends=True)
+    transactions_file = tmp_path / "transactions.csv"
+    checkpoint = tmp_path / "engine.ckpt"
+    transactions_file.write_text("".join(lines[:300]))
+    run_engine(str(transactions_file), StringIO(CLIENT_DETAILS), checkpoint, capsys, workers=2)
+    with open(transactions_file, "a") as appended:
+        appended.write("".join(lines[300:]))
+    app = PaymentEngine(str(transactions_file), None, streaming=True, workers=2)
+    app.load_checkpoint(checkpoint)
+    offset, states = app.transactions_offset, app.account_states()
+    # Workers create their ledger with the engine's account store
+    app.account_store = "unknown"
+    app.process_transactions()
+    assert capsys.readouterr().out == "Exception: 'unknown'\n"
+    assert app.transactions_offset == offset and app.account_states() == states
+    with pytest.raises(ValueError):
+        app.save_checkpoint(checkpoint)
+    _, resumed = run_engine(str(transactions_file), None, checkpoint, capsys, workers=2)
+    _, full = run_engine(str(transactions_file), StringIO(CLIENT_DETAILS), tmp_path / "full.ckpt", capsys)
+    assert resumed == full
@@ -0,0 +1,72 @@
+# decoding.py unit tests written using PyTest framework
+from io import StringIO
+from src.decoding import (BAD_AMOUNT, BAD_CLIENT, BAD_TXN, CHARGEBACK, DEPOSIT, NEGATIVE_AMOUNT, WITHDRAW,
+                          RejectWriter, decode_columns, decode_row)
+from src.outcomes import MISSING_AMOUNT, UNKNOWN_TYPE
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS
+
+ROWS = [
+    ("deposit", "1", "1", "2.5"),
+    (" withdraw ", " 2 ", " 3 ", " 0.0001 "),
+    ("chargeback", "1", "1", "ignored"),
+    ("withdrawal", "1", "4", "1.0"),
+    ("deposit", "x", "5", "1.0"),
+    ("deposit", "1", "-6", "1.0"),
+    ("deposit", "1", "7", ""),
+    ("withdraw", "1", "8", "1.2.3"),
+    ("deposit", "1", "9", "-1.0"),
+    ("deposit", "1", "10", "123456789012.34567"),
+    ("deposit", "1", "11", "1e3"),
+]
+DECODED = [
+    ((DEPOSIT, 1, 1, 25000), None),
+    ((WITHDRAW, 2, 3, 1), None),
+    ((CHARGEBACK, 1, 1, None), None),
+    (None, UNKNOWN_TYPE),
+    (None, BAD_CLIENT),
+    (None, BAD_TXN),
+    (None, MISSING_AMOUNT),
+    (None, BAD_AMOUNT),
+    (None, NEGATIVE_AMOUNT),
+    ((DEPOSIT, 1, 10, 1234567890123457), None),
+    ((DEPOSIT, 1, 11, 10000000), None),
+]
+
+
+# Test#1: rows are decoded into typed records or rejected with the reason, one row at a time
+def test_decode_row():
+    assert [decode_row(list(row)) for row in ROWS] == DECODED
+    assert decode_row(["dispute", "1"]) == (None, BAD_TXN)
+
+
+# Test#2: decoding columns gives the same records and reasons as decoding each row
+def test_decode_columns_matches_decode_row():
+    records, record_rows, rejects = decode_columns(*zip(*ROWS))
+    assert records == [record for record, _ in DECODED if record is not None]
+    assert record_rows == [row for row, (record, _) in enumerate(DECODED) if record is not None]
+    assert rejects == [(row, reason) for row, (_, reason) in enumerate(DECODED) if reason is not None]
+    assert all(type(value) is int for record in records for value in record if value is not None)
+
+
+# Test#3: rejected rows are written with their row number and reason, batch and streaming agree and valid rows
+# are still applied
+def test_rejects_are_written():
+    transactions = ("type,client,txn,amount\n"
+                    "deposit,1,1,1.0\n"
+                    "deposit,1,2,abc\n"
+                    "withdrawal,1,3,1.0\n"
+                    "deposit,1,4,2.0\n")
+    outputs = []
+    for streaming in (False, True):
+        rejects_csv = StringIO()
+        rejects = RejectWriter(rejects_csv)
+        app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), streaming=streaming, rejects=rejects)
+        app.process_transactions()
+        assert app.clients[1].available == 130000
+        assert rejects.counts == {BAD_AMOUNT: 1, UNKNOWN_TYPE: 1}
+        outputs.append(rejects_csv.getvalue())
+    assert outputs[0] == outputs[1]
+    assert outputs[0].splitlines() == ["row,type,client,txn,amount,reason",
+                                       "2,deposit,1,2,abc,bad_amount",
+                                       "3,withdrawal,1,3,1.0,unknown_type"]
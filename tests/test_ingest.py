@@ -0,0 +1,68 @@
+# ingest.py unit tests written using PyTest framework
+from io import StringIO
+from src.decoding import DEPOSIT, DISPUTE, RESOLVE, RejectWriter
+from src.ingest import ParallelTransactionReader, TransactionReader, iter_transactions
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+# Test#1: rows are stripped and decoded, rows without an amount or with a trailing empty amount get None
+def test_iter_transactions_parses_rows():
+    transactions_csv = StringIO(
+        "type, client, txn, amount\n"
+        "deposit, 1, 1, 2.5\n"
+        "\n"
+        "dispute, 1, 1\n"
+        "resolve,1,1,\n"
+    )
+    assert list(iter_transactions(transactions_csv)) == [
+        (DEPOSIT, 1, 1, 25000),
+        (DISPUTE, 1, 1, None),
+        (RESOLVE, 1, 1, None),
+    ]
+
+
+# Test#2: empty input yields no transactions
+def test_iter_transactions_empty_input():
+    assert list(iter_transactions(StringIO(""))) == []
+
+
+# Test#3: a reader started at the offset of another reader continues with the next row
+def test_reader_resumes_from_offset():
+    transactions_csv = "type,client,txn,amount\ndeposit,1,1,1.0\ndeposit,1,2,2.0\ndispute,1,1\n"
+    first = TransactionReader(StringIO(transactions_csv))
+    rows = iter(first)
+    assert next(rows) == (DEPOSIT, 1, 1, 10000)
+    resumed = TransactionReader(StringIO(transactions_csv), first.offset)
+    assert list(resumed) == [(DEPOSIT, 1, 2, 20000), (DISPUTE, 1, 1, None)]
+    assert resumed.offset == len(transactions_csv)
+
+
+# Test#4: parsing byte ranges in worker processes yields the same records, offsets and rejects as reading
+# the file in one process, including rows with a trailing empty amount, blank lines and a start offset
+def test_parallel_reader_matches_reader(tmp_path):
+    transactions_file = tmp_path / "transactions.csv"
+    transactions_file.write_text(random_transactions(400, 8) + "\ndeposit, 2, 401, 1.5\nwithdrawal,1,402,1.0\n"
+                                 "dispute,2,401,\ndeposit,3,403")
+    path = str(transactions_file)
+    for start_offset in (0, 2000):
+        expected_rejects, rejects = StringIO(), StringIO()
+        reader = TransactionReader(path, start_offset, RejectWriter(expected_rejects))
+        expected = [(record, reader.offset) for record in reader]
+        parallel = ParallelTransactionReader(path, start_offset, RejectWriter(rejects), workers=2, block_bytes=512)
+        assert [(record, parallel.offset) for record in parallel] == expected
+        assert parallel.offset == reader.offset == transactions_file.stat().st_size
+        assert rejects.getvalue() == expected_rejects.getvalue()
+        assert "withdrawal" in rejects.getvalue()
+
+
+# Test#5: the engine gives the same output with parallel parsing
+def test_engine_with_parse_workers(tmp_path, capsys):
+    transactions = random_transactions(2000, 30)
+    transactions_file = tmp_path / "transactions.csv"
+    transactions_file.write_text(transactions)
+    expected = engine_output(capsys, transactions, streaming=True)
+    app = PaymentEngine(str(transactions_file), StringIO(CLIENT_DETAILS), streaming=True, parse_workers=3)
+    app.process_transactions()
+    app.write_results()
+    assert capsys.readouterr().out == expected
@@ -0,0 +1,50 @@
+# ledger.py unit tests written using PyTest framework
+import subprocess
+import sys
+from io import StringIO
+from pathlib import Path
+import numpy as np
+from src.decoding import CHARGEBACK, DEPOSIT, DISPUTE, NEGATIVE_AMOUNT, WITHDRAW, RecordBatch, decode_row
+from src.ledger import Ledger
+from src.outcomes import APPLIED, INSUFFICIENT_FUNDS, LOCKED_ACCOUNT, MISSING_AMOUNT, UNKNOWN_TXN
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, random_transactions
+
+
+# Test#1: a ledger created from account states answers every submitted record with its outcome
+def test_submit_outcomes():
+    ledger = Ledger({1: (100000, 0, 100000, False), 2: (0, 0, 0, True)})
+    assert ledger.submit(DEPOSIT, 1, 1, 50000) == APPLIED
+    assert ledger.submit(WITHDRAW, 1, 2, 500000) == INSUFFICIENT_FUNDS
+    assert ledger.submit(DEPOSIT, 2, 3, 10000) == LOCKED_ACCOUNT
+    assert ledger.submit(DISPUTE, 1, 99) == UNKNOWN_TXN
+    assert ledger.submit(DEPOSIT, 1, 4) == MISSING_AMOUNT
+    assert ledger.submit(WITHDRAW, 1, 5, -1) == NEGATIVE_AMOUNT
+    assert ledger.submit_batch([(DISPUTE, 1, 1, None), (CHARGEBACK, 1, 1, None), (DEPOSIT, 1, 6, 1)]) == \
+        [APPLIED, APPLIED, LOCKED_ACCOUNT]
+    assert ledger.account_states()[1] == (100000, 0, 100000, True, set())
+
+
+# Test#2: submitting a RecordBatch gives the same accounts as the engine processing the same CSV
+def test_submit_batch_matches_engine():
+    transactions = random_transactions(2000, 30)
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), streaming=True)
+    app.process_transactions()
+    records = [decode_row(line.split(","))[0] for line in transactions.splitlines()[1:]]
+    types, clients, txns, amounts = zip(*records)
+    batch = RecordBatch(np.array(types, dtype=np.int8), np.array(clients), np.array(txns),
+                        np.array([amount or 0 for amount in amounts]),
+                        np.array([amount is not None for amount in amounts]))
+    ledger = Ledger({1: (100000, 0, 100000, False), 2: (200000, 20000, 220000, True),
+                     3: (300000, 0, 300000, False)}, account_store="columnar", track_changes=True)
+    outcomes = ledger.submit_batch(batch)
+    assert len(outcomes) == len(records) and APPLIED in outcomes
+    assert ledger.account_states() == app.account_states()
+    assert {client_id for client_id, _ in ledger.output_accounts(changed_only=True)} == ledger.changed
+
+
+# Test#3: the ledger can be used without loading pandas
+def test_ledger_without_pandas():
+    code = ("import sys; from src.ledger import Ledger; Ledger().submit(0, 1, 1, 10); "
+            "assert 'pandas' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=Path(__file__).parent.parent)
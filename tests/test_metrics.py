@@ -0,0 +1,116 @@
+# metrics.py unit tests written using PyTest framework
+import time
+from io import StringIO
+import pytest
+from src.metrics import EngineMetrics, SamplingProfiler, histogram_summary
+from src.payment_engine import PaymentEngine
+from tests.txn_data import CLIENT_DETAILS, random_transactions
+
+# Client 2 is locked in CLIENT_DETAILS
+TRANSACTIONS = (
+    "type,client,txn,amount\n"
+    "deposit,1,1,3.0\n"
+    "deposit,2,2,1.0\n"
+    "withdraw,1,3,100.0\n"
+    "withdrawal,1,4,1.0\n"
+    "dispute,1,9\n"
+    "dispute,4,1\n"
+    "dispute,1,1\n"
+    "resolve,1,1\n"
+    "chargeback,1,1\n"
+)
+
+
+def run_with_metrics(**options):
+    metrics = EngineMetrics(**options.pop("metrics_options", {}))
+    app = PaymentEngine(StringIO(TRANSACTIONS), StringIO(CLIENT_DETAILS), streaming=True, metrics=metrics, **options)
+    app.process_transactions()
+    return metrics.as_dict()
+
+
+# Test#1: processed, applied and ignored transactions are counted per type with the reason they were ignored,
+# rows rejected by decoding are counted separately
+def test_counts_by_type_and_reason():
+    stats = run_with_metrics()
+    assert stats["processed"] == 8
+    assert stats["applied"] == 3
+    assert stats["by_type"]["deposit"] == {"processed": 2, "applied": 1, "ignored": {"locked_account": 1}}
+    assert stats["by_type"]["withdraw"]["ignored"] == {"insufficient_funds": 1}
+    assert "withdrawal" not in stats["by_type"]
+    assert stats["rejected"] == {"unknown_type": 1}
+    assert stats["by_type"]["dispute"] == {"processed": 3, "applied": 1,
+                                           "ignored": {"unknown_txn": 1, "client_mismatch": 1}}
+    assert stats["by_type"]["chargeback"]["ignored"] == {"not_disputed": 1}
+    assert stats["latency_ns"]["deposit"]["count"] == 2
+    assert stats["errors"] == []
+
+
+# Test#2: metrics of sharded workers are merged into the engine metrics. Workers only know their own clients'
+# transactions, so a dispute of another client's transaction is counted as unknown_txn
+def test_sharded_metrics_are_merged():
+    sharded, serial = run_with_metrics(workers=2), run_with_metrics()
+    assert sharded["processed"] == serial["processed"] and sharded["applied"] == serial["applied"]
+    assert sharded["by_type"]["deposit"] == serial["by_type"]["deposit"]
+    assert sharded["by_type"]["dispute"]["ignored"] == {"unknown_txn": 2}
+
+
+# Test#3: metrics are reported periodically during the run, latency can be switched off
+def test_periodic_reports():
+    reports = []
+    stats = run_with_metrics(metrics_options={"report_every": 4, "reporter": reports.append, "latency": False})
+    assert [report["processed"] for report in reports] == [4, 8]
+    assert stats["latency_ns"] == {}
+
+
+# Test#4: errors that stop processing are recorded
+def test_error_is_recorded(capsys, tmp_path):
+    metrics = EngineMetrics()
+    app = PaymentEngine(str(tmp_path / "missing.csv"), StringIO(CLIENT_DETAILS), streaming=True, metrics=metrics)
+    app.process_transactions()
+    assert metrics.as_dict()["processed"] == 0
+    assert metrics.errors[0].startswith("FileNotFoundError")
+    assert capsys.readouterr().out.startswith("Exception:")
+
+
+# Test#5: histogram summary gives bucket upper bounds as percentiles
+def test_histogram_summary():
+    histogram = [0] * 48
+    histogram[10] = 98
+    histogram[20] = 2
+    summary = histogram_summary(histogram)
+    assert summary["count"] == 100
+    assert summary["p50"] == 1024 and summary["p99"] == 2 ** 20 and summary["max"] == 2 ** 20
+
+
+# Test#6: sampling profiler collects stacks of the thread that started it
+def test_sampling_profiler(tmp_path):
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    profiler.stop()
+    assert any(stack.endswith("test_sampling_profiler") for stack in profiler.samples)
+    profiler.write_collapsed(tmp_path / "profile.txt")
+    assert (tmp_path / "profile.txt").read_text().strip()
+
+
+# Test#7: periodic reports cover rows applied by the scan kernel, and records routed to sharded workers, whose
+# counts are merged at the end; workers are sampled by the profiler
+@pytest.mark.parametrize("options", [{"scan_kernel": True}, {"workers": 2}])
+def test_periodic_reports_of_batches_and_shards(options):
+    reports = []
+    metrics = EngineMetrics(report_every=100, reporter=reports.append, latency=False,
+                            profiler=SamplingProfiler(interval=0.001))
+    # Clients that only deposit and withdraw are scanned
+    transactions = "type,client,txn,amount\n" + "".join(
+        f"{'deposit' if row % 3 else 'withdraw'},{row % 20 + 3},{row},1.0\n" for row in range(2000))
+    app = PaymentEngine(StringIO(transactions if "scan_kernel" in options else random_transactions(2000, 20)),
+                        StringIO(CLIENT_DETAILS), streaming=True, metrics=metrics, **options)
+    app.process_transactions()
+    progress = [report["routed"] if "workers" in options else report["processed"] for report in reports]
+    assert progress == sorted(progress) and progress[-1] > 1900
+    assert metrics.as_dict()["processed"] == 2000
+    if "workers" in options:
+        assert len(reports) == 20 and metrics.routed == 2000
+        assert any("src.sharding:_run_shard" in stack for stack in metrics.profiler.samples)
@@ -0,0 +1,28 @@
+# money.py unit tests written using PyTest framework
+import pytest
+from decimal import Decimal
+from src.money import format_amount, parse_amount, to_decimal
+
+
+# Test#1: amounts are parsed into integer units of 1/10000
+@pytest.mark.parametrize("text, units", [
+    ("2", 20000), ("2.5", 25000), (" 1.1234 ", 11234), ("-1.5", -15000), (".5", 5000), ("1e3", 10000000),
+    ("1.23455", 12346),
+])
+def test_parse_amount(text, units):
+    assert parse_amount(text) == units
+
+
+# Test#2: malformed amounts raise ValueError
+@pytest.mark.parametrize("text", ["", "-", "abc", "1.2.3", "nan"])
+def test_parse_amount_invalid(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+
+# Test#3: units are formatted with 4 decimal places and convert to exact Decimals
+def test_format_amount_and_to_decimal():
+    assert format_amount(0) == "0.0000"
+    assert format_amount(-5) == "-0.0005"
+    assert format_amount(123456789012345678) == "12345678901234.5678"
+    assert to_decimal(123456789012345678) == Decimal("12345678901234.5678")
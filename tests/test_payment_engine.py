@@ -4,6 +4,7 @@ import pytest_html
 from decimal import *
 from io import StringIO
 from src.payment_engine import PaymentEngine
+from src.decoding import DEPOSIT, WITHDRAW
 import logging
 import sys
 import datetime
@@ -292,7 +293,7 @@ def test_when_resolve_client_do_not_match(client_csv):
     assert client1.locked is False
 
 
-# Test#14: case to check transactions decimal precision of 4
+# Test#14: case to check transactions are kept to 4 decimal places without rounding
 def test_txn_decimal_precision(client_csv):
     in_mem_transaction_csv = StringIO(
         "type,client,txn,amount\n"
@@ -302,4 +303,138 @@ def test_txn_decimal_precision(client_csv):
     app = PaymentEngine(in_mem_transaction_csv, client_csv)
     app.process_transactions()
     client11 = app.clients[11]
-    assert client11.available_balance == round(Decimal(1.1234), 3) + round(Decimal(2.1234), 3)
+    assert client11.available_balance == Decimal("3.2468")
+
+
+# Test#15: case when a transaction id is repeated, dispute refers to the first transaction recorded under that id
+def test_dispute_refers_to_first_txn_with_repeated_id(client_csv):
+    in_mem_transaction_csv = StringIO(
+        "type,client,txn,amount\n"
+        "deposit,1,1,3.0\n"
+        "deposit,1,1,5.0\n"
+        "withdraw,1,2,1.0\n"
+        "dispute,1,1\n"
+    )
+    app = PaymentEngine(in_mem_transaction_csv, client_csv)
+    app.process_transactions()
+    client1 = app.clients[1]
+    assert len(app.txn_index) == 2
+    assert app.txn_index.get(1) == (1, 30000, DEPOSIT)
+    assert app.txn_index.get(2) == (1, None, WITHDRAW)
+    assert client1.available_balance == Decimal(14.0)
+    assert client1.held_amount == Decimal(3.0)
+    assert client1.total_amount == Decimal(17.0)
+
+
+# Test#16: case to check streaming mode produces same client accounts output as batch mode
+def test_streaming_output_matches_batch(capsys):
+    transactions = (
+        "type,client,txn,amount\n"
+        "deposit, 1, 1, 3.0\n"
+        "deposit, 2, 2, 6.0\n"
+        "withdraw, 1, 3, 1.5\n"
+        "dispute, 2, 2,\n"
+        "deposit, 4, 4, 2.5\n"
+        "dispute, 4, 4\n"
+        "chargeback, 4, 4\n"
+        "resolve, 2, 2,\n"
+    )
+    client_details = "client,available,held,total,locked\n1,10.0,0.0,10.0,0\n2,20.0,2.0,22.0,1\n"
+    outputs = []
+    for streaming in (False, True):
+        app = PaymentEngine(StringIO(transactions), StringIO(client_details), streaming=streaming)
+        app.process_transactions()
+        app.write_results()
+        outputs.append(capsys.readouterr().out)
+    LOGGER.info(f"streaming output: = {outputs[1]}")
+    assert outputs[0] == outputs[1]
+
+
+# Test#17: case to check large balances stay exact and are written with 4 decimal places
+def test_large_balances_are_exact(capsys):
+    in_mem_transaction_csv = StringIO(
+        "type,client,txn,amount\n"
+        "deposit,5,1,123456789.1234\n"
+        "deposit,5,2,0.0001\n"
+        "withdraw,5,3,0.5\n"
+    )
+    client_details = StringIO("client,available,held,total,locked\n")
+    app = PaymentEngine(in_mem_transaction_csv, client_details)
+    app.process_transactions()
+    app.write_results()
+    client5 = app.clients[5]
+    assert client5.available_balance == Decimal("123456788.6235")
+    assert capsys.readouterr().out.splitlines()[1] == "5,123456788.6235,0.0000,123456788.6235,False"
+
+
+# Test#18: case when a withdrawal is made for a client that doesn't exist, it is ignored and processing continues
+def test_withdrawal_for_unknown_client(client_csv):
+    in_mem_transaction_csv = StringIO(
+        "type,client,txn,amount\n"
+        "withdraw,9,1,1.0\n"
+        "deposit,1,2,2.0\n"
+    )
+    app = PaymentEngine(in_mem_transaction_csv, client_csv)
+    app.process_transactions()
+    assert not app.is_client_exists(9)
+    assert app.clients[1].available_balance == Decimal(12.0)
+
+
+# Test#19: case to check only accounts changed by the run are written in changes mode, optionally sorted by
+# client id, and the full dump is unchanged
+def test_changed_accounts_output(capsys):
+    transactions = (
+        "type,client,txn,amount\n"
+        "deposit,9,1,1.0\n"
+        "deposit,2,2,5.0\n"
+        "withdraw,3,3,1.0\n"
+        "withdraw,1,4,100.0\n"
+        "dispute,9,1\n"
+    )
+    client_details = "client,available,held,total,locked\n1,10.0,0.0,10.0,0\n2,20.0,2.0,22.0,1\n3,30.0,0.0,30.0,0\n"
+    outputs = {}
+    for name, options in (("serial", {}), ("sharded", {"workers": 2})):
+        app = PaymentEngine(StringIO(transactions), StringIO(client_details), streaming=True, track_changes=True,
+                            **options)
+        app.process_transactions()
+        app.write_results(changed_only=True)
+        app.write_results(changed_only=True, sort=True)
+        app.write_results()
+        outputs[name] = capsys.readouterr().out
+    LOGGER.info(f"changes output: = {outputs['serial']}")
+    assert outputs["serial"] == outputs["sharded"]
+    assert outputs["serial"].splitlines() == [
+        "client,available,held,total,locked", "3,29.0000,0.0000,29.0000,False", "9,0.0000,1.0000,1.0000,False",
+        "client,available,held,total,locked", "3,29.0000,0.0000,29.0000,False", "9,0.0000,1.0000,1.0000,False",
+        "client,available,held,total,locked", "1,10.0000,0.0000,10.0000,False", "2,20.0000,2.0000,22.0000,True",
+        "3,29.0000,0.0000,29.0000,False", "9,0.0000,1.0000,1.0000,False",
+    ]
+
+
+# Test#20: case to check changes mode needs changes to be tracked
+def test_changed_accounts_need_tracking(client_csv):
+    app = PaymentEngine(StringIO("type,client,txn,amount\n"), client_csv)
+    app.process_transactions()
+    with pytest.raises(ValueError):
+        app.write_results(changed_only=True)
+
+
+# Test#21: case when a deposit reuses the txn id of an earlier withdrawal, the id still refers to the withdrawal
+# so a dispute of it is ignored, whichever way transactions are applied
+@pytest.mark.parametrize("options", [{"streaming": False}, {"streaming": True},
+                                     {"streaming": True, "account_store": "columnar"},
+                                     {"streaming": True, "scan_kernel": True}, {"streaming": True, "workers": 2}])
+def test_dispute_of_deposit_reusing_withdrawal_id(client_csv, options):
+    in_mem_transaction_csv = StringIO(
+        "type,client,txn,amount\n"
+        "withdraw,1,5,1.0\n"
+        "deposit,1,5,3.0\n"
+        "dispute,1,5\n"
+    )
+    app = PaymentEngine(in_mem_transaction_csv, client_csv, **options)
+    app.process_transactions()
+    client1 = app.clients[1]
+    assert client1.available_balance == Decimal(12.0)
+    assert client1.held_amount == Decimal(0.0)
+    assert client1.total_amount == Decimal(12.0)
+    assert app.txn_index.get(5) == (1, None, WITHDRAW)
@@ -0,0 +1,86 @@
+# scan_kernel.py unit tests written using PyTest framework
+import random
+from io import StringIO
+import numpy as np
+import pytest
+from src.decoding import DEPOSIT, DISPUTE, WITHDRAW, RecordBatch
+from src.ledger import Ledger
+from src.metrics import EngineMetrics
+from src.outcomes import APPLIED, INSUFFICIENT_FUNDS, NOT_A_DEPOSIT, UNKNOWN_CLIENT
+from src.payment_engine import PaymentEngine
+from src.scan_kernel import MAX_ROUNDS, SCAN_OUTCOMES, scan_balances
+from tests.txn_data import CLIENT_DETAILS, random_transactions
+
+
+def mixed_transactions(rows, seed=3):
+    """random_transactions with deposits and withdrawals of clients 50 to 80 interleaved, a dispute of another
+    client's deposit and withdrawals before a client's first deposit"""
+    rng = random.Random(seed)
+    lines = random_transactions(rows, 40).splitlines()
+    mixed = lines[:1] + ["withdraw,60,900000,1.0", "dispute,5,900001,"]
+    for txn_id, line in enumerate(lines[1:], start=900001):
+        mixed.append(line)
+        txn_type = "deposit" if rng.random() < 0.5 else "withdraw"
+        mixed.append(f"{txn_type},{rng.randint(50, 80)},{txn_id},{rng.randint(0, 30000) / 100}")
+    return "\n".join(mixed) + "\n"
+
+
+def run_engine(transactions, **options):
+    metrics = EngineMetrics(latency=False)
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), metrics=metrics, **options)
+    app.process_transactions()
+    return app, metrics.counts
+
+
+# Test#1: the scan refuses withdrawals the running balance doesn't cover and withdrawals of clients without an
+# account before their first deposit, also past MAX_ROUNDS refusals
+def test_scan_balances():
+    refused = MAX_ROUNDS + 5
+    amounts = np.array([5, 10, 3] + [4, 1, 1, 7] + [2] * refused + [3, 2, 2], dtype=np.int64)
+    withdrawals = np.array([True, False, True] + [True, True, False, True] + [True] * refused + [False, True, True])
+    codes, final = scan_balances(amounts, withdrawals, np.array([0, 3, 7]), [0, 1, 0], np.array([False, True, True]))
+    outcomes = SCAN_OUTCOMES[codes].tolist()
+    assert outcomes[:7] == [UNKNOWN_CLIENT, APPLIED, APPLIED, INSUFFICIENT_FUNDS, APPLIED, APPLIED, INSUFFICIENT_FUNDS]
+    assert outcomes[7:] == [INSUFFICIENT_FUNDS] * refused + [APPLIED, APPLIED, INSUFFICIENT_FUNDS]
+    assert final.tolist() == [7, 1, 1]
+
+
+# Test#2: with the scan kernel the accounts, their order, the changed accounts and the outcome counts are those of
+# applying every row one by one, streamed or not and with either account store
+@pytest.mark.parametrize("options", [{"streaming": True}, {"streaming": False},
+                                     {"streaming": True, "account_store": "columnar"}])
+def test_same_result_as_row_path(options):
+    transactions = mixed_transactions(3000)
+    expected, expected_counts = run_engine(transactions, track_changes=True, **options)
+    app, counts = run_engine(transactions, track_changes=True, scan_kernel=True, **options)
+    assert list(app.account_states().items()) == list(expected.account_states().items())
+    assert app.changed == expected.changed
+    assert counts == expected_counts
+    assert app.txn_index.entries() == expected.txn_index.entries()
+
+
+# Test#3: submitting a RecordBatch to a ledger with the scan kernel gives the outcome of every row
+def test_submit_batch_outcomes():
+    ledger = Ledger({1: (10000, 0, 10000, False)}, scan_kernel=True)
+    batch = RecordBatch(np.array([WITHDRAW, DEPOSIT, WITHDRAW, DEPOSIT, DISPUTE, WITHDRAW], dtype=np.int8),
+                        np.array([2, 2, 2, 1, 1, 1]), np.array([1, 2, 3, 4, 4, 5]),
+                        np.array([1, 50000, 60000, 1, 0, 1]), np.array([1, 1, 1, 1, 0, 1], dtype=bool))
+    assert ledger.submit_batch(batch) == [UNKNOWN_CLIENT, APPLIED, INSUFFICIENT_FUNDS, APPLIED, APPLIED, APPLIED]
+    assert ledger.account_states() == {1: (9999, 1, 10000, False, {4}), 2: (50000, 0, 50000, False, set())}
+    assert list(ledger.clients) == [1, 2]
+
+
+# Test#4: scanned withdrawals are recorded in the transaction index, a deposit reusing the id of one in a later batch
+# can't be disputed
+def test_scanned_withdrawal_ids_are_kept():
+    ledger = Ledger({1: (10000, 0, 10000, False)}, scan_kernel=True)
+
+    def batch(txn_type, amount):
+        return RecordBatch(np.array([txn_type], dtype=np.int8), np.array([1]), np.array([5]), np.array([amount]),
+                           np.array([amount is not None]))
+
+    assert ledger.submit_batch(batch(WITHDRAW, 2000)) == [APPLIED]
+    assert ledger.submit_batch(batch(DEPOSIT, 5000)) == [APPLIED]
+    assert ledger.submit_batch(batch(DISPUTE, 0)) == [NOT_A_DEPOSIT]
+    assert ledger.txn_index.get(5) == (1, None, WITHDRAW)
+    assert ledger.account_states() == {1: (13000, 0, 13000, False, set())}
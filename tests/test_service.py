@@ -0,0 +1,62 @@
+# service.py unit tests written using PyTest framework
+import asyncio
+import pytest
+from io import StringIO
+from src.payment_engine import PaymentEngine
+from src.service import PaymentService, ServiceClient
+from tests.txn_data import CLIENT_DETAILS
+
+
+@pytest.fixture
+def service():
+    return PaymentService(PaymentEngine(None, StringIO(CLIENT_DETAILS), streaming=True))
+
+
+# Test#1: transactions are applied without a response, malformed ones rejected, balances and errors are answered
+def test_handle_line(service):
+    assert service.handle_line("type,client,txn,amount\n") is None
+    assert service.handle_line("deposit, 1, 1, 2.5\n") is None
+    assert service.handle_line("balance,1\n") == "1,12.5000,0.0000,12.5000,False"
+    assert service.handle_line("balance,9\n") == "error,unknown client 9"
+    assert service.handle_line("balance,x\n").startswith("error,")
+    assert service.handle_line("deposit,x,1,1.0\n") is None
+    assert service.engine.rejects.counts == {"bad_client": 1}
+
+
+# Test#2: a client connected over a socket sees its own transactions applied in order, and another client
+# connected at the same time can query the same balances
+def test_clients_over_socket(service):
+    async def scenario():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            writer_client = await ServiceClient.connect(port=port)
+            reader_client = await ServiceClient.connect(port=port)
+            writer_client.send_transaction("deposit", 1, 1, "3.0")
+            writer_client.send_transaction("deposit", 4, 2, "1.0")
+            writer_client.send_transaction("dispute", 1, 1)
+            assert await writer_client.balance(1) == ("1", "10.0000", "3.0000", "13.0000", "False")
+            assert await reader_client.balance(4) == ("4", "1.0000", "0.0000", "1.0000", "False")
+            with pytest.raises(LookupError):
+                await reader_client.balance(99)
+            await writer_client.close()
+            await reader_client.close()
+
+    asyncio.run(scenario())
+
+
+# Test#3: malformed transactions get no answer, so the following queries still read their own answers
+def test_malformed_transaction_over_socket(service):
+    async def scenario():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            client = await ServiceClient.connect(port=port)
+            client.send_transaction("withdrawal", 1, 5, "1.0")
+            assert await client.balance(1) == ("1", "10.0000", "0.0000", "10.0000", "False")
+            client.send_transaction("deposit", 1, 6, "5.0")
+            assert await client.balance(1) == ("1", "15.0000", "0.0000", "15.0000", "False")
+            await client.close()
+
+    asyncio.run(scenario())
+    assert service.engine.rejects.counts == {"unknown_type": 1}
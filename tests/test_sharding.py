@@ -0,0 +1,102 @@
+# sharding.py unit tests written using PyTest framework
+from io import StringIO
+import time
+import pytest
+from src.decoding import DEPOSIT
+from src.payment_engine import PaymentEngine
+from src.sharding import QUEUE_DEPTH, RecordedShards, run_sharded, shard_of
+from src.txn_index import RetentionPolicy
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+# Test#1: clients are spread over all shards
+def test_shard_of_spreads_clients():
+    assert {shard_of(client_id, 4) for client_id in range(100)} == {0, 1, 2, 3}
+
+
+# Test#2: sharded run writes exactly the same output as a serial run
+def test_sharded_output_matches_serial(capsys):
+    transactions = random_transactions(3000, 40)
+    serial = engine_output(capsys, transactions, streaming=True)
+    sharded = engine_output(capsys, transactions, streaming=True, workers=3)
+    assert sharded == serial
+
+
+# Test#3: transaction index of the workers is merged back into the engine
+def test_sharded_run_merges_txn_index():
+    transactions = "type,client,txn,amount\ndeposit,1,1,1.0\ndeposit,4,2,2.0\ndeposit,5,3,3.0\ndispute,5,3\n"
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), workers=2)
+    app.process_transactions()
+    assert len(app.txn_index) == 3
+    assert app.clients[5].disputed_transactions == {3}
+    assert list(app.clients) == [1, 2, 3, 4, 5]
+
+
+# Test#4: when a worker raises, feeding stops once its queue is full and the error is raised instead of waiting
+# on the worker forever, the engine reports it
+def test_worker_error_is_raised(capsys):
+    records = [(DEPOSIT, 1, 1, None)] + [(DEPOSIT, 1, txn_id, 10000) for txn_id in range(2, 10 * QUEUE_DEPTH)]
+    with pytest.raises(TypeError):
+        run_sharded(iter(records), {}, {}, 2, batch_size=1)
+    app = PaymentEngine(StringIO("type,client,txn,amount\ndeposit,1,1,1.0\n"), StringIO(CLIENT_DETAILS), workers=2)
+    # Workers create their ledger with the engine's account store
+    app.account_store = "unknown"
+    app.process_transactions()
+    assert capsys.readouterr().out == "Exception: 'unknown'\n"
+    assert app.account_states() == {1: (100000, 0, 100000, False, set()), 2: (200000, 20000, 220000, True, set()),
+                                    3: (300000, 0, 300000, False, set())}
+
+
+# Test#5: a txn id reused by a client of another shard still refers to the first transaction recorded under it, the
+# output and the merged transaction index are those of a serial run
+def test_repeated_txn_id_across_shards(capsys):
+    transactions = ("type,client,txn,amount\ndeposit,1,5,1.0\ndeposit,2,5,3.0\ndispute,2,5\ndispute,1,5\n"
+                    "withdraw,4,6,1.0\ndeposit,3,6,2.0\ndispute,3,6\ndeposit,4,7,4.0\nwithdraw,1,7,1.0\ndispute,4,7\n")
+    assert shard_of(1, 2) == shard_of(3, 2) != shard_of(2, 2) == shard_of(4, 2)
+    outputs, indexes = [], []
+    for workers in (1, 2):
+        app = PaymentEngine(StringIO(transactions), None, streaming=True, workers=workers)
+        app.process_transactions()
+        app.write_results()
+        outputs.append(capsys.readouterr().out)
+        indexes.append(app.txn_index.entries())
+    assert outputs[1] == outputs[0]
+    assert outputs[0].splitlines()[1:] == ["1,0.0000,1.0000,1.0000,False", "2,3.0000,0.0000,3.0000,False",
+                                           "3,2.0000,0.0000,2.0000,False", "4,0.0000,4.0000,4.0000,False"]
+    assert indexes[1] == indexes[0]
+
+
+# Test#6: with a retention policy the ids kept by the parent are bounded like the index, an id reused by another
+# shard once the first transaction is forgotten is recorded by that shard as in a serial run
+def test_recorded_ids_follow_retention(capsys):
+    recorded = RecordedShards(RetentionPolicy(max_age=10))
+    for row in range(1, 1001):
+        assert recorded.first_shard(row, row % 3, row) == row % 3
+    assert len(recorded) == 10 and recorded.first_shard(995, 0, 1001) == 995 % 3
+    transactions = ("type,client,txn,amount\ndeposit,1,5,1.0\ndeposit,1,10,1.0\ndeposit,1,11,1.0\n"
+                    "deposit,1,12,1.0\ndeposit,1,13,1.0\ndeposit,4,5,3.0\ndispute,4,5\n")
+    outputs = [engine_output(capsys, transactions, streaming=True, workers=workers,
+                             retention=RetentionPolicy(max_age=3)) for workers in (1, 2)]
+    assert outputs[1] == outputs[0]
+    assert "4,0.0000,3.0000,3.0000,False" in outputs[0].splitlines()
+
+
+# Test#7: with publish the accounts of every batch a worker applied are published while records are still fed
+def test_balances_published_during_run():
+    assert shard_of(1, 2) != shard_of(2, 2)
+    fed, published = [], []
+
+    def records():
+        for txn_id in range(1, 41):
+            yield DEPOSIT, 1 + txn_id % 2, txn_id, 10000
+            fed.append(txn_id)
+            if txn_id % 10 == 0:
+                # Let the workers apply the batches sent so far
+                time.sleep(0.5)
+
+    run_sharded(records(), {}, {}, 2, batch_size=5, publish=lambda states: published.append((len(fed), states)))
+    assert published[0][0] < 30
+    final = {}
+    for _, states in published:
+        final.update(states)
+    assert final == {1: (200000, 0, 200000, False), 2: (200000, 0, 200000, False)}
@@ -0,0 +1,90 @@
+# snapshot.py unit tests written using PyTest framework
+import pytest
+from io import StringIO
+from src.payment_engine import PaymentEngine
+from src.snapshot import AccountSnapshot, is_snapshot, read_account_rows, write_snapshot
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "accounts.snap")
+    write_snapshot(path, read_account_rows(StringIO(CLIENT_DETAILS)))
+    return path
+
+
+def snapshot_output(capsys, snapshot_path, transactions, **options):
+    app = PaymentEngine(StringIO(transactions), snapshot_path, **options)
+    app.process_transactions()
+    app.write_results()
+    return app, capsys.readouterr().out
+
+
+# Test#1: the snapshot holds the accounts of the CSV and finds them by client id
+def test_snapshot_round_trip(snapshot_path):
+    snapshot = AccountSnapshot(snapshot_path)
+    assert is_snapshot(snapshot_path) and len(snapshot) == 3
+    assert snapshot.account(snapshot.row_of(2)) == (2, 200000, 20000, 220000, True)
+    assert snapshot.row_of(4) is None
+    assert snapshot.text(0, 1) == "1,10.0000,0.0000,10.0000,False\r\n"
+
+
+# Test#2: processing with a snapshot gives the same output as with the accounts CSV, in every mode
+def test_snapshot_output_matches_csv(capsys, snapshot_path):
+    transactions = random_transactions(500, 6)
+    for options in ({}, {"streaming": True, "account_store": "columnar"}, {"streaming": True, "workers": 2}):
+        expected = engine_output(capsys, transactions, **options)
+        assert snapshot_output(capsys, snapshot_path, transactions, **options)[1] == expected
+
+
+# Test#3: only accounts touched by a transaction are read from the snapshot, the others are written as they are
+def test_untouched_accounts_are_not_materialized(capsys, snapshot_path):
+    transactions = "type,client,txn,amount\ndeposit,3,1,1.5\ndeposit,7,2,2.0\nwithdraw,9,3,1.0\n"
+    app, output = snapshot_output(capsys, snapshot_path, transactions)
+    assert app.clients.materialized == {3: 2}
+    assert len(app.clients) == 4 and list(app.clients) == [1, 2, 3, 7]
+    assert output.splitlines() == ["client,available,held,total,locked",
+                                   "1,10.0000,0.0000,10.0000,False",
+                                   "2,20.0000,2.0000,22.0000,True",
+                                   "3,31.5000,0.0000,31.5000,False",
+                                   "7,2.0000,0.0000,2.0000,False"]
+
+
+# Test#4: client ids of a snapshot must be unique
+def test_duplicate_client_ids_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_snapshot(str(tmp_path / "accounts.snap"), [(1, 0, 0, 0, False), (1, 0, 0, 0, False)])
+
+
+# Test#5: with a snapshot only the changed accounts are looked at for the changes output
+def test_changed_accounts_from_snapshot(capsys, snapshot_path):
+    transactions = "type,client,txn,amount\ndeposit,2,1,1.0\ndeposit,3,2,1.5\ndeposit,7,3,2.0\n"
+    app = PaymentEngine(StringIO(transactions), snapshot_path, track_changes=True)
+    app.process_transactions()
+    app.write_results(changed_only=True, sort=True)
+    assert capsys.readouterr().out.splitlines() == ["client,available,held,total,locked",
+                                                    "3,31.5000,0.0000,31.5000,False",
+                                                    "7,2.0000,0.0000,2.0000,False"]
+    assert sorted(app.clients.materialized) == [2, 3]
+
+
+# Test#6: sharded workers read snapshot accounts themselves, the engine keeps the snapshot and only materializes
+# the accounts touched by the workers, resuming from them on the next run
+def test_sharded_run_keeps_snapshot(capsys, tmp_path):
+    path = str(tmp_path / "many.snap")
+    write_snapshot(path, ((client_id, client_id, 0, client_id, False) for client_id in range(1, 1001)))
+    transactions_file = tmp_path / "transactions.csv"
+    outputs = []
+    for workers in (1, 2):
+        transactions_file.write_text("type,client,txn,amount\ndeposit,10,1,1.0\ndeposit,2000,2,2.0\n"
+                                     "deposit,11,3,1.0\ndispute,10,1\n")
+        app = PaymentEngine(str(transactions_file), path, streaming=True, workers=workers)
+        app.process_transactions()
+        with open(transactions_file, "a") as appended:
+            appended.write("deposit,3000,4,3.0\nresolve,10,1\nwithdraw,11,5,1.0\n")
+        app.process_transactions()
+        app.write_results()
+        outputs.append(capsys.readouterr().out)
+        assert sorted(app.clients.materialized) == [10, 11] and len(app.clients) == 1002
+        assert list(app.clients)[-2:] == [2000, 3000]
+    assert outputs[1] == outputs[0]
@@ -0,0 +1,102 @@
+# txn_index.py unit tests written using PyTest framework
+from io import StringIO
+import pytest
+from src.decoding import DEPOSIT
+from src.metrics import EngineMetrics
+from src.payment_engine import PaymentEngine
+from src.txn_index import ENTRY_BYTES, RetentionPolicy, TransactionIndex
+from tests.txn_data import CLIENT_DETAILS, engine_output, random_transactions
+
+
+def run_engine(transactions, retention, **options):
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), streaming=True, retention=retention,
+                        **options)
+    app.process_transactions()
+    return app
+
+
+# Test#1: deposits older than the window are evicted, disputes of them are ignored and counted
+def test_deposits_are_evicted_by_age():
+    transactions = ("type,client,txn,amount\n"
+                    "deposit,1,1,1.0\n"
+                    "deposit,1,2,2.0\n"
+                    "deposit,1,3,3.0\n"
+                    "dispute,1,1\n"
+                    "dispute,1,3\n")
+    app = run_engine(transactions, RetentionPolicy(max_age=2))
+    assert 1 not in app.txn_index and 3 in app.txn_index
+    assert app.clients[1].held == 30000
+    assert app.txn_index.counters["evicted"] == 1
+    assert app.txn_index.counters["evicted_misses"] == 1
+
+
+# Test#2: with a memory budget the index stays bounded however many deposits are recorded
+def test_memory_budget_bounds_index():
+    index = TransactionIndex(RetentionPolicy(max_bytes=10 * ENTRY_BYTES))
+    for txn_id in range(1000):
+        index.add(txn_id, 1, 10000, DEPOSIT)
+    assert len(index) == 10
+    assert index.get(999) == (1, 10000, DEPOSIT) and index.get(0) is None
+    assert index.counters["evicted"] == 990
+
+
+# Test#3: a deposit under dispute is not evicted until the dispute is closed
+def test_open_dispute_is_kept():
+    transactions = ("type,client,txn,amount\n"
+                    "deposit,1,1,1.0\n"
+                    "dispute,1,1\n"
+                    "deposit,1,2,2.0\n"
+                    "deposit,1,3,3.0\n"
+                    "deposit,1,4,4.0\n"
+                    "chargeback,1,1\n")
+    app = run_engine(transactions, RetentionPolicy(max_age=1, max_bytes=ENTRY_BYTES))
+    client1 = app.clients[1]
+    assert client1.locked and client1.held == 0 and client1.total == 190000
+    assert app.txn_index.counters["evicted_misses"] == 0
+
+
+# Test#4: evicted deposits spill to disk and are found there, the output is the same as without eviction,
+# serial and sharded
+def test_spilled_deposits_are_found(tmp_path, capsys):
+    transactions = random_transactions(3000, 40)
+    expected = engine_output(capsys, transactions, streaming=True)
+    metrics = EngineMetrics(latency=False)
+    app = run_engine(transactions, RetentionPolicy(max_age=50, spill_path=str(tmp_path / "spill.db")),
+                     metrics=metrics)
+    app.write_results()
+    assert capsys.readouterr().out == expected
+    stats = metrics.as_dict()["dispute_window"]
+    assert stats["spilled"] > 0 and stats["spill_hits"] > 0 and stats["evicted_misses"] == 0
+    assert len(app.txn_index) < 100
+    sharded = engine_output(capsys, transactions, streaming=True, workers=2,
+                            retention=RetentionPolicy(max_age=50, spill_path=str(tmp_path / "sharded.db")))
+    assert sharded == expected
+
+
+# Test#5: deposits spilled by an earlier run are only disputable when resuming from its checkpoint, serial and sharded
+@pytest.mark.parametrize("workers", [1, 2])
+def test_spill_file_of_earlier_run(tmp_path, workers):
+    transactions_file = tmp_path / "transactions.csv"
+    transactions_file.write_text("type,client,txn,amount\ndeposit,7,1,5.0\n" +
+                                 "".join(f"deposit,{8 + row % 2},{row},1.0\n" for row in range(2, 10)))
+    retention = RetentionPolicy(max_age=2, spill_path=str(tmp_path / "spill.db"))
+    app = PaymentEngine(str(transactions_file), None, streaming=True, retention=retention, workers=workers)
+    app.process_transactions()
+    app.save_checkpoint(tmp_path / "engine.ckpt")
+    with open(transactions_file, "a") as appended:
+        appended.write("dispute,7,1\n")
+    resumed = PaymentEngine(str(transactions_file), None, streaming=True, retention=retention, workers=workers)
+    resumed.load_checkpoint(tmp_path / "engine.ckpt")
+    resumed.process_transactions()
+    assert resumed.clients[7].held == 50000
+    fresh = PaymentEngine(StringIO("type,client,txn,amount\ndeposit,7,2,10.0\ndispute,7,1\n"), None,
+                          streaming=True, retention=retention, workers=workers)
+    fresh.process_transactions()
+    assert fresh.clients[7].held == 0
+
+
+# Test#6: sharded workers share the memory budget
+def test_retention_for_shard():
+    policy = RetentionPolicy(max_age=5, max_bytes=3000, spill_path="spill.db")
+    assert policy.for_shard(1, 3) == RetentionPolicy(max_age=5, max_bytes=1000, spill_path="spill.db.1")
+    assert RetentionPolicy(max_age=5).for_shard(0, 2) == RetentionPolicy(max_age=5)
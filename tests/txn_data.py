@@ -0,0 +1,34 @@
+# Test data shared by the engine mode tests
+import random
+from io import StringIO
+from src.payment_engine import PaymentEngine
+
+CLIENT_DETAILS = "client,available,held,total,locked\n1,10.0,0.0,10.0,0\n2,20.0,2.0,22.0,1\n3,30.0,0.0,30.0,0\n"
+
+
+def random_transactions(rows, clients, seed=7):
+    """Mixed transactions CSV where disputes, resolves and chargebacks refer to earlier txns"""
+    rng = random.Random(seed)
+    lines = ["type,client,txn,amount"]
+    deposits = []
+    for txn_id in range(1, rows + 1):
+        roll = rng.random()
+        if roll < 0.5 or not deposits:
+            client_id = rng.randint(1, clients)
+            lines.append(f"deposit,{client_id},{txn_id},{rng.randint(1, 50000) / 100}")
+            deposits.append((client_id, txn_id))
+        elif roll < 0.8:
+            lines.append(f"withdraw,{rng.randint(1, clients)},{txn_id},{rng.randint(1, 50000) / 100}")
+        else:
+            client_id, disputed_txn = rng.choice(deposits)
+            txn_type = rng.choice(["dispute", "dispute", "resolve", "chargeback"])
+            lines.append(f"{txn_type},{client_id},{disputed_txn},")
+    return "\n".join(lines) + "\n"
+
+
+def engine_output(capsys, transactions, **options):
+    """Client accounts CSV written by an engine with given options"""
+    app = PaymentEngine(StringIO(transactions), StringIO(CLIENT_DETAILS), **options)
+    app.process_transactions()
+    app.write_results()
+    return capsys.readouterr().out